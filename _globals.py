@@ -136,6 +136,8 @@ DIRECTORIES
 ROOT = os.path.dirname(os.path.abspath(__file__))
 LOG_LOCATION = os.path.join(os.path.expanduser('~'), 'mturk_logs',
                             'webserver.log')
+DAEMON_LOG_LOCATION = os.path.join(os.path.expanduser('~'), 'mturk_logs',
+                                   'daemon.log')
 # The template location
 TEMPLATE_DIR = os.path.join(ROOT, 'static/resources/templates/')
 # The destination of experiments
@@ -223,6 +225,7 @@ DATA INPUT FORMATTING
 TRUE = '1'  # how True is represented in the database
 FALSE = '0'  # how False is represented in the database
 FLOAT_STR = '%.4g'  # how to format strings / integers
+RATING_STR = '%.6f'  # how to format the online image ratings
 
 
 """
@@ -237,6 +240,12 @@ WIN_TABLE = 'wins'
 HIT_TYPE_TABLE = 'hittypes'
 STATISTICS_TABLE = 'imagestats'
 TASK_JSON_TABLE = 'taskjson'
+BAN_TABLE = 'bans'
+TASK_INDEX_TABLE = 'taskindex'
+JOB_TABLE = 'jobs'
+# the row of the statistics table that holds the task completion time
+# aggregate.
+TASK_TIME_STATS_KEY = 'task_time'
 
 """
 COLUMN NAMES, BY FAMILY
@@ -266,6 +275,17 @@ WIN_FAMILIES = {'data': dict(max_versions=1)}
 HIT_TYPE_FAMILIES = {'metadata': dict(max_versions=1),
                      'status': dict(max_versions=1)}
 STATISTICS_FAMILIES = {'statistics': dict(max_versions=1)}
+BAN_FAMILIES = {'metadata': dict(max_versions=1)}
+TASK_INDEX_FAMILIES = {'metadata': dict(max_versions=1)}
+JOB_FAMILIES = {'job': dict(max_versions=1)}
+
+"""
+TASK INDEX PREFIXES
+"""
+# Row key prefixes for the task index, which tracks the tasks that are in
+# transient states by the time they entered them.
+AWAITING_SERVE_PREFIX = 'as'  # the task has a HIT and is awaiting serving
+PENDING_COMPLETION_PREFIX = 'pc'  # the task is being completed by a worker
 
 
 """
@@ -305,6 +325,9 @@ INACTIVE_FILTER = ("SingleColumnValueFilter ('metadata','is_active',=,"
 PENDING_COMPLETION_FILTER = ("SingleColumnValueFilter ('status', "
                              "'pending_completion', =, "
                              "'regexstring:^%s$')" % TRUE)
+# Finds workers that are currently banned
+IS_BANNED_FILTER = ("SingleColumnValueFilter ('status', 'is_banned', =, "
+                    "'regexstring:^%s$', true, true)" % TRUE)
 
 
 """
@@ -315,3 +338,13 @@ MONITORING_CARBON_SERVER = "52.70.225.116"
 MONITORING_CARBON_PORT = 8090
 MONITORING_SERVICE_NAME = "mturk"  # not clear what this is.
 MONITORING_SLEEP_INTERVAL = 60
+# the carbon protocol to use, 'plaintext' or 'pickle' (the pickle receiver
+# usually listens on a different port)
+MONITORING_CARBON_PROTOCOL = 'plaintext'
+# the most datapoints that are held while the carbon server is unreachable;
+# beyond this, the oldest are dropped
+MONITORING_BUFFER_SIZE = 100000
+# the timeout on connecting to and sending to the carbon server, in seconds
+MONITORING_SOCKET_TIMEOUT = 5
+# the longest wait between attempts to reconnect, in seconds
+MONITORING_MAX_BACKOFF = 300
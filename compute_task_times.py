@@ -1,15 +1,30 @@
+"""
+Prints summary statistics of the task completion times, from the aggregate
+that's maintained as tasks are accepted.
+
+If the aggregate is missing tasks that were accepted before it existed,
+run with --rebuild to recompute it from the task table (slow!).
+"""
+
 from conf import *
+from db import Get
+from db import Set
 import happybase
-import json
-import numpy as np
-
-conn = happybase.Connection(host=DATABASE_LOCATION)
+import sys
 
-table = conn.table(TASK_TABLE)
+pool = happybase.ConnectionPool(size=1, host=DATABASE_LOCATION)
 
-s = table.scan(columns=['metadata:worker_id'])
+if '--rebuild' in sys.argv:
+    Set(pool).rebuild_task_time_stats()
 
-times = [json.loads(table.row(x[0]).get('completion_data:response_json'))[
-             -1]['time_elapsed'] for x in s]
+task_time_stats = Get(pool).get_task_time_stats()
 
-print 'Mean time is: %.0f min %.0f s' % (divmod(np.mean(times)/1000, 60))
+if task_time_stats is None:
+    print 'No task times have been recorded.'
+else:
+    print 'Tasks: %i' % task_time_stats['count']
+    print 'Mean time is: %.0f min %.0f s' % divmod(task_time_stats['mean'], 60)
+    print 'Std. dev. is: %.0f min %.0f s' % divmod(task_time_stats['std'], 60)
+    for pct in ['p50', 'p90', 'p99']:
+        print '%s is: %.0f min %.0f s' % ((pct,) +
+                                          divmod(task_time_stats[pct], 60))
@@ -28,6 +28,11 @@ FORCE_DEMOGRAPHICS = False  # if true, will always collect demographics.
 FORCE_VALIDATION = False  # if true, will always validate demographics.
 DISABLE_BANNING = False  # obvi
 FORCE_HIT_TYPE_REGEN = False  # force hit type regeneration
+SIMULATED_BACKENDS = False  # if True, the webserver runs against in-memory
+# stand-ins for HBase and MTurk (testing/fakehbase.py, testing/mturk_sim.py)
+# that it seeds with synthetic images, e.g. for load tests (see
+# testing/loadgen.py); the daemon cannot share them, so USE_DAEMON must be
+# False
 
 # ensure that if testing, you're using the mturk sandbox.
 _MTURK_SANDBOX = _MTURK_SANDBOX or TESTING
@@ -248,6 +253,63 @@ ENABLE_BANNING = True  # whether or not to ban poor-performing workers.
 SAMPLE_COUNT_REFRESH_RATE = 4000000  # how many samples until you rebuild
 # sampler
 SAMPLING_LIMIT = 4  # how many times to sample in-order
+SLOW_REQUEST_THRESHOLD = 2000  # requests that take longer than this, in
+                               # milliseconds, are logged with a breakdown
+                               # of the time spent in each of their phases
+SLOW_RPC_THRESHOLD = 500  # database calls that take longer than this, in
+                          # milliseconds, are logged
+
+"""
+QUOTA RESET CONFIGURATION
+"""
+QUOTA_RESET_THREADS = 8  # the number of concurrent MTurk requests when
+                         # resetting quotas
+QUOTA_RESET_RATE = 10  # the maximum number of MTurk requests per second
+QUOTA_RESET_RETRIES = 3  # how many times to retry a worker before giving up
+QUOTA_RESET_REPORT_INTERVAL = 60  # seconds between progress reports
+DAILY_QUOTA_INACTIVE_DAYS = 2  # skip the daily quota reset for workers that
+                               # have been inactive for this many days
+WEEKLY_QUOTA_INACTIVE_DAYS = 8  # skip the weekly practice quota reset for
+                                # workers inactive for this many days
+
+"""
+ONLINE RATING CONFIGURATION
+"""
+# the image ratings are updated on every accepted task with the online
+# Bradley-Terry rule in ranking/online.py
+ONLINE_RATING_BETA = 25. / 6  # the performance noise of a single comparison
+ONLINE_RATING_INIT_MU = 25.  # the rating of an image that has not been rated
+ONLINE_RATING_INIT_VAR = (25. / 3) ** 2  # the variance of an unrated image
+ONLINE_RATING_KAPPA = 1e-4  # the smallest factor by which an image's
+                            # variance may shrink in a single comparison
+
+"""
+HOUSEKEEPING CONFIGURATION
+"""
+USE_DAEMON = False  # if True, the housekeeping (HIT top-ups, bans, unbans,
+                    # quota resets) is run by a separate daemon process (see
+                    # daemon.py), which the webserver hands jobs to through
+                    # the job table
+DAEMON_THREADS = 4  # the number of jobs the daemon runs at once
+DAEMON_POLL_INTERVAL = 1.  # seconds between polls of an empty job table
+DAEMON_CHECK_INTERVAL = 10 * 60  # seconds between checks that enough HITs
+                                 # and practices are posted
+DAEMON_MAX_ATTEMPTS = 5  # how many times a failing job is run before it is
+                         # dropped
+DAEMON_RETRY_DELAY = 60  # seconds before a failed job is run again
+
+"""
+NOTIFICATION CONFIGURATION
+"""
+NOTIFICATION_SOURCE = 'ops@kryto.me'  # the sender of notification emails
+NOTIFICATION_RECIPIENTS = ['kryptonlabs99@gmail.com']  # their recipients
+NOTIFICATION_DIGEST_WINDOW = 10 * 60  # the least time between two emails
+                                      # about the same event, in seconds;
+                                      # repeats are gathered into a digest
+NOTIFICATION_RATE = 1. / 60  # the long-run rate of emails, per second
+NOTIFICATION_BURST = 10  # the most emails that may be sent at once
+NOTIFICATION_MAX_DIGEST_EVENTS = 20  # the most events listed in a digest
+NOTIFICATION_MAX_KEYS = 100  # the most distinct events that may be pending
 
 
 # # convenience overrides
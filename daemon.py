@@ -1,137 +1,406 @@
 """
-Exports a class, the daemon, that is designed to run in parallel alongside the webserver. Essentially, this class
-corrals db.get, db.set, and mturk so that the data and activity among them are up to date and appropriate, both for
-our needs and for the needs of our workers.
+Exports a class, the daemon, that is designed to run as a separate process
+alongside the webserver. Essentially, this class corrals db.get, db.set, and
+mturk so that the data and activity among them are up to date and
+appropriate, both for our needs and for the needs of our workers, without
+competing with the webserver's requests.
 
 This amounts to:
 
-    - Banning workers
+    - Posting new tasks and practices
+    - Renewing practices that have expired
+    - Recording accepted tasks
+    - Banning workers (and soft-rejecting their tasks)
     - Unbanning workers
-    - Renewing tasks that have expired
-    - Building new practices
-    - Activating new images.
-
-This should be done continuously, as such the daemon simply runs between those tasks, iteratively. Importantly, some
-tasks that may seem as though they should be done "offline" or in parallel with the webserver should be done
-on-demand, to keep workers happy, such as granting the practice passed qualification.
-
-In sequence, the daemon:
-    - Checks for tasks that need validation (pseudo on-demand)
-        - Post-validation, check if this merit a bans.
-    - Check banned workers if it's time to unban them.
-    - Checks if new tasks are needed
-    - Checks if the practices need to be refreshed
-    - Checks if workers need to be unbanned
+    - Resetting the worker quotas
+    - Resetting the tasks that were served but not completed in time
 
-NOTES:
-    The Daemon also uses the database db connection and mturk connection objects, and thus should not be run in
-    parallel with the webserver in the true sense. Instead, it should be spawned as a separate thread, which share
-    memory in python because of the GIL.
+The periodic work is scheduled with APScheduler, and the work that follows
+from requests is handed over by the webserver through the job table, a
+durable queue in HBase (see JobTable), which the daemon polls. Because the
+queue is durable, jobs survive restarts of either process; a job is removed
+from the table only once it has run, so it is run at least once.
+
+The job functions themselves are in housekeeping.py. The webserver hands
+them over when USE_DAEMON is True; run the daemon with:
+
+    python daemon.py
 
-    To perform the "pseudo on-demand" validation of tasks, the Daemon also accepts a queue, from which it dequeues
-    task IDs to validate.
+Jobs may be retried, so they check what they have already done (e.g., a
+soft rejection is recorded before the worker is notified, and isn't recorded
+again), and those that post HITs raise jobs.PartialFailure when they fail
+part-way, so that only the remaining HITs are posted on a retry.
+
+NOTES:
+    To perform the "pseudo on-demand" validation of tasks, the Daemon also
+    exports validate_work(), which accepts or rejects a finished task from
+    the validation statistics stored with it.
 """
 
-# TODO: determine if it's possible to set the daemon's database access priority lower than the webservers.
+# TODO: determine if it's possible to set the daemon's database access
+# priority lower than the webservers.
 
+import json
+import struct
+import threading
+import time
+import uuid
+from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.executors.pool import ThreadPoolExecutor
+import housekeeping
+import jobs
+import logger
+import statemon
 from conf import *
-from itertools import cycle
-import Queue
 
 _log = logger.setup_logger(__name__)
 
-class Daemon():
+_n_jobs_run = statemon.define('n_jobs_run')
+_n_jobs_dropped = statemon.define('n_jobs_dropped')
+
+_HAS_NAME = "SingleColumnValueFilter('job', 'name', !=, 'binary:', true, true)"
+
+
+class _StoredJob(object):
     """
-    This class is designed to run as a daemon thread, which continuously manages MTurk and the database to do all the
-    housekeeping, issuing of new HITs, etc (see readme above). Any work that does not need to be done on-demand as a
-    result of web requests hitting the server.
+    A job read from the job table.
     """
-    def __init__(self, dbget, dbset, mt, work_queue):
+    def __init__(self, row_key, data, count=None):
+        self.row_key = row_key
+        self.name = data.get('job:name')
+        self.args = json.loads(data.get('job:args', '[]'))
+        self.counted = data.get('job:counted') == TRUE
+        self.keyed = 'job:keyed' in data
+        self.priority = int(row_key.split('_', 1)[0])
+        self.added = float(data.get('job:added', time.time()))
+        if count is None and 'job:n' in data:
+            count = int(data['job:n'])
+        self.count = count
+
+
+class JobTable(object):
+    """
+    A durable job queue, stored in the job table. Its row keys begin with the
+    priority of the job, so that a scan returns the most urgent first; those
+    of the jobs without a key then hold the time they were added, and those
+    of the jobs with a key hold the key, so that the jobs of the same key
+    share a row (and a count, kept in a counter). The jobs are the functions
+    listed in housekeeping.JOBS, called with JSON-serializable arguments.
+    """
+    def __init__(self, pool):
+        """
+        :param pool: A HappyBase connection pool.
+        :return: A JobTable instance.
+        """
+        self.pool = pool
+
+    def add(self, name, args=None, priority=jobs.PRIORITY_NORMAL, key=None,
+            count=None):
+        """
+        Adds a job, with the semantics of jobs.JobQueue.add().
+
+        :param name: The name of the job, in housekeeping.JOBS.
+        :param args: Its arguments, following mt, dbget and dbset.
+        :param priority: The priority of the job.
+        :param key: The key of the job, a string or a tuple of strings.
+        :param count: If given, the job is called with the keyword argument
+                      n, the sum of the counts of the coalesced jobs.
+        :return: None
+        """
+        data = {'job:name': name,
+                'job:args': json.dumps(args or []),
+                'job:added': repr(time.time())}
+        if count is not None:
+            data['job:counted'] = TRUE
+        with self.pool.connection() as conn:
+            table = conn.table(JOB_TABLE)
+            if key is None:
+                row_key = '%i_%017.6f_%s' % (priority, time.time(),
+                                             uuid.uuid4().hex[:8])
+                if count is not None:
+                    data['job:n'] = str(count)
+                table.put(row_key, data)
+                return
+            if isinstance(key, (tuple, list)):
+                key = ':'.join(str(k) for k in key)
+            row_key = '%i_key_%s' % (priority, key)
+            data['job:keyed'] = TRUE
+            table.put(row_key, data)
+            table.counter_inc(row_key, 'job:count', count or 1)
+
+    def take(self, limit, exclude=()):
+        """
+        Returns the most urgent jobs, without removing them.
+
+        :param limit: The most jobs to return.
+        :param exclude: The row keys of jobs to skip (i.e., those that are
+                        running).
+        :return: A list of _StoredJob.
+        """
+        taken = []
+        with self.pool.connection() as conn:
+            table = conn.table(JOB_TABLE)
+            # the rows left by done() have no name.
+            for row_key, data in table.scan(filter=_HAS_NAME,
+                                            limit=limit + len(exclude)):
+                if row_key in exclude:
+                    continue
+                count = None
+                if 'job:keyed' in data:
+                    count = table.counter_get(row_key, 'job:count')
+                    if count <= 0:
+                        continue
+                taken.append(_StoredJob(row_key, data, count))
+                if len(taken) >= limit:
+                    break
+        return taken
+
+    def done(self, job):
+        """
+        Removes a job that has run. If jobs of the same key were added while
+        it ran, its row is kept for them.
+        """
+        with self.pool.connection() as conn:
+            table = conn.table(JOB_TABLE)
+            if not job.keyed:
+                table.delete(job.row_key)
+                return
+            table.counter_inc(job.row_key, 'job:count', -job.count)
+            # a job of the same key may be added at any point, so the row is
+            # only deleted as of just before the decrement: the cells written
+            # by a later add() are newer, and survive the delete. (HBase's
+            # timestamps are in milliseconds, so those of an add() in the
+            # same millisecond are not newer, and must survive too.) What is
+            # left of the row, at most its count of zero, is reused by the
+            # next add() of the key, and is skipped by take().
+            count, timestamp = table.row(
+                job.row_key, columns=['job:count'],
+                include_timestamp=True)['job:count']
+            if struct.unpack('>q', count)[0] > 0:
+                # the new jobs are a fresh start.
+                table.counter_set(job.row_key, 'job:attempts', 0)
+                return
+            table.delete(job.row_key, timestamp=timestamp - 1)
+
+    def failed(self, job, n_done=0):
+        """
+        Records that a job failed, removing it once it has failed
+        DAEMON_MAX_ATTEMPTS times.
+
+        :param job: The _StoredJob.
+        :param n_done: How much of the count of the job was done before it
+                       failed (see jobs.PartialFailure); only the rest of it
+                       is run again.
+        :return: True if the job will be run again, False otherwise.
+        """
+        with self.pool.connection() as conn:
+            table = conn.table(JOB_TABLE)
+            if n_done:
+                job.count -= n_done
+                if job.keyed:
+                    table.counter_inc(job.row_key, 'job:count', -n_done)
+                else:
+                    table.put(job.row_key, {'job:n': str(job.count)})
+            if job.count is None or job.count > 0:
+                attempts = table.counter_inc(job.row_key, 'job:attempts')
+                if attempts < DAEMON_MAX_ATTEMPTS:
+                    return True
+        self.done(job)
+        return False
+
+    def discard(self, job):
+        """
+        Removes a job that cannot be run.
+        """
+        with self.pool.connection() as conn:
+            conn.table(JOB_TABLE).delete(job.row_key)
+
+
+class Daemon(object):
+    """
+    This class is designed to run as a separate process, which continuously
+    manages MTurk and the database to do all the housekeeping, issuing of new
+    HITs, etc (see readme above). Any work that does not need to be done
+    on-demand as a result of web requests hitting the server.
+    """
+    def __init__(self, dbget, dbset, mt, work_queue,
+                 n_threads=DAEMON_THREADS):
         """
         Instantiates the Daemon class.
 
         :param dbget: An instance of the database 'getter' class. (see db.py)
         :param dbset: An instance of the database 'setter' class. (see db.py)
         :param mt: An instance of the MTurk class. (see mturk.py)
-        :param work_queue: A multithreading Queue object, which stores all the 'important' jobs.
+        :param work_queue: A JobTable, from which the daemon runs the jobs
+                           handed over by the webserver.
+        :param n_threads: The number of jobs to run at once.
         :return: Instance object.
         """
         self.dbget = dbget
         self.dbset = dbset
         self.mt = mt
         self.q = work_queue
-        # the 'loop functions' are a sequence of functions to run, one after the other, each time loop() is called.
-        self.loop_functions = cycle([self.check_images, self.check_practices, self.check_images, self.check_unban])
-        # the termination attribute. If True, the thread exits. (set by "loop")
+        self.n_threads = n_threads
+        self.task_hit_type_id = None
+        self.practice_hit_type_id = None
+        # runs the jobs taken from the job table.
+        self.runner = jobs.JobQueue(n_threads, name='daemon')
+        # runs the periodic jobs, one at a time.
+        self.scheduler = BackgroundScheduler(
+            executors={'default': ThreadPoolExecutor(1)},
+            job_defaults={'misfire_grace_time': 999999, 'coalesce': True})
+        self._lock = threading.Lock()
+        self._running = set()  # the row keys of the jobs being run
+        self._retry_after = {}  # maps the row keys of failed jobs to times
+        # the termination attribute. If True, the loop exits.
         self.terminate = False
-        self.setup()
 
     def setup(self):
         """
-        This should be run once the Daemon is spun up. It ensures the following:
-            - There are enough images activated.
-            - There is an active HIT Type ID for normal tasks and practice tasks.
-            - There are enough HITs posted.
+        This should be run once the Daemon is spun up. It ensures the
+        following:
+            - There is an active HIT Type ID for normal tasks and practices.
             - There are enough practices posted, which are <= 1 week old.
+            - There are enough HITs posted.
+            - The ban and task indices and the job table exist.
 
         :return: None
         """
-        # TODO: Implement this!
-        raise NotImplementedError()
+        self.dbset.create_job_table()
+        self.task_hit_type_id, self.practice_hit_type_id = \
+            housekeeping.setup_hit_types(self.mt, self.dbget, self.dbset)
+        self.check_practices()
+        self.check_hits()
+        # note that this must be done *after* the tasks are generated, since
+        # it is the tasks that actually activate new images.
+        housekeeping.setup_indices(self.dbset)
 
-    def loop(self):
+    def start(self):
         """
-        This is the main function of the Daemon; it defines a loop that runs all the required tasks, and between each
-        checks to ensure that the queue is empty.
+        Schedules the periodic jobs and starts the threads that run jobs.
 
         :return: None
         """
-        # check if you should terminate
+        self.scheduler.add_job(self.check_hits, 'interval',
+                               seconds=DAEMON_CHECK_INTERVAL, id='check hits')
+        self.scheduler.add_job(self.check_practices, 'interval',
+                               seconds=DAEMON_CHECK_INTERVAL,
+                               id='check practices')
+        housekeeping.schedule_periodic(self.scheduler, self.mt, self.dbget,
+                                       self.dbset)
+        self.scheduler.start()
+        self.runner.start()
+
+    def loop(self):
+        """
+        Takes the most urgent jobs from the job table, up to the number of
+        idle threads, and queues them to be run.
+
+        :return: The number of jobs queued.
+        """
         if self.terminate:
-            return
+            return 0
+        now = time.time()
+        with self._lock:
+            idle = self.n_threads - len(self._running)
+            if idle <= 0:
+                return 0
+            for row_key, t in self._retry_after.items():
+                if t <= now:
+                    del self._retry_after[row_key]
+            exclude = self._running | set(self._retry_after)
+        taken = self.q.take(idle, exclude)
+        for job in taken:
+            with self._lock:
+                self._running.add(job.row_key)
+            self.runner.add(self._run_job, args=[job], priority=job.priority)
+        return len(taken)
+
+    def _run_job(self, job):
+        """
+        Runs a job from the job table, and removes it once it has run.
+        """
         try:
-            # attempt to fetch a task_id from the queue
-            task_id = self.q.get(False)
-            if task_id is None:
-                _log.info('Terminating!')
-                self.terminate = True
+            func = housekeeping.JOBS.get(job.name)
+            if func is None:
+                _log.error('Unknown job %s, dropping it', job.name)
+                self.q.discard(job)
+                return
+            kwargs = {'n': job.count} if job.counted else {}
+            try:
+                func(self.mt, self.dbget, self.dbset, *job.args, **kwargs)
+            except Exception as e:
+                _log.exception('Job %s failed: %s', job.name, e.message)
+                n_done = 0
+                if isinstance(e, jobs.PartialFailure):
+                    n_done = e.n_done
+                if self.q.failed(job, n_done):
+                    with self._lock:
+                        self._retry_after[job.row_key] = \
+                            time.time() + DAEMON_RETRY_DELAY
+                else:
+                    _log.error('Dropping job %s after %i attempts', job.name,
+                               DAEMON_MAX_ATTEMPTS)
+                    try:
+                        _n_jobs_dropped.increment()
+                    except Exception as e:
+                        _log.warn('Could not increment statemons: %s' %
+                                  e.message)
                 return
-            else:
-                _log.info('Validating task %s' % task_id)
-                self.validate_work(task_id)
-        except Queue.Empty:
-            self.loop_functions.next()
+            self.q.done(job)
+            try:
+                _n_jobs_run.increment()
+            except Exception as e:
+                _log.warn('Could not increment statemons: %s' % e.message)
+        finally:
+            with self._lock:
+                self._running.discard(job.row_key)
 
-    def check_hits(self):
+    def run(self):
         """
-        Checks that there are enough HITs posted.
+        Sets up and starts the daemon, and polls the job table until it is
+        stopped.
 
         :return: None
         """
-        _log.info('Checking all hits on MTurk')
-        # TODO: Implement this!
-        pass
+        self.setup()
+        self.start()
+        _log.info('Daemon started')
+        while not self.terminate:
+            if not self.loop():
+                time.sleep(DAEMON_POLL_INTERVAL)
 
-    def check_practices(self):
+    def stop(self):
         """
-        Checks that there are enough practices posted, and that they're not too old.
+        Stops the daemon, letting the jobs that are running finish.
 
         :return: None
         """
-        _log.info('Checking all practice tasks on MTurk')
-        # TODO: Implement this!
-        pass
+        _log.info('Terminating!')
+        self.terminate = True
+        self.scheduler.shutdown(wait=False)
+        self.runner.stop()
 
-    def check_ban(self):
+    def check_hits(self):
         """
-        Checks to see if any users need to be banned.
+        Checks that there are enough HITs posted.
 
-        NOTES:
-            Not currently used (implicit in the validate_work call)
+        :return: None
+        """
+        _log.info('Checking all hits on MTurk')
+        housekeeping.check_tasks(self.mt, self.dbget, self.dbset,
+                                 self.task_hit_type_id)
+
+    def check_practices(self):
+        """
+        Checks that there are enough practices posted, and that they're not
+        too old.
 
         :return: None
         """
-        pass
+        _log.info('Checking all practice tasks on MTurk')
+        housekeeping.check_practices(self.mt, self.dbget, self.dbset,
+                                     self.practice_hit_type_id)
 
     def check_unban(self):
         """
@@ -140,8 +409,7 @@ class Daemon():
         :return: None
         """
         _log.info('Checking if banned workers can be unbanned')
-        # TODO: Implement this!
-        pass
+        housekeeping.unban_workers(self.mt, self.dbget, self.dbset)
 
     def reset_quotas(self):
         """
@@ -150,27 +418,47 @@ class Daemon():
         :return: None
         """
         _log.info('Resetting all quotas')
-        # TODO: Implement this!
-        pass
+        housekeeping.reset_worker_quotas(self.mt, self.dbget, self.dbset)
 
-    def check_images(self):
+    def validate_work(self, task_id):
         """
-        Checks to see if more images need to be activated.
+        Validates a finished task from the statistics stored with it, and
+        accepts or rejects it accordingly.
 
+        :param task_id: The task ID, as a string.
         :return: None
         """
-        _log.info('Checking all images')
-        # TODO: Implement this!
-        pass
-
-    def validate_work(self, task_id=None):
-        """
-        Invokes the validation script on a task.
-
-        :return: None
-        """
-        is_acceptable = self.dbget.task_is_acceptable(task_id)
+        is_acceptable, reason = self.dbset.validate_task(task_id=task_id)
         if is_acceptable:
             self.dbset.accept_task(task_id)
         else:
-            self.dbset.reject_task(task_id)
+            self.dbset.reject_task(task_id, reason)
+
+
+if __name__ == '__main__':
+    import boto.mturk.connection
+    import happybase
+    import dbpool
+    import monitor
+    from db import Get
+    from db import Set
+    from mturk import MTurk
+    logger.config_root_logger(DAEMON_LOG_LOCATION)
+    pool = dbpool.InstrumentedPool(
+        happybase.ConnectionPool(size=DAEMON_THREADS + 2,
+                                 host=DATABASE_LOCATION))
+    mtconn = boto.mturk.connection.MTurkConnection(
+        aws_access_key_id=MTURK_ACCESS_ID,
+        aws_secret_access_key=MTURK_SECRET_KEY,
+        host=MTURK_HOST)
+    mt = MTurk(mtconn)
+    mt.setup_quals()
+    housekeeping.notifications.start()
+    if not LOCAL:
+        magent = monitor.MonitoringAgent()
+        magent.start()
+    daemon = Daemon(Get(pool), Set(pool), mt, JobTable(pool))
+    try:
+        daemon.run()
+    except KeyboardInterrupt:
+        daemon.stop()
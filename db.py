@@ -25,9 +25,12 @@ import time
 from collections import Counter
 import scipy.stats as stats
 import json
+import heapq
 from geoip import geolite2
 import statemon
 from sampler import OrderedSampler
+from sketch import LogBucketSketch
+from ranking.online import OnlineBradleyTerry
 
 """
 LOGGING
@@ -42,6 +45,18 @@ statemon.define("n_images_activated")
 statemon.define("n_workers_registered")
 statemon.define("demographics_valid", int)
 statemon.define("demographics_invalid", int)
+_ms_gen_task = statemon.define_timer("ms_gen_task")
+_ms_accept_task = statemon.define_timer("ms_accept_task")
+
+# the quantile sketch for task completion times, in seconds.
+_task_time_sketch = LogBucketSketch(min_value=1., max_value=2 * 60 * 60.,
+                                    growth=1.1)
+
+# the online rating updater for images.
+_image_rater = OnlineBradleyTerry(beta=ONLINE_RATING_BETA,
+                                  init_mu=ONLINE_RATING_INIT_MU,
+                                  init_var=ONLINE_RATING_INIT_VAR,
+                                  kappa=ONLINE_RATING_KAPPA)
 
 """
 PRIVATE METHODS
@@ -72,6 +87,45 @@ def _get_pair_key(image1, image2):
     return ','.join(pair_to_tuple(image1, image2))
 
 
+def _get_ban_index_key(expires, worker_id):
+    """
+    Returns the ban index row key for a given ban. Keys are prefixed with the
+    zero-padded expiration time, so that the bans that have expired can be
+    found with a single range scan.
+
+    :param expires: The time the ban expires, in seconds since the epoch.
+    :param worker_id: The worker ID, as a string.
+    :return: The ban index row key, as a string.
+    """
+    return '%012d_%s' % (int(expires), worker_id)
+
+
+def _get_task_index_key(prefix, timestamp, task_id):
+    """
+    Returns the task index row key for a task entering some state at a given
+    time. Keys are grouped by state and then ordered by time, so the tasks
+    that have been in a state for too long can be found with a single range
+    scan.
+
+    :param prefix: The task index prefix for the state, see _globals.py.
+    :param timestamp: The time the task entered the state, in seconds since
+                      the epoch.
+    :param task_id: The task ID, as a string.
+    :return: The task index row key, as a string.
+    """
+    return '%s_%012d_%s' % (prefix, int(timestamp), task_id)
+
+
+def _get_task_time_bucket_col(idx):
+    """
+    Returns the statistics table column for a bucket of the task time sketch.
+
+    :param idx: The bucket index, as an int.
+    :return: The column name, as a string.
+    """
+    return 'statistics:task_time_bucket_%03d' % idx
+
+
 def _timestamp_to_struct_time(timestamp):
     """
     Converts an HBase timestamp (msec since UNIX epoch) to a struct_time.
@@ -524,6 +578,34 @@ class Get(object):
             yield row_key
         return
 
+    def get_recently_active_workers(self, days):
+        """
+        Iterates over the workers that have been active within the last
+        number of days, according to stats:last_active. Workers for whom no
+        activity has been recorded are always included, since they may have
+        been active before activity was being tracked.
+
+        :param days: The number of days.
+        :return: An iterator over worker IDs.
+        """
+        since = time.time() - days * 24 * 60 * 60
+        row_filter = ("SingleColumnValueFilter ('stats', 'last_active', >=, "
+                      "'binary:%010d', false, true)" % int(since))
+        active = []
+        with self.pool.connection() as conn:
+            table = conn.table(WORKER_TABLE)
+            # status:is_banned is requested as well, since it's set for every
+            # worker upon registration and rows without any of the requested
+            # columns are not returned at all.
+            scanner = table.scan(columns=['status:is_banned',
+                                          'stats:last_active'],
+                                 filter=row_filter)
+            for row_key, _ in scanner:
+                active.append(row_key)
+        for row_key in active:
+            yield row_key
+        return
+
     def worker_need_practice(self, worker_id):
         """
         Indicates whether the worker should be served a practice or a real task.
@@ -584,6 +666,46 @@ class Get(object):
         return _get_timedelta_string(int(ban_time * 1000), timestamp), \
                ban_reason
 
+    def get_expired_bans(self, until=None):
+        """
+        Iterates over the ban index, returning every ban that expires on or
+        before a given time. Note that this only reads the ban index--the
+        entries may be stale if the worker has since been re-banned or
+        unbanned, so the worker's row remains authoritative.
+
+        :param until: The time, in seconds since the epoch, up to which bans
+                      should be returned. [def: now]
+        :return: An iterator over (index key, worker ID) tuples.
+        """
+        if until is None:
+            until = time.time()
+        expired = []
+        with self.pool.connection() as conn:
+            table = conn.table(BAN_TABLE)
+            scanner = table.scan(row_stop='%012d' % (int(until) + 1),
+                                 columns=['metadata:worker_id'])
+            for row_key, data in scanner:
+                expired.append((row_key, data.get('metadata:worker_id',
+                                                  row_key[13:])))
+        for item in expired:
+            yield item
+        return
+
+    def get_banned_workers(self):
+        """
+        Returns the IDs of all the workers in the ban index, irrespective of
+        when their ban expires.
+
+        :return: A list of worker IDs.
+        """
+        banned = set()
+        with self.pool.connection() as conn:
+            table = conn.table(BAN_TABLE)
+            scanner = table.scan(columns=['metadata:worker_id'])
+            for row_key, data in scanner:
+                banned.add(data.get('metadata:worker_id', row_key[13:]))
+        return list(banned)
+
     def worker_attempted_interval(self, worker_id):
         """
         Returns the number of tasks this worker has attempted this week.
@@ -658,34 +780,44 @@ class Get(object):
 
     def _get_mean_task_time(self):
         """
-        Computes the average task time for all accepted HITs.
+        Returns the average task time for all accepted HITs.
 
         :return: The mean task time, in seconds.
         """
-        times = []
-        with self.pool.connection() as conn:
-            table = conn.table(TASK_TABLE)
-            f1 = "SingleColumnValueFilter('metadata', 'is_practice', =, " \
-                 "'regexstring:^0$', true, true)"
-            f2 = "SingleColumnValueFilter('status', 'accepted', =, " \
-                 "'regexstring:^1$', " \
-                 "true, true)"
-            fstring = "%s AND %s" % (f1, f2)
-            s = table.scan(columns=['metadata:is_practice',
-                                    'status:accepted',
-                                    'completion_data:total_time'],
-                           filter=fstring,
-                           batch_size=10)
-            for n, (id, data) in enumerate(s):
-                cts = data.get('completion_data:total_time', None)
-                if cts is None:
-                    continue
-                times.append(float(cts) / 1000)
-        if not len(times):
+        task_time_stats = self.get_task_time_stats()
+        if task_time_stats is None:
             _log.info('No task time information found! Calculating it by rote')
             return DEF_NUM_IMAGES_PER_TASK / 3. * \
                    DEF_NUM_IMAGE_APPEARANCE_PER_TASK * 2 * 2014. / 1000
-        return np.mean(times)
+        return task_time_stats['mean']
+
+    def get_task_time_stats(self):
+        """
+        Returns summary statistics of the completion times of all accepted
+        HITs, from the aggregate maintained by Set.accept_task. Percentiles
+        are estimates, accurate to within ~5%.
+
+        :return: A dictionary with the count, mean, std, p50, p90 and p99 of
+                 the task times, in seconds. None if no task times have been
+                 recorded.
+        """
+        with self.pool.connection() as conn:
+            table = conn.table(STATISTICS_TABLE)
+            data = table.row(TASK_TIME_STATS_KEY)
+        count = counter_str_to_int(data.get('statistics:task_time_count', ''))
+        if not count:
+            return None
+        tot = counter_str_to_int(data.get('statistics:task_time_sum', ''))
+        tot_sq = counter_str_to_int(data.get('statistics:task_time_sum_sq',
+                                             ''))
+        mean = float(tot) / count / 1000
+        var = max(float(tot_sq) / count - mean ** 2, 0.)
+        counts = [counter_str_to_int(data.get(_get_task_time_bucket_col(i),
+                                              ''))
+                  for i in range(_task_time_sketch.n_buckets)]
+        p50, p90, p99 = _task_time_sketch.quantiles(counts, [.5, .9, .99])
+        return {'count': count, 'mean': mean, 'std': np.sqrt(var),
+                'p50': p50, 'p90': p90, 'p99': p99}
 
     def _get_task_time(self, task_id):
         """
@@ -740,11 +872,10 @@ class Get(object):
 
         :return: None
         """
-        row_filter = general_filter([('status', 'awaiting_hit_type'),
-                                     ('status', 'awaiting_serve')],
-                                    [FALSE, TRUE], key_only=False)
         with self.pool.connection() as conn:
-            scanner = conn.table(TASK_TABLE).scan(filter=row_filter)
+            scanner = conn.table(TASK_INDEX_TABLE).scan(
+                row_prefix=AWAITING_SERVE_PREFIX + '_',
+                filter='KeyOnlyFilter() AND FirstKeyOnlyFilter()')
             awaiting_serve_cnt = 0
             for _ in scanner:
                 awaiting_serve_cnt += 1
@@ -1195,6 +1326,60 @@ class Get(object):
             mon.val_mean_image_seen = rval
             return rval
 
+    def get_image_rating(self, image_id):
+        """
+        Returns the online rating of an image, which is updated each time a
+        task containing it is accepted.
+
+        :param image_id: The image ID, which is the row key.
+        :return: The rating and its standard deviation, as floats. Images
+                 that have not been rated have the prior rating.
+        """
+        with self.pool.connection() as conn:
+            table = conn.table(IMAGE_TABLE)
+            data = table.row(image_id, columns=['stats:rating',
+                                                'stats:rating_var'])
+        mu, var = _image_rater.default()
+        if 'stats:rating' in data and 'stats:rating_var' in data:
+            mu = float(data['stats:rating'])
+            var = float(data['stats:rating_var'])
+        return mu, np.sqrt(var)
+
+    def get_top_rated_images(self, k, n_sigma=0.,
+                             image_attributes=IMAGE_ATTRIBUTES):
+        """
+        Returns the k active images with the highest online ratings. Only the
+        rating columns are read.
+
+        :param k: The number of images to return.
+        :param n_sigma: Images are ordered by their rating minus this many
+                        standard deviations, so that a positive value favors
+                        the images whose ratings are more certain.
+        :param image_attributes: The image attributes that the images
+                                 considered must satisfy.
+        :return: A list of (image ID, rating, standard deviation) tuples, in
+                 descending order.
+        """
+        top = []
+        with self.pool.connection() as conn:
+            table = conn.table(IMAGE_TABLE)
+            scanner = table.scan(
+                columns=['stats:rating', 'stats:rating_var'],
+                filter=attribute_image_filter(image_attributes,
+                                              only_active=True))
+            for im_id, data in scanner:
+                if 'stats:rating' not in data:
+                    continue
+                mu = float(data['stats:rating'])
+                sigma = np.sqrt(float(data.get('stats:rating_var', 0)))
+                item = (mu - n_sigma * sigma, im_id, mu, sigma)
+                if len(top) < k:
+                    heapq.heappush(top, item)
+                elif item > top[0]:
+                    heapq.heapreplace(top, item)
+        return [(im_id, im_mu, im_sigma) for _, im_id, im_mu, im_sigma in
+                sorted(top, reverse=True)]
+
     def get_n_images(self, n, image_attributes=IMAGE_ATTRIBUTES):
         """
         Returns n images, randomly sampled from the set of images. This is
@@ -1247,6 +1432,7 @@ class Get(object):
         design = [tuple(images[i:i+t]) for i in range(0, len(images), t)]
         return design
 
+    @_ms_gen_task
     def gen_task(self, n, t, j, n_keep_blocks=None, n_reject_blocks=None,
                  prompt=None, practice=False, attribute=ATTRIBUTE,
                  random_segment_order=RANDOMIZE_SEGMENT_ORDER,
@@ -1556,6 +1742,36 @@ class Set(object):
             return REJECTED
         return UNKNOWN_STATUS
 
+    @staticmethod
+    def _move_task_index(conn, task_id, prefix=None, timestamp=None):
+        """
+        Moves a task to a new state in the task index, removing the entry for
+        its previous state.
+
+        :param conn: The HappyBase connection object.
+        :param task_id: The task ID, as a string.
+        :param prefix: The task index prefix for the new state (see
+                       _globals.py), or None if the task should no longer be
+                       indexed.
+        :param timestamp: The time the task entered the state, in seconds
+                          since the epoch. [def: now]
+        :return: None
+        """
+        table = conn.table(TASK_TABLE)
+        index_table = conn.table(TASK_INDEX_TABLE)
+        old_key = table.row(task_id, columns=['status:index_key']).get(
+            'status:index_key', '')
+        if old_key:
+            index_table.delete(old_key)
+        new_key = ''
+        if prefix is not None:
+            if timestamp is None:
+                timestamp = time.time()
+            new_key = _get_task_index_key(prefix, timestamp, task_id)
+            index_table.put(new_key, {'metadata:task_id': task_id})
+        if old_key or new_key:
+            table.put(task_id, {'status:index_key': new_key})
+
     def create_worker_table(self, clobber=False):
         """
         Creates a workers table, with names based on conf.
@@ -1655,6 +1871,46 @@ class Set(object):
             return _create_table(conn, STATISTICS_TABLE, STATISTICS_FAMILIES,
                                  clobber)
 
+    def create_task_index_table(self, clobber=False):
+        """
+        Creates a table for the task index, which tracks the tasks that are
+        awaiting serving or pending completion.
+
+        :param clobber: Boolean, if true will erase old task index table if it
+               exists. [def: False]
+        :return: True if table was created. False otherwise.
+        """
+        _log.info('Creating task index table')
+        with self.pool.connection() as conn:
+            return _create_table(conn, TASK_INDEX_TABLE, TASK_INDEX_FAMILIES,
+                                 clobber)
+
+    def create_ban_table(self, clobber=False):
+        """
+        Creates a table for the ban index, which is keyed by the time each ban
+        expires.
+
+        :param clobber: Boolean, if true will erase old ban table if it
+               exists. [def: False]
+        :return: True if table was created. False otherwise.
+        """
+        _log.info('Creating ban table')
+        with self.pool.connection() as conn:
+            return _create_table(conn, BAN_TABLE, BAN_FAMILIES, clobber)
+
+    def create_job_table(self, clobber=False):
+        """
+        Creates a table for the durable job queue, which the webserver adds
+        housekeeping jobs to and the daemon runs them from.
+
+        :param clobber: Boolean, if true will erase old job table if it
+               exists. [def: False]
+        :return: True if table was created. False otherwise.
+        """
+        _log.info('Creating job table')
+        with self.pool.connection() as conn:
+            return _create_table(conn, JOB_TABLE, JOB_FAMILIES, clobber)
+
     def force_regen_tables(self):
         """
         Forcibly rebuilds all tables.
@@ -1671,12 +1927,15 @@ class Set(object):
         succ = succ and self.create_win_table(clobber=True)
         succ = succ and self.create_task_type_table(clobber=True)
         succ = succ and self.create_statistics_table(clobber=True)
+        succ = succ and self.create_ban_table(clobber=True)
+        succ = succ and self.create_task_index_table(clobber=True)
+        succ = succ and self.create_job_table(clobber=True)
         return succ
 
     def wipe_database_except_images(self, save_workers=False,
                                     save_pairs=False, save_tasks=False,
                                     save_wins=False, save_task_types=False,
-                                    save_stats=False):
+                                    save_stats=False, save_bans=False):
         """
         Wipes all data from the database, except for persistent image data.
         Note that all information that pertains to image usage is wiped as
@@ -1685,10 +1944,11 @@ class Set(object):
 
         :param save_workers: Don't change the worker table.
         :param save_pairs: Don't change the pairs table.
-        :param save_tasks: Don't change the tasks table.
+        :param save_tasks: Don't change the tasks table (or the task index).
         :param save_wins: Don't change the wins table.
         :param save_task_types: Don't change the task_types table.
         :param save_stats: Don't change the statistics table.
+        :param save_bans: Don't change the ban table.
         :return: None
         """
         _log.warn('Wiping all tables but images')
@@ -1703,6 +1963,7 @@ class Set(object):
             _log.info('Preserving pairs table')
         if not save_tasks:
             self.create_task_table(clobber=True)
+            self.create_task_index_table(clobber=True)
         else:
             _log.info('Preserving tasks table')
         if not save_wins:
@@ -1717,6 +1978,10 @@ class Set(object):
             self.create_statistics_table(clobber=True)
         else:
             _log.info('Preserving statistics table')
+        if not save_bans:
+            self.create_ban_table(clobber=True)
+        else:
+            _log.info('Preserving ban table')
         # now, for any active image, we need to:
         #   - delete all but the metadata
         #   - set is_active to false
@@ -1921,14 +2186,16 @@ class Set(object):
     def indicate_task_has_hit_type(self, task_id):
         """
         Sets status:awaiting_hit_type parameter of the task, indicating that
-        it has been added to a HIT type
+        it has been added to a HIT type, and adds it to the task index as
+        awaiting serving.
 
         :param task_id: The task ID, as a string.
         :return: None
         """
         with self.pool.connection() as conn:
             table = conn.table(TASK_TABLE)
-            table.put(task_id, {'status:awaiting_hit_type': TRUE})
+            table.put(task_id, {'status:awaiting_hit_type': FALSE})
+            self._move_task_index(conn, task_id, AWAITING_SERVE_PREFIX)
 
     def set_task_html(self, task_id, html):
         """
@@ -1966,6 +2233,18 @@ class Set(object):
         except Exception as e:
             _log.warn('Could not increment statemon')
 
+    def worker_active(self, worker_id):
+        """
+        Records that a worker has been active, which allows periodic jobs to
+        skip workers that have not been around for a while.
+
+        :param worker_id: A string, the worker ID.
+        :return: None.
+        """
+        with self.pool.connection() as conn:
+            table = conn.table(WORKER_TABLE)
+            table.put(worker_id, {'stats:last_active': '%010d' % time.time()})
+
     def register_images(self, image_ids, image_urls, attributes=[]):
         """
         Registers one or more images to the database.
@@ -2130,6 +2409,16 @@ class Set(object):
                                  'metadata:payment': payment,
                                  'status:pending_completion': TRUE,
                                  'status:awaiting_serve': FALSE}))
+            self._move_task_index(conn, task_id, PENDING_COMPLETION_PREFIX)
+            # this is recorded in the background, so the task may have been
+            # submitted in the meantime; if so, it's no longer pending. This
+            # is checked after the writes so that it holds even if they were
+            # interleaved with those of task_finished_from_json.
+            if table.row(task_id, columns=['completion_data:total_time']):
+                _log.info('Task %s was finished before its serve was '
+                          'recorded' % task_id)
+                table.put(task_id, {'status:pending_completion': FALSE})
+                self._move_task_index(conn, task_id)
         with self.pool.connection() as conn:
             table = conn.table(WORKER_TABLE)
             # increment the number of incomplete trials for this worker.
@@ -2198,6 +2487,8 @@ class Set(object):
                     contradiction_dict[global_tup_idx] = (
                         contradiction_dict.get(global_tup_idx, []) +
                                                           [taskwide_im_idx])
+        # the total time is the elapsed time at the last trial.
+        total_time = max([x.get('time_elapsed', 0) for x in resp_json])
         # compute the number unanswered
         num_unanswered = sum([x == -1 for x in choices])
         # compute the number of contradictory statements
@@ -2235,6 +2526,7 @@ class Set(object):
                       'completion_data:choices': dumps(choices),
                       'completion_data:action': dumps(actions),
                       'completion_data:reaction_times': dumps(rts),
+                      'completion_data:total_time': '%i' % total_time,
                       'metadata:hit_type_id': str(hit_type_id),
                       'validation_statistics:prob_random': '%.4f' % p_value,
                       'validation_statistics:frac_contradictions':
@@ -2252,6 +2544,11 @@ class Set(object):
             except Exception as e:
                 _log.critical('COULD NOT STORE TASK DATA FOR %s: %s' % (task_id,
                                                                         e))
+            try:
+                self._move_task_index(conn, task_id)
+            except Exception as e:
+                _log.warn('Could not remove task %s from the task index: %s',
+                          task_id, e)
             if user_agent is not None:
                 table.put(task_id, _conv_dict_vals(
                                     {'user_agent:browser': user_agent.browser,
@@ -2505,11 +2802,19 @@ class Set(object):
         _log.info('Nothing needs to be logged for a practice failure at this '
                   'time.')
 
+    @_ms_accept_task
     def accept_task(self, task_id):
         """
         Accepts a completed task, updating the worker, task, image, and win
         tables.
 
+        NOTES:
+            The task is only marked as accepted once all the tables have been
+            updated, and the updates that are done are recorded as they go
+            (in status:accept_progress), so if this fails part-way, calling
+            it again makes the remaining updates without repeating the
+            others.
+
         :param task_id: The ID of the task to reject.
         :return: None.
         """
@@ -2524,38 +2829,46 @@ class Set(object):
             #              'accepted, but proceeding anyway')
             pass
         with self.pool.connection() as conn:
-            table = conn.table(TASK_TABLE)
+            task_table = conn.table(TASK_TABLE)
             stats_table = conn.table(STATISTICS_TABLE)
-            task_data = table.row(task_id)
-            table.put(task_id, {'status:pending_evaluation': FALSE,
-                                'status:accepted': TRUE})
+            task_data = task_table.row(task_id)
+            progress = task_data.get('status:accept_progress', '').split(',')
+
+            def record_progress(step):
+                progress.append(step)
+                task_table.put(task_id, {'status:accept_progress':
+                                         ','.join(filter(None, progress))})
+
             img_tuples = loads(task_data.get('metadata:tuples', None))
             img_tuple_types = loads(task_data.get('metadata:tuple_types', None))
             worker_id = task_data.get('metadata:worker_id', None)
             attribute = task_data.get('metadata:attribute', None)
             image_attributes = loads(task_data.get('metadata:attributes', None))
+            choices = loads(task_data.get('completion_data:choices', None))
+            rts = loads(task_data.get('completion_data:reaction_times', None))
             # update worker table
-            worker_id = task_data.get('metadata:worker_id', None)
             if worker_id is None:
                 _log.warning('No associated worker for task %s' % task_id)
-            table = conn.table(WORKER_TABLE)
-            # decrement pending evaluation count
-            table.counter_dec(worker_id, 'stats:num_pending_eval')
-            # increment accepted count
-            table.counter_inc(worker_id, 'stats:num_accepted')
-            table.counter_inc(worker_id, 'stats:num_accepted_interval')
+            if 'worker' not in progress:
+                table = conn.table(WORKER_TABLE)
+                # decrement pending evaluation count
+                table.counter_dec(worker_id, 'stats:num_pending_eval')
+                # increment accepted count
+                table.counter_inc(worker_id, 'stats:num_accepted')
+                table.counter_inc(worker_id, 'stats:num_accepted_interval')
+                record_progress('worker')
             # update images table
-            table = conn.table(IMAGE_TABLE)
-            # unfortunately, happybase does not support batch incrementation
-            # (arg!)
-            choices = loads(task_data.get('completion_data:choices', None))
-            rts = loads(task_data.get('completion_data:reaction_times', None))
-            for img, rt in zip(choices, rts):
-                if img == -1:
-                    continue
-                if rt < MIN_TRIAL_RT:
-                    continue
-                table.counter_inc(img, 'stats:num_wins')
+            if 'images' not in progress:
+                table = conn.table(IMAGE_TABLE)
+                # unfortunately, happybase does not support batch
+                # incrementation (arg!)
+                for img, rt in zip(choices, rts):
+                    if img == -1:
+                        continue
+                    if rt < MIN_TRIAL_RT:
+                        continue
+                    table.counter_inc(img, 'stats:num_wins')
+                record_progress('images')
             # update the win matrix table
             table = conn.table(WIN_TABLE)
             b = table.batch()
@@ -2563,6 +2876,7 @@ class Set(object):
             # table -- as a batch this will store all the ids that we have to
             # increment (which cant be incremented in a batch)
             ids_to_inc = []
+            outcomes = []
             for ch, rt, tup, tuptype in zip(choices, rts, img_tuples,
                                            img_tuple_types):
                 if ch == -1:
@@ -2575,6 +2889,7 @@ class Set(object):
                             # compute the id for this win element
                             cid = ch + ',' + img
                             ids_to_inc.append(cid)
+                            outcomes.append((ch, img))
                             if ALLOW_MULTIPAIRS:
                                 dct = {'data:winner_id': ch,
                                        'data:loser_id': img}
@@ -2588,6 +2903,7 @@ class Set(object):
                         else:
                             cid = img + ',' + ch
                             ids_to_inc.append(cid)
+                            outcomes.append((img, ch))
                             if ALLOW_MULTIPAIRS:
                                 dct = {'data:winner_id': img,
                                        'data:loser_id': ch}
@@ -2598,13 +2914,132 @@ class Set(object):
                                        'data:worker_id': worker_id,
                                        'data:attribute': attribute}
                             b.put(cid, _conv_dict_vals(dct))
-            b.send()
-            for cid in ids_to_inc:
-                table.counter_inc(cid, 'data:win_count')
-            # we increment the global number of samples count here.
-            skey = _get_stats_key(image_attributes)
-            stats_table.counter_inc(skey, 'statistics:n_samples',
-                                    len(ids_to_inc))
+            if 'wins' not in progress:
+                b.send()
+                for cid in ids_to_inc:
+                    table.counter_inc(cid, 'data:win_count')
+                record_progress('wins')
+            if 'ratings' not in progress:
+                self._update_image_ratings(conn.table(IMAGE_TABLE), outcomes)
+                record_progress('ratings')
+            if 'stats' not in progress:
+                # we increment the global number of samples count here.
+                skey = _get_stats_key(image_attributes)
+                stats_table.counter_inc(skey, 'statistics:n_samples',
+                                        len(ids_to_inc))
+                total_time = task_data.get('completion_data:total_time', None)
+                if total_time and (task_data.get('metadata:is_practice',
+                                                 FALSE) != TRUE):
+                    self._record_task_time(stats_table, float(total_time))
+                record_progress('stats')
+            task_table.put(task_id, {'status:pending_evaluation': FALSE,
+                                     'status:accepted': TRUE})
+
+    @staticmethod
+    def _update_image_ratings(table, outcomes):
+        """
+        Applies the online rating update to the images in a set of
+        comparisons, reading their current ratings in a single request and
+        writing them back in a single batch.
+
+        NOTES:
+            The read and write are not atomic, so concurrent acceptances of
+            tasks that share an image may lose one of the updates. The
+            ratings are approximate in any case; rank() is the exact
+            recompute.
+
+        :param table: The HappyBase image table object.
+        :param outcomes: A list of (winner ID, loser ID) tuples, in the
+                         order in which they were decided.
+        :return: None
+        """
+        if not outcomes:
+            return
+        images = list(set([i for outcome in outcomes for i in outcome]))
+        ratings = {}
+        for im_id, data in table.rows(images, columns=['stats:rating',
+                                                       'stats:rating_var']):
+            if 'stats:rating' in data and 'stats:rating_var' in data:
+                ratings[im_id] = (float(data['stats:rating']),
+                                  float(data['stats:rating_var']))
+        _image_rater.update(ratings, outcomes)
+        b = table.batch()
+        for im_id, (mu, var) in ratings.iteritems():
+            b.put(im_id, {'stats:rating': RATING_STR % mu,
+                          'stats:rating_var': RATING_STR % var})
+        b.send()
+
+    @staticmethod
+    def _record_task_time(stats_table, total_time):
+        """
+        Adds a task time to the task time aggregate, which holds the count,
+        sum and sum of squares of the task times as well as a quantile sketch
+        of them, all as counters.
+
+        :param stats_table: The HappyBase statistics table object.
+        :param total_time: The task time, in milliseconds.
+        :return: None
+        """
+        secs = total_time / 1000.
+        stats_table.counter_inc(TASK_TIME_STATS_KEY,
+                                'statistics:task_time_count')
+        stats_table.counter_inc(TASK_TIME_STATS_KEY,
+                                'statistics:task_time_sum', int(total_time))
+        # squares are kept in seconds, so as not to overflow the counter.
+        stats_table.counter_inc(TASK_TIME_STATS_KEY,
+                                'statistics:task_time_sum_sq',
+                                int(round(secs ** 2)))
+        stats_table.counter_inc(TASK_TIME_STATS_KEY, _get_task_time_bucket_col(
+            _task_time_sketch.bucket(secs)))
+
+    def rebuild_task_time_stats(self):
+        """
+        Rebuilds the task time aggregate from the task table, which is
+        required for tasks that were accepted before the aggregate existed.
+        This scans all accepted tasks, so it should be run sparingly.
+
+        :return: The number of task times found.
+        """
+        _log.info('Rebuilding the task time aggregate')
+        times = []
+        with self.pool.connection() as conn:
+            table = conn.table(TASK_TABLE)
+            f1 = "SingleColumnValueFilter('metadata', 'is_practice', =, " \
+                 "'regexstring:^0$', true, true)"
+            f2 = "SingleColumnValueFilter('status', 'accepted', =, " \
+                 "'regexstring:^1$', " \
+                 "true, true)"
+            fstring = "%s AND %s" % (f1, f2)
+            s = table.scan(columns=['metadata:is_practice',
+                                    'status:accepted',
+                                    'completion_data:total_time'],
+                           filter=fstring,
+                           batch_size=100)
+            for n, (id, data) in enumerate(s):
+                cts = data.get('completion_data:total_time', None)
+                if cts is None:
+                    continue
+                times.append(float(cts))
+            times = np.array(times)
+            secs = times / 1000.
+            counts = np.zeros(_task_time_sketch.n_buckets, dtype=int)
+            for sec in secs:
+                counts[_task_time_sketch.bucket(sec)] += 1
+            stats_table = conn.table(STATISTICS_TABLE)
+            stats_table.counter_set(TASK_TIME_STATS_KEY,
+                                    'statistics:task_time_count', len(times))
+            stats_table.counter_set(TASK_TIME_STATS_KEY,
+                                    'statistics:task_time_sum',
+                                    int(np.sum(times.astype(int))))
+            stats_table.counter_set(TASK_TIME_STATS_KEY,
+                                    'statistics:task_time_sum_sq',
+                                    int(np.sum(np.round(secs ** 2))))
+            for idx, count in enumerate(counts):
+                stats_table.counter_set(TASK_TIME_STATS_KEY,
+                                        _get_task_time_bucket_col(idx),
+                                        int(count))
+        _log.info('Found %i task times' % len(times))
+        return len(times)
 
     def reject_task(self, task_id, reason=None):
         """
@@ -2667,18 +3102,103 @@ class Set(object):
         :param reason: The reason for the ban.
         :return: None.
         """
+        index_key = _get_ban_index_key(time.time() + duration, worker_id)
         with self.pool.connection() as conn:
             table = conn.table(WORKER_TABLE)
+            old_key = table.row(worker_id, columns=['status:ban_index_key']
+                                ).get('status:ban_index_key', '')
             table.put(worker_id,
                       _conv_dict_vals({'status:is_banned': TRUE,
                                        'status:ban_duration': duration,
                                        'status:ban_reason': reason}))
+            table.put(worker_id, {'status:ban_index_key': index_key})
             table.counter_set(worker_id,
                               'stats:num_accepted_interval',
                               value=0)
             table.counter_set(worker_id,
                               'stats:num_rejected_interval',
                               value=0)
+            table = conn.table(BAN_TABLE)
+            if old_key and old_key != index_key:
+                table.delete(old_key)
+            table.put(index_key, {'metadata:worker_id': worker_id,
+                                  'metadata:expires': index_key[:12]})
+
+    def remove_ban_index(self, index_key):
+        """
+        Removes an entry from the ban index.
+
+        :param index_key: The ban index row key, as a string.
+        :return: None.
+        """
+        with self.pool.connection() as conn:
+            table = conn.table(BAN_TABLE)
+            table.delete(index_key)
+
+    def reindex_ban(self, index_key, worker_id, expires_in):
+        """
+        Moves an entry of the ban index to the time at which the ban actually
+        expires. The key given to a ban is truncated to whole seconds and
+        computed before the ban is recorded, so the ban may outlive its entry.
+        If the entry is stale (the worker has since been re-banned), it's
+        simply removed.
+
+        :param index_key: The ban index row key, as a string.
+        :param worker_id: The worker ID, as a string.
+        :param expires_in: The time until the ban expires, in seconds.
+        :return: None.
+        """
+        new_key = _get_ban_index_key(time.time() + expires_in + 1, worker_id)
+        with self.pool.connection() as conn:
+            table = conn.table(WORKER_TABLE)
+            cur_key = table.row(worker_id, columns=['status:ban_index_key']
+                                ).get('status:ban_index_key', '')
+            if cur_key == index_key:
+                table.put(worker_id, {'status:ban_index_key': new_key})
+                table = conn.table(BAN_TABLE)
+                table.put(new_key, {'metadata:worker_id': worker_id,
+                                    'metadata:expires': new_key[:12]})
+            else:
+                table = conn.table(BAN_TABLE)
+            if new_key != index_key:
+                table.delete(index_key)
+
+    def rebuild_ban_index(self):
+        """
+        Rebuilds the ban index from the worker table, which is required for
+        bans that were issued before the index existed. This scans the entire
+        worker table, so it should only be run when the ban table is created.
+
+        :return: The number of bans indexed.
+        """
+        _log.info('Rebuilding the ban index')
+        to_index = []
+        with self.pool.connection() as conn:
+            table = conn.table(WORKER_TABLE)
+            scanner = table.scan(columns=['status:is_banned',
+                                          'status:ban_duration'],
+                                 filter=IS_BANNED_FILTER,
+                                 include_timestamp=True)
+            for worker_id, data in scanner:
+                ban_data = data.get('status:is_banned', (FALSE, 0))
+                if ban_data[0] != TRUE:
+                    continue
+                ban_dur = float(data.get('status:ban_duration', ('0', 0))[0])
+                expires = float(ban_data[1]) / 1000 + ban_dur
+                to_index.append((worker_id,
+                                 _get_ban_index_key(expires, worker_id)))
+            b = table.batch()
+            for worker_id, index_key in to_index:
+                b.put(worker_id, {'status:ban_index_key': index_key})
+            b.send()
+            table = conn.table(BAN_TABLE)
+            b = table.batch()
+            for worker_id, index_key in to_index:
+                b.put(index_key, {'metadata:worker_id': worker_id,
+                                  'metadata:expires': index_key[:12]})
+            b.send()
+        _log.info('Indexed %i bans' % len(to_index))
+        return len(to_index)
 
     def worker_ban_expires_in(self, worker_id):
         """
@@ -2702,7 +3222,11 @@ class Set(object):
             if (cur_date - ban_date) > ban_dur:
                 table.put(worker_id, {'status:is_banned': FALSE,
                                       'status:ban_length': '0',
-                                      'status:ban_duration': '0'})
+                                      'status:ban_duration': '0',
+                                      'status:ban_index_key': ''})
+                index_key = data.get('status:ban_index_key', ('', 0))[0]
+                if index_key:
+                    conn.table(BAN_TABLE).delete(index_key)
                 return 0
             else:
                 return ban_dur - (cur_date - ban_date)
@@ -2714,20 +3238,28 @@ class Set(object):
 
         :return: None
         """
+        cur_date = time.time()
+        row_start = PENDING_COMPLETION_PREFIX + '_'
+        row_stop = row_start + '%012d' % (cur_date - TASK_COMPLETION_TIMEOUT)
         with self.pool.connection() as conn:
             table = conn.table(TASK_TABLE)
+            index_table = conn.table(TASK_INDEX_TABLE)
+            # the index only contains tasks that are in-flight, so this range
+            # scan is bounded regardless of the size of the task table.
+            index_keys = dict()
+            scanner = index_table.scan(row_start=row_start, row_stop=row_stop,
+                                       columns=['metadata:task_id'])
+            for index_key, data in scanner:
+                index_keys[data.get('metadata:task_id',
+                                    index_key[16:])] = index_key
             to_reset = []  # a list of task IDs to reset.
-            scanner = table.scan(columns=['status:pending_completion'],
-                                 filter=PENDING_COMPLETION_FILTER,
-                                 include_timestamp=True)
-            for row_key, rowData in scanner:
-                start_timestamp = rowData.get('status:pending_completion',
-                                              (FALSE, '0'))[1]
-                start_date = time.mktime(time.localtime(float(
-                    start_timestamp)/1000))
-                cur_date = time.mktime(time.localtime())
-                if (cur_date - start_date) > TASK_COMPLETION_TIMEOUT:
-                    to_reset.append(row_key)
+            columns = ['status:index_key', 'status:pending_completion']
+            for task_id, data in table.rows(index_keys.keys(),
+                                            columns=columns):
+                if (data.get('status:pending_completion', FALSE) == TRUE and
+                        data.get('status:index_key', '') ==
+                        index_keys[task_id]):
+                    to_reset.append(task_id)
             # Now, un-serve all those tasks
             b = table.batch()
             for task_id in to_reset:
@@ -2737,10 +3269,68 @@ class Set(object):
                                        'metadata:hit_id': '',
                                        'metadata:payment': '',
                                        'status:pending_completion': FALSE,
-                                       'status:awaiting_serve': TRUE}))
+                                       'status:awaiting_serve': TRUE,
+                                       'status:index_key': _get_task_index_key(
+                                           AWAITING_SERVE_PREFIX, cur_date,
+                                           task_id)}))
+            b.send()
+            # stale entries are dropped along with the ones that were reset.
+            b = index_table.batch()
+            for index_key in index_keys.itervalues():
+                b.delete(index_key)
+            for task_id in to_reset:
+                b.put(_get_task_index_key(AWAITING_SERVE_PREFIX, cur_date,
+                                          task_id),
+                      {'metadata:task_id': task_id})
             b.send()
         _log.info('Found %i incomplete tasks to be reset.' % len(to_reset))
 
+    def rebuild_task_index(self):
+        """
+        Rebuilds the task index from the task table, which is required for
+        tasks that were given a HIT type or served before the index existed.
+        This scans the entire task table, so it should only be run when the
+        task index table is created.
+
+        :return: The number of tasks indexed.
+        """
+        _log.info('Rebuilding the task index')
+        to_index = []
+        with self.pool.connection() as conn:
+            table = conn.table(TASK_TABLE)
+            scanner = table.scan(columns=['status:pending_completion',
+                                          'status:awaiting_serve',
+                                          'status:awaiting_hit_type'],
+                                 filter=' OR '.join(
+                                     [PENDING_COMPLETION_FILTER,
+                                      AWAITING_SERVE_FILTER]),
+                                 include_timestamp=True)
+            for task_id, data in scanner:
+                pc_data = data.get('status:pending_completion', (FALSE, 0))
+                as_data = data.get('status:awaiting_serve', (FALSE, 0))
+                ht_data = data.get('status:awaiting_hit_type', (TRUE, 0))
+                if pc_data[0] == TRUE:
+                    prefix, timestamp = PENDING_COMPLETION_PREFIX, pc_data[1]
+                elif as_data[0] == TRUE and ht_data[0] == FALSE:
+                    # the task entered the state when it was given a HIT type
+                    # or, if it was since reset, when it was un-served.
+                    prefix = AWAITING_SERVE_PREFIX
+                    timestamp = max(as_data[1], ht_data[1])
+                else:
+                    continue
+                to_index.append((task_id, _get_task_index_key(
+                    prefix, float(timestamp) / 1000, task_id)))
+            b = table.batch()
+            for task_id, index_key in to_index:
+                b.put(task_id, {'status:index_key': index_key})
+            b.send()
+            b = conn.table(TASK_INDEX_TABLE).batch()
+            for task_id, index_key in to_index:
+                b.put(index_key, {'metadata:task_id': task_id})
+            b.send()
+        _log.info('Indexed %i tasks' % len(to_index))
+        return len(to_index)
+
     def deactivate_images(self, image_ids):
         """
         Deactivates a list of images.
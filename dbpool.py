@@ -0,0 +1,305 @@
+"""
+Exports an instrumented wrapper around a HappyBase connection pool, which
+accounts for every call made to the database through it.
+
+    pool = InstrumentedPool(happybase.ConnectionPool(size=8, host=...))
+
+is used exactly as the pool it wraps; the tables it hands out count and time
+each of their calls (row, scan, put, counter_inc, ..., and the send of a
+batch), and the time spent waiting for a connection from the pool is timed
+as well. The totals are exported through statemon timers:
+
+    ms_pool_checkout          - the time waiting for a connection
+    ms_rpc_<table>_<method>   - the time of each call, by table and method
+
+Calls are attributed to the request or job during which they are made,
+which is set with the attribute() context manager or the attributed()
+decorator. The number of calls made by each is counted by the statemon
+counter n_rpc_<name>, and the calls of the current one are summarized by
+current_scope() (which the slow-request log of the phases module includes).
+Calls that take longer than SLOW_RPC_THRESHOLD milliseconds are logged.
+
+A scan is counted as a single call, timed from the call until its results
+are exhausted (or it is abandoned).
+"""
+
+import contextlib
+import functools
+import json
+import re
+import threading
+import time
+import logger
+import statemon
+from conf import *
+
+_log = logger.setup_logger(__name__)
+
+_ms_pool_checkout = statemon.define_timer('ms_pool_checkout')
+
+# the Table methods that call the database.
+_RPC_METHODS = frozenset(['row', 'rows', 'cells', 'scan', 'put', 'delete',
+                          'counter_get', 'counter_set', 'counter_inc',
+                          'counter_dec', 'families', 'regions'])
+
+# maps (table, method) to its timer, and operation names to their counters.
+_timers = {}
+_counters = {}
+_define_lock = threading.Lock()
+
+# holds the scope of the request or job being run by this thread.
+_local = threading.local()
+
+
+def _metric_name(*parts):
+    """
+    Joins parts of a statemon variable name, replacing the characters that
+    cannot appear in a carbon path.
+    """
+    return re.sub(r'[^A-Za-z0-9_]', '_', '_'.join(parts))
+
+
+def _rpc_timer(table, method):
+    try:
+        return _timers[(table, method)]
+    except KeyError:
+        with _define_lock:
+            if (table, method) not in _timers:
+                _timers[(table, method)] = statemon.state.define_histogram(
+                    _metric_name('ms_rpc', table, method), timer=True)
+            return _timers[(table, method)]
+
+
+def _rpc_counter(name):
+    try:
+        return _counters[name]
+    except KeyError:
+        with _define_lock:
+            if name not in _counters:
+                _counters[name] = statemon.state.define(
+                    _metric_name('n_rpc', name), int)
+            return _counters[name]
+
+
+class _Scope(object):
+    """
+    Accumulates the calls made during a request or job.
+    """
+    def __init__(self, name):
+        self.name = name
+        self.n_rpcs = 0
+        self.ms_rpc = 0.
+        self.ms_checkout = 0.
+        self.by_call = {}  # maps 'table.method' to [count, ms]
+
+    def add(self, table, method, ms):
+        self.n_rpcs += 1
+        self.ms_rpc += ms
+        call = self.by_call.setdefault('%s.%s' % (table, method), [0, 0.])
+        call[0] += 1
+        call[1] += ms
+
+    def merge(self, other):
+        self.n_rpcs += other.n_rpcs
+        self.ms_rpc += other.ms_rpc
+        self.ms_checkout += other.ms_checkout
+        for key, (count, ms) in other.by_call.iteritems():
+            call = self.by_call.setdefault(key, [0, 0.])
+            call[0] += count
+            call[1] += ms
+
+    def summary(self):
+        """
+        Returns the totals of the scope, as a dict that can be serialized to
+        JSON.
+        """
+        return {'n_rpcs': self.n_rpcs,
+                'ms_rpc': round(self.ms_rpc, 1),
+                'ms_checkout': round(self.ms_checkout, 1),
+                'rpcs': dict((key, [count, round(ms, 1)]) for key, (count, ms)
+                             in self.by_call.iteritems())}
+
+
+def current_scope():
+    """
+    Returns the scope of the request or job being run by this thread, or
+    None if there is none.
+    """
+    return getattr(_local, 'scope', None)
+
+
+@contextlib.contextmanager
+def attribute(name):
+    """
+    Attributes the calls made within the block to a request or job. Scopes
+    may be nested, in which case the outer scope includes the calls of the
+    inner.
+
+    :param name: The name of the request or job.
+    :return: The scope, a context manager.
+    """
+    parent = current_scope()
+    scope = _Scope(name)
+    _local.scope = scope
+    try:
+        yield scope
+    finally:
+        _local.scope = parent
+        if parent is not None:
+            parent.merge(scope)
+        try:
+            if scope.n_rpcs:
+                _rpc_counter(name).increment(scope.n_rpcs)
+        except Exception as e:
+            _log.warn('Could not increment statemons: %s' % e.message)
+
+
+def attributed(name=None):
+    """
+    Decorates a function so that the calls made while it runs are attributed
+    to it.
+
+    :param name: The name to attribute the calls to. [def: the function's]
+    :return: The decorator.
+    """
+    def decorator(func):
+        scope_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapped(*args, **kwargs):
+            with attribute(scope_name):
+                return func(*args, **kwargs)
+        return wrapped
+    return decorator
+
+
+def _record(table, method, start):
+    """
+    Records a completed call.
+    """
+    ms = (time.time() - start) * 1000.
+    try:
+        _rpc_timer(table, method).observe(ms)
+        scope = current_scope()
+        if scope is not None:
+            scope.add(table, method, ms)
+        if ms >= SLOW_RPC_THRESHOLD:
+            _log.warn('Slow HBase call: %s', json.dumps(
+                {'table': table, 'method': method, 'ms': round(ms, 1),
+                 'scope': scope.name if scope is not None else None},
+                sort_keys=True))
+    except Exception as e:
+        _log.warn('Could not record HBase call: %s' % e.message)
+
+
+class _Batch(object):
+    """
+    Wraps a HappyBase Batch, timing its sends.
+    """
+    def __init__(self, batch, table):
+        self._batch = batch
+        self._table = table
+
+    def __getattr__(self, name):
+        return getattr(self._batch, name)
+
+    def send(self):
+        start = time.time()
+        try:
+            return self._batch.send()
+        finally:
+            _record(self._table, 'batch_send', start)
+
+    def __enter__(self):
+        self._batch.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        start = time.time()
+        try:
+            return self._batch.__exit__(*exc_info)
+        finally:
+            _record(self._table, 'batch_send', start)
+
+
+class _Table(object):
+    """
+    Wraps a HappyBase Table, timing its calls to the database.
+    """
+    def __init__(self, table, name):
+        self._table = table
+        self._name = name
+
+    def __getattr__(self, name):
+        attr = getattr(self._table, name)
+        if name not in _RPC_METHODS:
+            return attr
+        if name == 'scan':
+            return self._scan
+
+        def timed(*args, **kwargs):
+            start = time.time()
+            try:
+                return attr(*args, **kwargs)
+            finally:
+                _record(self._name, name, start)
+        return timed
+
+    def _scan(self, *args, **kwargs):
+        start = time.time()
+        try:
+            for item in self._table.scan(*args, **kwargs):
+                yield item
+        finally:
+            _record(self._name, 'scan', start)
+
+    def batch(self, *args, **kwargs):
+        return _Batch(self._table.batch(*args, **kwargs), self._name)
+
+
+class _Connection(object):
+    """
+    Wraps a HappyBase Connection, so that the tables it returns are
+    instrumented.
+    """
+    def __init__(self, conn):
+        self._conn = conn
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def table(self, name, *args, **kwargs):
+        return _Table(self._conn.table(name, *args, **kwargs), name)
+
+
+class InstrumentedPool(object):
+    """
+    Wraps a HappyBase ConnectionPool, timing the checkout of connections and
+    instrumenting the tables of the connections it returns.
+    """
+    def __init__(self, pool):
+        """
+        :param pool: A HappyBase ConnectionPool, or an object like it.
+        :return: An InstrumentedPool instance.
+        """
+        self._pool = pool
+
+    def __getattr__(self, name):
+        return getattr(self._pool, name)
+
+    @contextlib.contextmanager
+    def connection(self, timeout=None):
+        """
+        Obtains a connection from the pool, as the ConnectionPool does.
+        """
+        start = time.time()
+        with self._pool.connection(timeout) as conn:
+            ms = (time.time() - start) * 1000.
+            try:
+                _ms_pool_checkout.observe(ms)
+                scope = current_scope()
+                if scope is not None:
+                    scope.ms_checkout += ms
+            except Exception as e:
+                _log.warn('Could not record pool checkout: %s' % e.message)
+            yield _Connection(conn)
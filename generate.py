@@ -12,6 +12,7 @@ import numpy as np
 import jinja2
 from jinja2 import meta
 from jinja_globals import jg
+import phases
 
 _log = logger.setup_logger(__name__)
 
@@ -604,33 +605,39 @@ def fetch_task(dbget, dbset, task_id, worker_id=None, is_practice=None):
         intro_instructions = DEF_INTRO_INSTRUCTIONS
     collect_demo = False
     collect_demo_val = False
+    with phases.phase('worker_reads'):
+        if is_practice:
+            if dbget.worker_need_demographics(worker_id):
+                collect_demo = True
+                # register the worker
+                _log.debug('Registering worker %s' % worker_id)
+                dbset.register_worker(worker_id)
+        else:
+            if dbget.worker_need_demographics(worker_id):
+                _log.warn('Worker %s does not have demographic information '
+                          'but is requesting a task? Will attempt to '
+                          'collect.', worker_id)
+                collect_demo = True
+            else:
+                if dbget.worker_demo_needs_validation(worker_id):
+                    collect_demo_val = True
     if is_practice:
-        if dbget.worker_need_demographics(worker_id):
-            collect_demo = True
-            # register the worker
-            _log.debug('Registering worker %s' % worker_id)
-            dbset.register_worker(worker_id)
         _log.info('Serving practice %s to worker %s' % (task_id, worker_id))
     else:
-        if dbget.worker_need_demographics(worker_id):
-            _log.warn('Worker %s does not have demographic information but is'
-                      ' requesting a task? Will attempt to collect.', worker_id)
-            collect_demo = True
-        else:
-            if dbget.worker_demo_needs_validation(worker_id):
-                collect_demo_val = True
         _log.info('Serving task %s served to %s' % (task_id, worker_id))
-    blocks = dbget.get_task_blocks(task_id)
+    with phases.phase('get_task_blocks'):
+        blocks = dbget.get_task_blocks(task_id)
     if blocks is None:
         # display an error-fetching-task page.
         _log.error('Could not fetch blocks for task %s' % task_id)
         raise Exception('Could not fetch task blocks')
-    html = make_html(blocks,
-                     practice=is_practice,
-                     collect_demo=collect_demo,
-                     collect_demo_valid=collect_demo_val,
-                     intro_instructions=intro_instructions,
-                     task_id=task_id)
+    with phases.phase('make_html'):
+        html = make_html(blocks,
+                         practice=is_practice,
+                         collect_demo=collect_demo,
+                         collect_demo_valid=collect_demo_val,
+                         intro_instructions=intro_instructions,
+                         task_id=task_id)
     return html
 
 
@@ -0,0 +1,573 @@
+"""
+Exports the housekeeping of the task: the jobs that keep the right number of
+HITs and practices posted, ban and unban workers, reset the worker quotas and
+the tasks that timed out and record the outcome of tasks, as well as the
+notifications they send.
+
+Every job is called as job(mt, dbget, dbset, *args), and is listed by name in
+JOBS, so that it can be queued durably (by name and JSON arguments) and run
+by another process. The jobs are run either by the webserver itself or, if
+USE_DAEMON is True, those in DAEMON_JOBS are run by the daemon (see
+daemon.py), which also runs the periodic ones, so that the webserver does
+little more than serve requests.
+"""
+
+import traceback
+import dbpool
+import jobs
+import logger
+import notifier
+import statemon
+from conf import *
+
+_log = logger.setup_logger(__name__)
+
+# create state monitoring variables & handle statemon
+_n_tasks_generated = statemon.define("n_tasks_generated")
+_n_practices_generated = statemon.define("n_practices_generated")
+_n_workers_banned = statemon.define("n_workers_banned")
+_n_workers_unbanned = statemon.define("n_workers_unbanned")
+_n_errors_observed = statemon.define("n_errors_observed")
+
+# notifications are sent in the background, with repeats gathered into digests
+notifications = notifier.Notifier(notifier.SESTransport())
+
+
+"""
+NOTIFICATIONS
+"""
+
+
+def dispatch_err(e, tb='', request=None):
+    """
+    Dispatches an error email. Errors with the same message are digested
+    together.
+
+    :param e: The exception.
+    :param tb: The traceback.
+    :param request: The Flask request.
+    """
+    try:
+        _n_errors_observed.increment()
+    except:
+        _log.warn('Could not increment observed error count')
+    if request is not None:
+        if request.headers.getlist("X-Forwarded-For"):
+           src = request.headers.getlist("X-Forwarded-For")[0]
+        else:
+           src = request.remote_addr
+        try:
+            req_json = request.json
+        except:
+            req_json = 'No JSON'
+        try:
+            ua = str(request.user_agent)
+        except:
+            ua = 'No User Agent'
+    else:
+        src = 'No request'
+        req_json = 'No request'
+        ua = 'No request'
+    subj = 'MTurk Error %s' % e.message
+    body_elem = ['Error: %s' % e.message,
+                 'Traceback:\n%s' % tb,
+                 'IP: %s' % src,
+                 'User Agent: %s' % ua,
+                 'JSON: %s' % str(req_json)]
+    body = '\n\n----------------------------\n\n'.join(body_elem)
+    notifications.notify(subj, body)
+
+
+def dispatch_notification(message, subject='Notification', key=None):
+    """
+    Dispatches a message to the NOTIFICATION_RECIPIENTS. The message is sent
+    in the background; if others with the same key were sent recently, it is
+    held and sent with them as a digest.
+
+    :param message: The body of the message.
+    :param subject: The subject of the message.
+    :param key: The key of the event. [def: the subject]
+    """
+    notifications.notify(subject, message, key)
+
+
+"""
+SETUP
+"""
+
+
+def setup_hit_types(mt, dbget, dbset):
+    """
+    Fetches the active HIT types, registering new ones if there are none (or
+    if they must be regenerated).
+
+    :param mt: A MTurk object.
+    :param dbget: A database Get object.
+    :param dbset: A database Set object.
+    :return: The task HIT type ID and the practice HIT type ID.
+    """
+    _log.info('Fetching hit types')
+    practice_hit_type_id = dbget.get_active_practice_hit_type_for(
+        task_attribute=ATTRIBUTE,
+        image_attributes=IMAGE_ATTRIBUTES)
+    task_hit_type_id = dbget.get_active_hit_type_for(
+        task_attribute=ATTRIBUTE,
+        image_attributes=IMAGE_ATTRIBUTES)
+    if ((not practice_hit_type_id) or (not task_hit_type_id) or TESTING or
+            FORCE_HIT_TYPE_REGEN):
+        _log.info('Calculating payment')
+        _task_payment = 0.41 #((1./60) * dbget.task_time) * PAYMENT_PER_MIN
+        task_payment = float(int(_task_payment * 100))/100
+        mins, secs = divmod(dbget.task_time, 60)
+        _log.info('Average task time is %i min, %i sec. Payment is %.2f',
+                  int(mins), int(secs), task_payment)
+        if practice_hit_type_id:
+            dbset.deactivate_hit_type(practice_hit_type_id)
+        if task_hit_type_id:
+            dbset.deactivate_hit_type(task_hit_type_id)
+        task_hit_type_id, practice_hit_type_id = \
+            mt.register_hit_type_mturk(reward=task_payment)
+        _log.info('Created new HIT Types, obtained %s and %s',
+                  practice_hit_type_id, task_hit_type_id)
+        dbset.register_hit_type(task_hit_type_id, reward=task_payment)
+        dbset.register_hit_type(practice_hit_type_id, is_practice=True)
+    return task_hit_type_id, practice_hit_type_id
+
+
+def setup_indices(dbset):
+    """
+    Creates the ban and task indices if they do not exist, indexing the bans
+    and tasks that predate them.
+
+    :param dbset: A database Set object.
+    :return: None
+    """
+    if dbset.create_ban_table():
+        # the ban index is new, so index the bans that predate it.
+        dbset.rebuild_ban_index()
+    if dbset.create_task_index_table():
+        dbset.rebuild_task_index()
+
+
+def schedule_periodic(scheduler, mt, dbget, dbset):
+    """
+    Schedules the periodic jobs: unbanning workers, resetting the quotas and
+    resetting the tasks that timed out.
+
+    :param scheduler: An APScheduler scheduler.
+    :param mt: A MTurk object.
+    :param dbget: A database Get object.
+    :param dbset: A database Set object.
+    :return: None
+    """
+    scheduler.add_job(unban_workers, 'interval', hours=24,
+                      args=[mt, dbget, dbset], id='unban workers')
+    scheduler.add_job(reset_worker_quotas, 'cron', hour='0',
+                      args=[mt, dbget, dbset], id='task quota reset')
+    scheduler.add_job(reset_weekly_practices, 'cron', day_of_week='sun',
+                      hour='1', args=[mt, dbget, dbset],
+                      id='practice quota reset')
+    # a task is reset at most 1/24th of the timeout late.
+    scheduler.add_job(reset_timed_out_tasks, 'interval',
+                      seconds=TASK_COMPLETION_TIMEOUT / 24,
+                      args=[mt, dbget, dbset], id='task timeout reset')
+
+
+"""
+JOBS
+"""
+
+
+@dbpool.attributed()
+def check_tasks(mt, dbget, dbset, hit_type_id):
+    """
+    Ensures that there is an appropriate number of tasks posted and active.
+
+    :param mt: A MTurk object.
+    :param dbget: A database Get object.
+    :param dbset: A database Set object.
+    :param hit_type_id: The HIT type ID, as a string.
+    :return: None.
+    """
+    _log.info('JOB STARTED check_tasks: Looking for missing tasks')
+    num_extant_hits = mt.get_all_pending_hits_of_type(
+        hit_type_id, ids_only=True)
+    to_generate = max(NUM_TASKS - len(num_extant_hits), 0)
+    if to_generate:
+        _log.info('Building %i new tasks and posting them' % to_generate)
+        create_hits(mt, dbget, dbset, hit_type_id, n=to_generate)
+
+
+@dbpool.attributed()
+def create_hits(mt, dbget, dbset, hit_type_id, n=1):
+    """
+    The background task for creating new hits, which enables us to maintain a
+    constant number of tasks at all times. Note that this should be only used
+    for generating 'real' tasks--i.e., NOT practices!
+
+    Additionally, this checks to make sure that an adequate number of images
+    have been activated. The balance and the sampling are checked once for
+    all n hits, so requests for new hits are coalesced by the job queue.
+
+    :param mt: A MTurk object.
+    :param dbget: A database Get object.
+    :param dbset: A database Set object.
+    :param hit_type_id: The HIT type ID, as a string.
+    :param n: The number of hits to create.
+    :return: None.
+    """
+    _log.info('JOB_STARTED create_hits: %i hits', n)
+    _log.info('Checking image statuses')
+    dbget.update_sampling()
+    if dbget.should_halt():
+        return
+    # n_active = dbget.get_n_active_images_count(IMAGE_ATTRIBUTES)
+    # mean_seen = dbget.image_get_mean_seen(IMAGE_ATTRIBUTES)
+    # if mean_seen > MEAN_SAMPLES_REQ_PER_IMAGE(n_active):
+    #     _log.info('Images are sufficiently sampled, activating more')
+    #     dbset.activate_n_images(ACTIVATION_CHUNK_SIZE)
+    # else:
+    #     _log.info('Mean %.2f < required %.2f' % (mean_seen,
+    #                                              MEAN_SAMPLES_REQ_PER_IMAGE(
+    #                                                  n_active)))
+    hit_cost = DEFAULT_TASK_PAYMENT
+    bal = mt.get_account_balance()
+    if hit_cost > bal:
+        _log.warn('Insufficient funds to generate new tasks: %.2f cost vs. '
+                  '%.2f balance', hit_cost, bal)
+        return
+    if hit_cost * n > bal:
+        _log.warn('Insufficient funds to generate %i new tasks: %.2f cost vs. '
+                  '%.2f balance', n, hit_cost * n, bal)
+        n = int(bal // hit_cost)
+    if bal < LOW_FUNDS_WARNING:
+        dispatch_notification('Low funds: %s' % str(bal),
+                              subject="LOW BALANCE WARING", key='low_funds')
+    posted = 0
+    for _ in range(n):
+        try:
+            _log.info('Generating a new HIT')
+            task_id, exp_seq, attribute, register_task_kwargs = \
+                dbget.gen_task(DEF_NUM_IMAGES_PER_TASK, 3,
+                               DEF_NUM_IMAGE_APPEARANCE_PER_TASK,
+                               n_keep_blocks=1, n_reject_blocks=1,
+                               hit_type_id=hit_type_id)
+            _log.info('Registering task in the database')
+            dbset.register_task(task_id, exp_seq, attribute,
+                                **register_task_kwargs)
+            _log.info('Adding task %s to mturk as hit under hit type id %s' %
+                      (task_id, hit_type_id))
+            hid = mt.add_hit_to_hit_type(hit_type_id, task_id)
+            posted += 1
+            dbset.indicate_task_has_hit_type(task_id)
+        except Exception as e:
+            if not posted:
+                raise
+            # the HITs already posted must not be posted again on a retry.
+            raise jobs.PartialFailure(posted, e)
+        _log.info('Hit %s is ready.' % hid)
+        _n_tasks_generated.increment()
+
+
+@dbpool.attributed()
+def check_practices(mt, dbget, dbset, hit_type_id):
+    """
+    Checks to make sure that the practices are up, etc. If not, rebuilds them.
+
+    NOTES:
+        Right now, if the practices are all used up (but not expired!) then
+        they are not re-created. They are only re-created upon expiration.
+
+    :param mt: A MTurk object.
+    :param dbget: A database Get object.
+    :param dbset: A database Set object.
+    :param hit_type_id: The HIT type ID, as a string.
+    :return: None.
+    """
+    _log.info('JOB STARTED check_practices: Checking practices...')
+    to_generate = 0
+    practice_hits = mt.get_all_hits_of_type(hit_type_id=hit_type_id)
+    to_generate += NUM_PRACTICES - len(practice_hits)
+    tot_cost = DEFAULT_PRACTICE_PAYMENT * NUM_ASSIGNMENTS_PER_PRACTICE * \
+               to_generate
+    bal = mt.get_account_balance()
+    if tot_cost > bal:
+        _log.warn('Insufficient funds to generate practicse: %.2f cost vs. '
+                  '%.2f balance', tot_cost, bal)
+        return
+    if bal < LOW_FUNDS_WARNING:
+        dispatch_notification('Low funds: %s' % str(bal),
+                              subject="LOW BALANCE WARING", key='low_funds')
+    for hit in practice_hits:
+        if mt.get_practice_status(hit=hit) == PRACTICE_EXPIRED:
+            _log.info('Practice %s expired' % hit.HITId)
+            # disable it
+            mt.disable_hit(hit.HITId)
+            to_generate += 1
+        elif mt.get_practice_status(hit=hit) == PRACTICE_COMPLETE:
+            _log.info('Practice %s is complete' % hit.HITId)
+            # disable it
+            mt.disable_hit(hit.HITId)
+            to_generate += 1
+    if to_generate <= 0:
+        return
+    _log.info('Need to generate %i more practices' % to_generate)
+    for _ in range(to_generate):
+        task_id, exp_seq, attribute, register_task_kwargs = \
+            dbget.gen_task(DEF_PRACTICE_NUM_IMAGES_PER_TASK, 3,
+                           DEF_NUM_IMAGE_APPEARANCE_PER_TASK, n_keep_blocks=1,
+                           n_reject_blocks=1, hit_type_id=hit_type_id,
+                           practice=True)
+        dbset.register_task(task_id, exp_seq, attribute,
+                            **register_task_kwargs)
+        mt.add_practice_hit_to_hit_type(hit_type_id, task_id)
+        _n_practices_generated.increment()
+
+
+@dbpool.attributed()
+def create_practices(mt, dbget, dbset, hit_type_id, n=1):
+    """
+    Mirrors the functionality of create_hits, only creates practices instead.
+
+    :param mt: A MTurk object.
+    :param dbget: A database Get object.
+    :param dbset: A database Set object.
+    :param hit_type_id: The HIT type ID, as a string.
+    :param n: The number of practices to create.
+    :return: None.
+    """
+    _log.info('JOB_STARTED create_practices: %i practices', n)
+    if dbget.should_halt():
+        return
+    hit_cost = DEFAULT_PRACTICE_PAYMENT
+    bal = mt.get_account_balance()
+    if hit_cost > bal:
+        _log.warn('Insufficient funds to generate new tasks: %.2f cost vs. '
+                  '%.2f balance', hit_cost, bal)
+        return
+    n = min(n, int(bal // hit_cost))
+    posted = 0
+    for _ in range(n):
+        try:
+            task_id, exp_seq, attribute, register_task_kwargs = \
+                dbget.gen_task(DEF_PRACTICE_NUM_IMAGES_PER_TASK, 3,
+                               DEF_NUM_IMAGE_APPEARANCE_PER_TASK,
+                               n_keep_blocks=1, n_reject_blocks=1,
+                               hit_type_id=hit_type_id, practice=True)
+            dbset.register_task(task_id, exp_seq, attribute,
+                                **register_task_kwargs)
+            mt.add_practice_hit_to_hit_type(hit_type_id, task_id)
+            posted += 1
+        except Exception as e:
+            if not posted:
+                raise
+            raise jobs.PartialFailure(posted, e)
+        _n_practices_generated.increment()
+
+
+@dbpool.attributed()
+def check_ban(mt, dbget, dbset, worker_id=None):
+    """
+    Checks to see if a worker needs to be banned
+
+    :param mt: A MTurk object.
+    :param dbget: A database Get object.
+    :param dbset: A database Set object.
+    :param worker_id: The worker ID, as a string
+    :return: None
+    """
+    _log.info('JOB STARTED check_ban')
+    if dbget.worker_autoban_check(worker_id):
+        dbset.ban_worker(worker_id)
+        try:
+            mt.ban_worker(worker_id)
+        except Exception as e:
+            tb = traceback.format_exc()
+            dispatch_err(e, tb, None)
+            return
+        dispatch_notification('Worker %s has been banned' % str(worker_id),
+                              subject="Ban notification", key='ban')
+        try:
+            _n_workers_banned.increment()
+        except:
+            _log.warn('Could not increment statemons')
+
+
+@dbpool.attributed()
+def unban_workers(mt, dbget, dbset):
+    """
+    Designed to run periodically, checks to see the workers -- if any -- that
+    need to be unbanned.
+
+    :param mt: A MTurk object.
+    :param dbget: A database Get object.
+    :param dbset: A database Set object.
+    :return: None
+    """
+    _log.info('JOB STARTED unban_workers')
+    _log.info('Checking if any bans can be lifted...')
+    for index_key, worker_id in dbget.get_expired_bans():
+        if dbget.worker_is_banned(worker_id):
+            expires_in = dbset.worker_ban_expires_in(worker_id)
+            if expires_in:
+                # the entry came due before the ban itself, so move it to
+                # when the ban really expires rather than losing track of it.
+                dbset.reindex_ban(index_key, worker_id, expires_in)
+                continue
+            mt.unban_worker(worker_id)
+            dispatch_notification('Worker %s has been unbanned' % str(
+                worker_id), subject="Unban notification", key='unban')
+            try:
+                _n_workers_unbanned.increment()
+            except:
+                _log.warn('Could not increment statemons')
+        # the entry is either consumed or stale (i.e., the worker was
+        # re-banned or manually unbanned), so drop it from the index.
+        dbset.remove_ban_index(index_key)
+
+
+@dbpool.attributed()
+def reset_worker_quotas(mt, dbget, dbset):
+    """
+    Designed to run periodically, resets all the worker completion quotas.
+
+    :param mt: A MTurk object.
+    :param dbget: A database Get object.
+    :param dbset: A database Set object.
+    :return: None
+    """
+    _log.info('JOB STARTED reset_worker_quotas')
+    # workers that have been inactive since the last reset have a full quota.
+    mt.bulk_reset_worker_daily_quotas(
+        dbget.get_recently_active_workers(DAILY_QUOTA_INACTIVE_DAYS))
+
+
+@dbpool.attributed()
+def reset_weekly_practices(mt, dbget, dbset):
+    """
+    Designed to run periodically, resets all the worker practice quotas.
+
+    :param mt: A MTurk object.
+    :param dbget: A database Get object.
+    :param dbset: A database Set object.
+    :return: None
+    """
+    _log.info('JOB STARTED reset_weekly_practices')
+    mt.bulk_reset_worker_weekly_practice_quotas(
+        dbget.get_recently_active_workers(WEEKLY_QUOTA_INACTIVE_DAYS))
+
+
+@dbpool.attributed()
+def reset_timed_out_tasks(mt, dbget, dbset):
+    """
+    Designed to run periodically, returns the tasks that were served but not
+    completed within TASK_COMPLETION_TIMEOUT to those awaiting serving.
+
+    :param mt: A MTurk object.
+    :param dbget: A database Get object.
+    :param dbset: A database Set object.
+    :return: None
+    """
+    _log.info('JOB STARTED reset_timed_out_tasks')
+    dbset.reset_timed_out_tasks()
+
+
+@dbpool.attributed()
+def handle_served_task(mt, dbget, dbset, task_id, worker_id, hit_id,
+                       hit_type_id):
+    """
+    Records that a task has been served asynchronously, i.e., by being passed
+    to the threadpool.
+
+    :param mt: A MTurk object.
+    :param dbget: A database Get object.
+    :param dbset: A database Set object.
+    :param task_id: The internal task ID
+    :param worker_id: The worker ID
+    :param hit_id: The MTurk HIT ID
+    :param hit_type_id: The MTurk HIT type ID
+    :return: None
+    """
+    dbset.task_served(task_id, worker_id, hit_id=hit_id,
+                      hit_type_id=hit_type_id)
+
+
+@dbpool.attributed()
+def handle_accepted_task(mt, dbget, dbset, task_id):
+    """
+    Handles an accepted task asynchronously, i.e., by being passed to the
+    threadpool.
+
+    :param mt: A MTurk object.
+    :param dbget: A database Get object.
+    :param dbset: A database Set object.
+    :param task_id: The internal task ID
+    :return: None
+    """
+    # accept_task marks the task as accepted only once everything has been
+    # counted (a retry of a failed one picks up where it left off), so an
+    # accepted task is done.
+    if dbget.get_task_status(task_id) == ACCEPTED:
+        _log.warn('Task %s was already accepted' % task_id)
+        return
+    dbset.accept_task(task_id)
+
+
+@dbpool.attributed()
+def handle_reject_task(mt, dbget, dbset, worker_id, assignment_id, task_id,
+                       reason):
+    """
+    Handles a rejected task asynchronously, i.e., by being passed to the
+    threadpool.
+
+    :param mt: A MTurk object.
+    :param dbget: A database Get object.
+    :param dbset: A database Set object.
+    :param worker_id: The worker ID
+    :param assignment_id: The MTurk assignment ID
+    :param task_id: The internal task ID
+    :param reason: The reason for the rejection
+    :return: None
+    """
+    _log.info('Soft rejection assignment %s from worker %s: %s' % (
+        assignment_id, worker_id, reason))
+    # this may be a retry, so the rejection is recorded only if it wasn't
+    # already, and the worker is notified last, so that they are notified
+    # again only if that is what failed.
+    if dbget.get_task_status(task_id) != REJECTED:
+        dbset.reject_task(task_id, reason)
+    mt.soft_reject_assignment(worker_id, assignment_id, reason)
+
+
+@dbpool.attributed()
+def handle_finished_hit(mt, dbget, dbset, hit_id):
+    """
+    Disables a completed task asynchronously, i.e., by being passed to the
+    threadpool.
+
+    NOTES:
+        Either an assignment_id or hit_id must be provided.
+
+    :param mt: A MTurk object.
+    :param dbget: A database Get object.
+    :param dbset: A database Set object.
+    :param hit_id: The reason for the rejection
+    :return: None
+    """
+    # mt.disable_hit(hit_id)
+    pass
+
+
+# the jobs, by name.
+JOBS = dict((func.__name__, func) for func in [
+    check_tasks, create_hits, check_practices, create_practices, check_ban,
+    unban_workers, reset_worker_quotas, reset_weekly_practices,
+    reset_timed_out_tasks, handle_served_task, handle_accepted_task,
+    handle_reject_task, handle_finished_hit])
+
+# the jobs that the daemon runs when USE_DAEMON is True. Recording a served
+# task stays in the webserver: it's a few writes, which cost as much as
+# queueing it durably would, and it should follow the serve closely.
+# handle_finished_hit does nothing at present.
+DAEMON_JOBS = frozenset(['create_hits', 'create_practices', 'check_ban',
+                         'handle_accepted_task', 'handle_reject_task'])
@@ -0,0 +1,258 @@
+"""
+Exports a job queue for the work that requests hand off to the background
+(recording accepted and rejected tasks, checking bans, topping up HITs),
+which coalesces identical pending jobs and runs the more urgent ones first.
+
+    queue = JobQueue(NUM_THREADS)
+    queue.start()
+    queue.add(handle_accepted_task, args=[dbset, task_id],
+              priority=PRIORITY_HIGH)
+    queue.add(create_hits, args=[mt, dbget, dbset, hit_type_id],
+              priority=PRIORITY_LOW, key=('create_hits', hit_type_id),
+              count=1)
+
+A job added with a key is coalesced with the pending job of the same key, if
+there is one, rather than queued again. If it is added with a count, the
+counts are summed and the function is called with the total as its keyword
+argument n, so that a burst of submissions asking for one more HIT each
+becomes a single job that creates them all (checking the balance and the
+sampling once). Jobs run in order of priority, then of addition.
+
+The queue exports the statemon variables:
+
+    job_queue_depth     - the number of pending jobs (a gauge)
+    ms_job_wait         - the time jobs wait to be started
+    ms_job_run          - the time jobs take to run
+    n_jobs_coalesced    - the number of jobs merged into pending ones
+    n_jobs_failed       - the number of jobs that raised
+"""
+
+import heapq
+import itertools
+import threading
+import time
+import logger
+import statemon
+
+_log = logger.setup_logger(__name__)
+
+# job priorities; lower values run first.
+PRIORITY_HIGH = 0  # e.g., recording accepted and rejected tasks
+PRIORITY_NORMAL = 1  # e.g., checking bans
+PRIORITY_LOW = 2  # e.g., topping up HITs and practices
+
+_job_queue_depth = statemon.define_gauge('job_queue_depth', int)
+_ms_job_wait = statemon.define_timer('ms_job_wait')
+_ms_job_run = statemon.define_timer('ms_job_run')
+_n_jobs_coalesced = statemon.define('n_jobs_coalesced')
+_n_jobs_failed = statemon.define('n_jobs_failed')
+
+
+class PartialFailure(Exception):
+    """
+    Raised by a job called with a count when it fails after doing part of its
+    work (e.g., after posting some of its HITs), so that a durable queue that
+    retries it (see daemon.JobTable) only retries the rest.
+    """
+    def __init__(self, n_done, error):
+        """
+        :param n_done: How much of the count was done.
+        :param error: The exception that stopped the job.
+        """
+        Exception.__init__(self, '%s (after %i done)' % (error, n_done))
+        self.n_done = n_done
+        self.error = error
+
+
+class _Job(object):
+    """
+    A pending job.
+    """
+    def __init__(self, func, args, kwargs, priority, key, count):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.priority = priority
+        self.key = key
+        self.count = count
+        self.added = time.time()
+
+    def run(self):
+        kwargs = self.kwargs
+        if self.count is not None:
+            kwargs = dict(kwargs, n=self.count)
+        return self.func(*self.args, **kwargs)
+
+
+class JobQueue(object):
+    """
+    Runs jobs on a pool of threads, by priority, coalescing the pending jobs
+    that share a key.
+    """
+    def __init__(self, n_threads=1, name='jobs'):
+        """
+        :param n_threads: The number of threads that run jobs.
+        :param name: The prefix of the names of the threads.
+        :return: A JobQueue instance.
+        """
+        self.n_threads = n_threads
+        self.name = name
+        self._heap = []  # (priority, seq, job)
+        self._seq = itertools.count()
+        self._by_key = {}  # maps keys to their pending job
+        self._cond = threading.Condition()
+        self._threads = []
+        self._stopped = False
+        self._n_running = 0
+
+    def start(self):
+        """
+        Starts the threads.
+        """
+        with self._cond:
+            self._stopped = False
+            while len(self._threads) < self.n_threads:
+                t = threading.Thread(
+                    target=self._run,
+                    name='%s-%i' % (self.name, len(self._threads)))
+                t.daemon = True
+                self._threads.append(t)
+                t.start()
+
+    def add(self, func, args=None, kwargs=None, priority=PRIORITY_NORMAL,
+            key=None, count=None):
+        """
+        Adds a job, or coalesces it with the pending job of the same key.
+
+        :param func: The function to run.
+        :param args: Its positional arguments.
+        :param kwargs: Its keyword arguments.
+        :param priority: The priority of the job.
+        :param key: The key of the job; a pending job with the same key
+                    absorbs this one, keeping its own arguments and priority.
+                    [def: the job is never coalesced]
+        :param count: If given, the function is called with the keyword
+                      argument n, the sum of the counts of the jobs that were
+                      coalesced.
+        :return: True if the job was coalesced, False if it was queued.
+        """
+        with self._cond:
+            if key is not None:
+                pending = self._by_key.get(key)
+                if pending is not None:
+                    if count is not None:
+                        pending.count = (pending.count or 0) + count
+                    try:
+                        _n_jobs_coalesced.increment()
+                    except Exception as e:
+                        _log.warn('Could not increment statemons: %s' %
+                                  e.message)
+                    return True
+            job = _Job(func, list(args or []), dict(kwargs or {}), priority,
+                       key, count)
+            if key is not None:
+                self._by_key[key] = job
+            heapq.heappush(self._heap, (priority, next(self._seq), job))
+            self._set_depth()
+            self._cond.notify_all()
+            return False
+
+    def depth(self):
+        """
+        Returns the number of pending jobs.
+        """
+        with self._cond:
+            return len(self._heap)
+
+    def _set_depth(self):
+        try:
+            _job_queue_depth.set(len(self._heap))
+        except Exception as e:
+            _log.warn('Could not set statemons: %s' % e.message)
+
+    def _take(self):
+        """
+        Waits for and removes the next job, or returns None once the queue
+        is stopped.
+        """
+        with self._cond:
+            while not self._heap and not self._stopped:
+                self._cond.wait()
+            if self._stopped:
+                return None
+            _, _, job = heapq.heappop(self._heap)
+            if job.key is not None:
+                # jobs added from now on are queued anew, rather than merged
+                # into one that has already started.
+                del self._by_key[job.key]
+            self._n_running += 1
+            self._set_depth()
+            return job
+
+    def _run(self):
+        while True:
+            job = self._take()
+            if job is None:
+                return
+            start = time.time()
+            try:
+                _ms_job_wait.observe((start - job.added) * 1000.)
+            except Exception as e:
+                _log.warn('Could not record job wait: %s' % e.message)
+            try:
+                job.run()
+            except Exception as e:
+                _log.exception('Job %s failed: %s',
+                               getattr(job.func, '__name__', job.func),
+                               e.message)
+                try:
+                    _n_jobs_failed.increment()
+                except Exception as e:
+                    _log.warn('Could not increment statemons: %s' % e.message)
+            finally:
+                try:
+                    _ms_job_run.observe((time.time() - start) * 1000.)
+                except Exception as e:
+                    _log.warn('Could not record job run: %s' % e.message)
+                with self._cond:
+                    self._n_running -= 1
+                    self._cond.notify_all()
+
+    def join(self, timeout=None):
+        """
+        Waits until no jobs are pending or running.
+
+        :param timeout: The longest to wait, in seconds. [def: no limit]
+        :return: True if the queue is idle, False if the wait timed out.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self._cond:
+            while self._heap or self._n_running:
+                if deadline is None:
+                    self._cond.wait()
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        return False
+                    self._cond.wait(remaining)
+            return True
+
+    def stop(self, wait=True):
+        """
+        Stops the threads once they finish the jobs they are running; the
+        pending jobs are discarded.
+
+        :param wait: Whether to wait for the threads to exit.
+        """
+        with self._cond:
+            self._stopped = True
+            if self._heap:
+                _log.warn('Discarding %i pending jobs', len(self._heap))
+            self._heap = []
+            self._by_key = {}
+            self._set_depth()
+            self._cond.notify_all()
+            threads, self._threads = self._threads, []
+        if wait:
+            for t in threads:
+                t.join()
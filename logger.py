@@ -1,69 +1,177 @@
 """
 Handles color logging.
+
+Logging never blocks on the console or on disk: the root logger has a single
+handler, which puts each record on a bounded queue, and a listener thread
+takes them off it and writes them. Records from the mturk loggers go to the
+console (in color) and, once config_root_logger() has been called, to the
+log file, as do the records of the APScheduler scheduler. If the queue is
+full, records are dropped, counted by the statemon variable
+n_log_records_dropped, and the listener logs how many were dropped once it
+catches up. The queue is drained when the process exits.
 """
 
+import atexit
 import logging
 import logging.handlers
+import os
+import Queue
+import threading
 from colorlog import ColoredFormatter
 from datetime import datetime
+import statemon
+
+# the most records that may be waiting to be written.
+QUEUE_SIZE = 10000
+# how long to wait for the queue to drain when the process exits, in seconds.
+DRAIN_TIMEOUT = 5.
+
+_n_dropped = statemon.define('n_log_records_dropped')
+
+# the targets that records are written to.
+_CONSOLE = 'console'
+_FILE = 'file'
+
+_FORMAT = "%(levelname)-8s %(asctime)s - %(name)s - %(funcName)s: %(message)s"
+_DATEFMT = '%m/%d/%Y %I:%M:%S %p'
 
 
 def _get_timestamp_string():
     return datetime.now().isoformat()
 
 
-def config_root_logger(logfile=None, return_webserver=False):
+class _QueueHandler(logging.Handler):
     """
-    Sets up the root logger. Call this in the main() of the file.
+    Puts records on the listener's queue, to be written to a fixed set of
+    targets or to those chosen by a routing function.
+    """
+    def __init__(self, listener, targets=None, route=None,
+                 level=logging.NOTSET):
+        """
+        :param listener: The _Listener.
+        :param targets: The targets of every record, as a tuple.
+        :param route: A function from a record to its targets, used if
+                      targets is not given.
+        :param level: The handler's level.
+        """
+        logging.Handler.__init__(self, level)
+        self._listener = listener
+        self._targets = targets
+        self._route = route
 
-    :param logfile: The filename to log to.
-    :param return_webserver: Whether or not to also create and return a
-           handler for the Flask webserver as well.
+    def emit(self, record):
+        targets = self._targets or self._route(record)
+        if not targets:
+            return
+        try:
+            # merge the arguments and format the traceback now, since they
+            # may change (or be freed) before the record is written.
+            record.msg = record.getMessage()
+            record.args = None
+            if record.exc_info:
+                record.exc_text = logging.Formatter().formatException(
+                    record.exc_info)
+                record.exc_info = None
+            self._listener.put(record, targets)
+        except Exception:
+            self.handleError(record)
+
+
+class _Listener(object):
     """
-    logger = logging.getLogger()
-    logger.setLevel(logging.DEBUG)
-    formatter = logging.Formatter(
-        "%(levelname)-8s %(asctime)s - %(name)s - %(funcName)s: %(message)s",
-        datefmt='%m/%d/%Y %I:%M:%S %p')
-    fltr1 = logging.Filter(name='mturk')
-    fltr2 = logging.Filter(name='apscheduler.scheduler')
-    if logfile is not None:
-        # Add a rotating file handler
+    Writes queued records from a background thread.
+    """
+    def __init__(self, queue_size=QUEUE_SIZE):
+        self._queue_size = queue_size
+        self._handlers = {_CONSOLE: _console_handler()}
+        self._lock = threading.Lock()
+        self._start()
+
+    def _start(self):
+        self._pid = os.getpid()
+        self._queue = Queue.Queue(self._queue_size)
+        self._dropped = 0  # records dropped since the listener last logged
+        self._thread = threading.Thread(target=self._run,
+                                        name='log-listener')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def set_file(self, logfile):
+        """
+        Writes the file target to a log file, rotating it at 100 MB.
+        """
         handler = logging.handlers.RotatingFileHandler(
             logfile,
             maxBytes=104857600L,  # 100 MB
             backupCount=6)
-        handler.addFilter(fltr1)
-        handler.setFormatter(formatter)
-        logger.addHandler(handler)
-        handler_aps = logging.handlers.RotatingFileHandler(
-            logfile,
-            maxBytes=104857600L,  # 100 MB
-            backupCount=6)
-        handler_aps.addFilter(fltr2)
-        handler_aps.setFormatter(formatter)
-        logger.addHandler(handler_aps)
-        if return_webserver:
-            handler = logging.handlers.RotatingFileHandler(
-                logfile,
-                maxBytes=104857600L,  # 100 MB
-                backupCount=6)
-            handler.setFormatter(formatter)
-            handler.setLevel(logging.WARNING)
-            return handler
+        handler.setFormatter(logging.Formatter(_FORMAT, datefmt=_DATEFMT))
+        with self._lock:
+            old = self._handlers.get(_FILE)
+            self._handlers[_FILE] = handler
+        if old is not None:
+            old.close()
 
+    def put(self, record, targets):
+        if os.getpid() != self._pid:
+            # this is a forked child, which did not inherit the thread.
+            with self._lock:
+                if os.getpid() != self._pid:
+                    self._start()
+        try:
+            self._queue.put_nowait((record, targets))
+        except Queue.Full:
+            self._dropped += 1
+            try:
+                _n_dropped.increment()
+            except Exception:
+                pass
 
-def setup_logger(log_name):
-    """
-    Return a logger configured for a particular module.
+    def _write(self, record, targets):
+        for target in targets:
+            handler = self._handlers.get(target)
+            if handler is not None and record.levelno >= handler.level:
+                handler.handle(record)
 
-    :param log_name: The name of the logger to use.
-    """
-    # TODO: Have this log to somewhere!
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            try:
+                self._write(*item)
+                if self._dropped:
+                    dropped, self._dropped = self._dropped, 0
+                    record = logging.LogRecord(
+                        'mturk.logger', logging.WARNING, __file__, 0,
+                        'Dropped %i log records, the log queue was full',
+                        (dropped,), None, '_run')
+                    self._write(record, (_CONSOLE, _FILE))
+            except Exception:
+                pass
+
+    def stop(self, timeout=DRAIN_TIMEOUT):
+        """
+        Writes the records that are still queued and stops the thread.
+        """
+        if os.getpid() != self._pid or not self._thread.is_alive():
+            return
+        try:
+            self._queue.put(None, timeout=timeout)
+        except Queue.Full:
+            return
+        self._thread.join(timeout)
+        for handler in self._handlers.values():
+            try:
+                handler.flush()
+            except (IOError, ValueError):
+                # e.g., the stream was closed first.
+                pass
+
+
+def _console_handler():
     formatter = ColoredFormatter(
-        "%(log_color)s%(levelname)-8s %(asctime)s - %(name)s - "
-        "%(funcName)s: %(message)s",
-        datefmt='%m/%d/%Y %I:%M:%S %p',
+        "%(log_color)s" + _FORMAT,
+        datefmt=_DATEFMT,
         reset=True,
         log_colors={
             'DEBUG':    'cyan',
@@ -73,11 +181,72 @@ def setup_logger(log_name):
             'CRITICAL': 'red',
         }
     )
-    # the mturk prefix is added so that it filters things that aren't mturk
-    logger = logging.getLogger('mturk.' + log_name)
     handler = logging.StreamHandler()
     handler.setFormatter(formatter)
-    if handler not in logger.handlers:
-        logger.addHandler(handler)
+    return handler
+
+
+# the mturk prefix is added so that it filters things that aren't mturk
+_mturk_filter = logging.Filter(name='mturk')
+_aps_filter = logging.Filter(name='apscheduler.scheduler')
+
+
+def _route(record):
+    """
+    Returns the targets of a record that reaches the root logger.
+    """
+    if _mturk_filter.filter(record):
+        return (_CONSOLE, _FILE)
+    if _aps_filter.filter(record):
+        return (_FILE,)
+    return ()
+
+
+_listener = None
+_listener_lock = threading.Lock()
+
+
+def _get_listener():
+    """
+    Returns the listener, creating it and attaching its handler to the root
+    logger if need be.
+    """
+    global _listener
+    with _listener_lock:
+        if _listener is None:
+            _listener = _Listener()
+            logging.getLogger().addHandler(
+                _QueueHandler(_listener, route=_route))
+            atexit.register(_listener.stop)
+        return _listener
+
+
+def config_root_logger(logfile=None, return_webserver=False):
+    """
+    Sets up the root logger. Call this in the main() of the file.
+
+    :param logfile: The filename to log to.
+    :param return_webserver: Whether or not to also create and return a
+           handler for the Flask webserver as well.
+    """
+    logger = logging.getLogger()
+    logger.setLevel(logging.DEBUG)
+    listener = _get_listener()
+    if logfile is not None:
+        listener.set_file(logfile)
+        if return_webserver:
+            return _QueueHandler(listener, targets=(_FILE,),
+                                 level=logging.WARNING)
+
+
+def setup_logger(log_name):
+    """
+    Return a logger configured for a particular module.
+
+    :param log_name: The name of the logger to use.
+    """
+    _get_listener()
+    # the mturk prefix is added so that it filters things that aren't mturk
+    logger = logging.getLogger('mturk.' + log_name)
     logger.setLevel(logging.DEBUG)
     return logger
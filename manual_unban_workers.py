@@ -7,8 +7,8 @@ from db import Set
 from mturk import MTurk
 import boto.mturk.connection
 import happybase
+import housekeeping
 from conf import *
-import boto.ses
 
 pool = happybase.ConnectionPool(size=8, host=DATABASE_LOCATION)
 dbget = Get(pool)
@@ -22,27 +22,10 @@ mtconn = boto.mturk.connection.MTurkConnection(
 mt = MTurk(mtconn)
 mt.setup_quals()
 
-emconn = boto.ses.connect_to_region('us-east-1')
-
-def dispatch_notification(message, subject='Notification'):
-    """
-    Dispatches a message to kryptonlabs99@gmail.com
-
-    :param message: The body of the message.
-    :param subject: The subject of the message.
-    """
-    emconn.send_email('ops@kryto.me', subject, message,
-                      ['kryptonlabs99@gmail.com'])
-
-
-print 'Checking if any bans can be lifted...'
-workers = dbget.get_all_workers()
-banned_workers = []
-for worker_id in workers:
-    if dbget.worker_is_banned(worker_id):
-        banned_workers.append(worker_id)
-        if not dbset.worker_ban_expires_in(worker_id):
-            mt.unban_worker(worker_id)
-            dispatch_notification('Worker %s has been unbanned' % str(
-                worker_id), subject="Unban notification")
+if dbset.create_ban_table():
+    dbset.rebuild_ban_index()
 
+# this is the periodic unban job, run once, so that the two can't drift apart.
+housekeeping.notifications.start()
+housekeeping.unban_workers(mt, dbget, dbset)
+housekeeping.notifications.stop()
@@ -1,12 +1,187 @@
 #!/usr/bin/env python
 
+import cPickle
+import collections
 import platform
+import select
 import socket
+import struct
 import threading
 import time
 import statemon
 from conf import *
 
+# the most datapoints in a single pickle message; carbon's pickle receiver
+# rejects very large messages.
+_PICKLE_CHUNK = 500
+
+def metric_path(name):
+    '''
+    Returns the full carbon path of a metric.
+    '''
+    node = platform.node().replace('.', '-')
+    if MONITORING_SERVICE_NAME:
+        return '%s.%s.%s' % (MONITORING_SERVICE_NAME, node, name)
+    return 'system.%s.%s' % (node, name)
+
+class CarbonExporter(object):
+    '''
+    Sends datapoints to a carbon server over a single persistent connection,
+    with every datapoint of a cycle serialized into one payload.
+
+    Datapoints are held in a bounded ring buffer until they have been sent,
+    so while the server is unreachable they accumulate (dropping the oldest
+    once the buffer is full) and are flushed once it can be reached again.
+    Reconnection attempts back off exponentially, so an unreachable server
+    costs a single connect timeout per attempt at most.
+    '''
+
+    def __init__(self, host=MONITORING_CARBON_SERVER,
+                 port=MONITORING_CARBON_PORT,
+                 protocol=MONITORING_CARBON_PROTOCOL,
+                 buffer_size=MONITORING_BUFFER_SIZE,
+                 timeout=MONITORING_SOCKET_TIMEOUT,
+                 max_backoff=MONITORING_MAX_BACKOFF):
+        '''
+        :param host: The carbon server's host.
+        :param port: The carbon server's port.
+        :param protocol: 'plaintext' or 'pickle'.
+        :param buffer_size: The most datapoints that are held.
+        :param timeout: The socket timeout, in seconds.
+        :param max_backoff: The longest wait between attempts to reconnect,
+                            in seconds.
+        :return: A CarbonExporter instance.
+        '''
+        if protocol not in ('plaintext', 'pickle'):
+            raise ValueError('Unknown carbon protocol: %s' % protocol)
+        self.host = host
+        self.port = port
+        self.protocol = protocol
+        self.timeout = timeout
+        self.max_backoff = max_backoff
+        self.n_dropped = 0  # the datapoints dropped from the full buffer
+        self._buffer = collections.deque(maxlen=buffer_size)
+        self._lock = threading.Lock()
+        self._sock = None
+        self._backoff = 0
+        self._next_connect = 0
+
+    def add(self, name, value, timestamp=None):
+        '''
+        Buffers a datapoint.
+
+        :param name: The metric's path.
+        :param value: The metric's value, as a number.
+        :param timestamp: The time of the datapoint. [def: now]
+        '''
+        if timestamp is None:
+            timestamp = int(time.time())
+        with self._lock:
+            if len(self._buffer) == self._buffer.maxlen:
+                self.n_dropped += 1
+            self._buffer.append((name, (timestamp, value)))
+
+    def pending(self):
+        '''
+        Returns the number of datapoints that have not yet been sent.
+        '''
+        return len(self._buffer)
+
+    def _connected(self):
+        '''
+        Returns True if the connection is open, connecting if it is not (and
+        the backoff has passed). The server never sends anything, so a
+        readable socket means it has been closed by the server.
+        '''
+        if self._sock is not None:
+            try:
+                readable, _, _ = select.select([self._sock], [], [], 0)
+                if not readable or self._sock.recv(1):
+                    return True
+            except (socket.error, select.error):
+                pass
+            self._disconnect()
+        if time.time() < self._next_connect:
+            return False
+        try:
+            self._sock = socket.create_connection((self.host, self.port),
+                                                  self.timeout)
+        except socket.error:
+            self._sock = None
+            self._backoff = min(max(2 * self._backoff, 1), self.max_backoff)
+            self._next_connect = time.time() + self._backoff
+            return False
+        self._backoff = 0
+        return True
+
+    def _disconnect(self):
+        if self._sock is not None:
+            try:
+                self._sock.close()
+            except socket.error:
+                pass
+        self._sock = None
+
+    def _serialize(self, datapoints):
+        '''
+        Serializes datapoints into a single payload.
+        '''
+        if self.protocol == 'pickle':
+            payload = cPickle.dumps(datapoints, 2)
+            return struct.pack('!L', len(payload)) + payload
+        return ''.join('%s %s %d\n' % (name, value, timestamp)
+                       for name, (timestamp, value) in datapoints)
+
+    def flush(self):
+        '''
+        Sends the buffered datapoints. Those that cannot be sent remain
+        buffered.
+
+        :return: True if the buffer was emptied.
+        '''
+        with self._lock:
+            while self._buffer:
+                if not self._connected():
+                    return False
+                if self.protocol == 'pickle':
+                    n = min(len(self._buffer), _PICKLE_CHUNK)
+                else:
+                    n = len(self._buffer)
+                datapoints = [self._buffer[i] for i in xrange(n)]
+                try:
+                    self._sock.sendall(self._serialize(datapoints))
+                except socket.error:
+                    self._disconnect()
+                    return False
+                for _ in xrange(n):
+                    self._buffer.popleft()
+            return True
+
+    def send(self, metrics, timestamp=None):
+        '''
+        Buffers datapoints and sends everything buffered.
+
+        :param metrics: An iterable of (path, value) pairs.
+        :param timestamp: The time of the datapoints. [def: now]
+        :return: True if the buffer was emptied.
+        '''
+        if timestamp is None:
+            timestamp = int(time.time())
+        for name, value in metrics:
+            self.add(name, value, timestamp)
+        return self.flush()
+
+    def close(self):
+        with self._lock:
+            self._disconnect()
+
+_exporter = None
+
+def _default_exporter():
+    global _exporter
+    if _exporter is None:
+        _exporter = CarbonExporter()
+    return _exporter
 
 def send_data(name, value):
     '''
@@ -14,52 +189,77 @@ def send_data(name, value):
 
     This is a best effort send
     '''
-        
-    node = platform.node().replace('.', '-')
-    timestamp = int(time.time())
-    if MONITORING_SERVICE_NAME:
-        data = '%s.%s.%s %s %d\n' % (MONITORING_SERVICE_NAME,
-                                     node,
-                                     name,
-                                     value,
-                                     timestamp)
-    else: 
-        data = 'system.%s.%s %s %d\n' % (node, 
-                                         name, 
-                                         value, 
-                                         timestamp)
-    sock = socket.socket()
-    sock.settimeout(20)
-    try:
-        sock.connect((MONITORING_CARBON_SERVER, MONITORING_CARBON_PORT))
-        sock.sendall(data)
-        sock.close()
-    except Exception, e:
-        pass
-        #print "excp", e
-
-def send_statemon_data():
-    m_vars = statemon.state.get_all_variables()
+    _default_exporter().send([(metric_path(name), value)])
+
+# the histogram quantiles that are exported.
+HISTOGRAM_QUANTILES = [('p50', .5), ('p90', .9), ('p99', .99)]
+
+# the bucket counts of each histogram when it was last collected.
+_last_counts = {}
+
+def collect_histogram_data(variable, m_value):
+    '''
+    Returns the number of values a histogram has observed and the quantiles
+    of the values observed since it was last collected, as (name, value)
+    pairs. The quantiles are omitted if there are no new values.
+    '''
+    counts, _ = m_value.snapshot()
+    last = _last_counts.get(variable, [0] * len(counts))
+    _last_counts[variable] = counts
+    data = [('%s.count' % variable, sum(counts))]
+    delta = [c - l for c, l in zip(counts, last)]
+    if min(delta) < 0:
+        # the histogram was reset since it was last collected.
+        delta = counts
+    if sum(delta) <= 0:
+        return data
+    qs = m_value.quantiles([q for _, q in HISTOGRAM_QUANTILES], delta)
+    for (suffix, _), value in zip(HISTOGRAM_QUANTILES, qs):
+        data.append(('%s.%s' % (variable, suffix), value))
+    return data
+
+def collect_statemon_data():
+    '''
+    Returns the values of the statemon variables as (name, value) pairs.
+    '''
+    data = []
+    for variable, m_value in statemon.state.get_all_variables().items():
+        if isinstance(m_value, statemon.Histogram):
+            data.extend(collect_histogram_data(variable, m_value))
+        else:
+            data.append((variable, m_value.value))
+    return data
+
+def send_statemon_data(exporter=None):
+    '''
+    Sends the values of the statemon variables in a single payload.
+
+    :param exporter: The CarbonExporter. [def: a module-wide one]
+    '''
+    if exporter is None:
+        exporter = _default_exporter()
+    data = collect_statemon_data()
     #Nothing to monitor
-    if len(m_vars) <= 0:
+    if len(data) <= 0:
         return
-
-    for variable, m_value in m_vars.iteritems():
-        send_data(variable, m_value.value)
+    exporter.send([(metric_path(name), value) for name, value in data])
 
 class MonitoringAgent(threading.Thread):
     '''
     Thread that monitors the statemon variables
     '''
 
-    def __init__(self):
+    def __init__(self, exporter=None):
         super(MonitoringAgent, self).__init__()
         self.daemon = True
+        self.exporter = exporter or CarbonExporter()
 
     def run(self):
         ''' Thread run loop
             Grab the statemon state variable and send its values
         '''
         while True:
-            send_statemon_data()
-            time.sleep(MONITORING_SLEEP_INTERVAL)
+            start = time.time()
+            send_statemon_data(self.exporter)
+            time.sleep(max(0, MONITORING_SLEEP_INTERVAL -
+                           (time.time() - start)))
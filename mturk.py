@@ -33,6 +33,10 @@ import boto.mturk.question
 import datetime
 import statemon
 import numpy as np
+import time
+from concurrent import futures
+from ratelimit import TokenBucket
+from ratelimit import retry_with_backoff
 
 _log = logger.setup_logger(__name__)
 
@@ -42,6 +46,9 @@ statemon.define("val_account_balance", float)
 statemon.define("n_hits_disposed", float)
 statemon.define("n_hits_disabled", float)
 statemon.define("val_hits_avail_to_workers", float)
+statemon.define("n_quota_resets")
+statemon.define("n_quota_reset_failures")
+statemon.define("val_quota_resets_per_sec", float)
 
 
 class _LocaleRequirement(boto.mturk.qualification.Requirement):
@@ -531,17 +538,20 @@ class MTurk(object):
             _log.error('Error revoking worker practice passed qualification: '
                        '%s' + e.message)
 
-    def reset_worker_daily_quota(self, worker_id):
+    def reset_worker_daily_quota(self, worker_id, verify=True):
         """
         Resets a worker's daily quota, allowing them to complete another
         round of tasks, as set by MAX_SUBMITS_PER_DAY (see conf.py)
 
         :param worker_id: The MTurk worker ID.
+        :param verify: If True, re-fetches the quota to ensure it was set.
         :return: None
         """
         try:
             self.mtconn.update_qualification_score(
                 self.quota_id, worker_id, value=MAX_SUBMITS_PER_DAY)
+            if not verify:
+                return
             cqval = self.get_qualification_score(self.quota_id,
                                                   worker_id)
             if cqval != MAX_SUBMITS_PER_DAY:
@@ -583,6 +593,143 @@ class MTurk(object):
             _log.error('Error resetting weekly practice quota for worker: %s',
                        e.message)
 
+    def _set_quota(self, qualification_id, worker_id, value, grant_value,
+                   bucket=None):
+        """
+        Sets a worker's quota qualification, granting it if the worker does
+        not have it yet. Unlike reset_worker_daily_quota, failures to grant
+        the qualification are raised, so that they can be retried.
+
+        :param qualification_id: The ID of the quota qualification.
+        :param worker_id: The MTurk worker ID.
+        :param value: The value to set the quota to.
+        :param grant_value: The value to grant the quota with, if the worker
+                            does not already have it.
+        :param bucket: A TokenBucket that every MTurk call must draw from.
+        :return: None
+        """
+        if bucket is not None:
+            bucket.acquire()
+        try:
+            self.mtconn.update_qualification_score(
+                qualification_id, worker_id, value=value)
+            return
+        except boto.mturk.connection.MTurkRequestError:
+            _log.debug('No quota %s for worker %s, trying to grant it',
+                       qualification_id, worker_id)
+        if bucket is not None:
+            bucket.acquire()
+        self.mtconn.assign_qualification(qualification_id, worker_id,
+                                         value=grant_value,
+                                         send_notification=False)
+
+    def _bulk_set_quota(self, name, qualification_id, value, grant_value,
+                        worker_ids, num_threads=QUOTA_RESET_THREADS,
+                        rate=QUOTA_RESET_RATE, retries=QUOTA_RESET_RETRIES):
+        """
+        Sets the quota qualification for many workers concurrently. The number
+        of in-flight requests is bounded by the number of threads, the overall
+        MTurk request rate is bounded by a token bucket, and each worker is
+        retried with exponential backoff before being counted as a failure.
+
+        :param name: The name of the quota, for logging.
+        :param qualification_id: The ID of the quota qualification.
+        :param value: The value to set the quota to.
+        :param grant_value: The value to grant the quota with, if the worker
+                            does not already have it.
+        :param worker_ids: An iterable of MTurk worker IDs.
+        :param num_threads: The number of concurrent requests.
+        :param rate: The maximum number of MTurk requests per second.
+        :param retries: The number of times to retry each worker.
+        :return: The number of workers whose quotas were reset and the number
+                 that failed, as a tuple.
+        """
+        bucket = TokenBucket(rate)
+        start = time.time()
+        last_report = start
+        n_done = 0
+        n_failed = 0
+        in_flight = dict()
+        max_in_flight = num_threads * 4
+        worker_iter = iter(worker_ids)
+        _log.info('Starting %s quota reset with %i threads at %.1f req/sec',
+                  name, num_threads, rate)
+        executor = futures.ThreadPoolExecutor(max_workers=num_threads)
+        try:
+            exhausted = False
+            while in_flight or not exhausted:
+                # keep the queue topped up, without reading every worker ID
+                # into memory at once.
+                while not exhausted and len(in_flight) < max_in_flight:
+                    try:
+                        worker_id = next(worker_iter)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    future = executor.submit(
+                        retry_with_backoff, self._set_quota,
+                        args=(qualification_id, worker_id, value, grant_value,
+                              bucket),
+                        retries=retries)
+                    in_flight[future] = worker_id
+                if not in_flight:
+                    break
+                finished, _ = futures.wait(
+                    in_flight.keys(), return_when=futures.FIRST_COMPLETED)
+                for future in finished:
+                    worker_id = in_flight.pop(future)
+                    if future.exception() is not None:
+                        n_failed += 1
+                        _log.error('Could not reset %s quota for worker %s: '
+                                   '%s', name, worker_id, future.exception())
+                    else:
+                        n_done += 1
+                if time.time() - last_report > QUOTA_RESET_REPORT_INTERVAL:
+                    last_report = time.time()
+                    _log.info('Reset %i %s quotas so far (%i failed), %.1f '
+                              'workers/sec', n_done, name, n_failed,
+                              (n_done + n_failed) / (last_report - start))
+        finally:
+            executor.shutdown(wait=True)
+        elapsed = time.time() - start
+        throughput = (n_done + n_failed) / max(elapsed, 1e-6)
+        _log.info('Finished %s quota reset: %i reset, %i failed in %.1f sec '
+                  '(%.1f workers/sec)', name, n_done, n_failed, elapsed,
+                  throughput)
+        try:
+            mon.increment('n_quota_resets', n_done)
+            mon.increment('n_quota_reset_failures', n_failed)
+            mon.val_quota_resets_per_sec = throughput
+        except Exception as e:
+            _log.warn('Error adjusting statemons: %s', e.message)
+        return n_done, n_failed
+
+    def bulk_reset_worker_daily_quotas(self, worker_ids, **kwargs):
+        """
+        Resets the daily quota of many workers concurrently. See
+        _bulk_set_quota for the keyword arguments.
+
+        :param worker_ids: An iterable of MTurk worker IDs.
+        :return: The number of workers whose quotas were reset and the number
+                 that failed, as a tuple.
+        """
+        return self._bulk_set_quota('daily', self.quota_id,
+                                    MAX_SUBMITS_PER_DAY, MAX_SUBMITS_PER_DAY,
+                                    worker_ids, **kwargs)
+
+    def bulk_reset_worker_weekly_practice_quotas(self, worker_ids, **kwargs):
+        """
+        Resets the weekly practice quota of many workers concurrently. See
+        _bulk_set_quota for the keyword arguments.
+
+        :param worker_ids: An iterable of MTurk worker IDs.
+        :return: The number of workers whose quotas were reset and the number
+                 that failed, as a tuple.
+        """
+        return self._bulk_set_quota('weekly practice', self.practice_quota_id,
+                                    WEEKLY_PRACTICE_LIM, NUM_PRACTICES,
+                                    worker_ids, **kwargs)
+
     def get_qualification_score(self, qualification_id, worker_id):
         """
         Wraps the equivalent function from mturk and returns the value
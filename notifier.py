@@ -0,0 +1,327 @@
+"""
+Exports a background dispatcher for operator notifications (e.g., emails
+about banned workers or errors), so that sending them never holds up a
+request, and so that a burst of similar events is sent as a single digest
+rather than a message per event.
+
+Every notification has a key, which defaults to its subject; notifications
+that differ only in their details (e.g., the worker ID) should share a key.
+The first notification of a key is sent right away, and those that follow
+within NOTIFICATION_DIGEST_WINDOW seconds are held and sent together as one
+digest once the window has passed. In addition, a token bucket bounds the
+rate of messages across all keys.
+
+The messages are sent by a transport:
+
+    SESTransport     - sends emails through Amazon SES
+    SMTPTransport    - sends emails through an SMTP server
+    FileTransport    - appends the messages to a file
+    MemoryTransport  - keeps the messages in a list, for tests
+"""
+
+import atexit
+import smtplib
+import threading
+import time
+from email.mime.text import MIMEText
+import boto.ses
+import logger
+import statemon
+from ratelimit import TokenBucket
+from conf import *
+
+_log = logger.setup_logger(__name__)
+
+_n_notifications_sent = statemon.define('n_notifications_sent')
+_n_notifications_failed = statemon.define('n_notifications_failed')
+_n_notifications_digested = statemon.define('n_notifications_digested')
+
+# the key under which notifications are gathered once there are too many
+# distinct keys pending.
+_OVERFLOW_KEY = '__overflow__'
+
+
+class SESTransport(object):
+    """
+    Sends messages as emails through Amazon SES.
+    """
+    def __init__(self, conn=None, source=NOTIFICATION_SOURCE,
+                 recipients=NOTIFICATION_RECIPIENTS, region='us-east-1'):
+        """
+        :param conn: A boto SES connection. [def: one is made to the region
+                     when the first message is sent]
+        :param source: The sender's address.
+        :param recipients: A list of the recipients' addresses.
+        :param region: The AWS region of the connection.
+        :return: A SESTransport instance.
+        """
+        self.conn = conn
+        self.source = source
+        self.recipients = recipients
+        self.region = region
+
+    def send(self, subject, body):
+        if self.conn is None:
+            self.conn = boto.ses.connect_to_region(self.region)
+        self.conn.send_email(self.source, subject, body, self.recipients)
+
+
+class SMTPTransport(object):
+    """
+    Sends messages as emails through an SMTP server.
+    """
+    def __init__(self, host='localhost', port=25,
+                 source=NOTIFICATION_SOURCE,
+                 recipients=NOTIFICATION_RECIPIENTS, timeout=30):
+        """
+        :param host: The SMTP server's host.
+        :param port: The SMTP server's port.
+        :param source: The sender's address.
+        :param recipients: A list of the recipients' addresses.
+        :param timeout: The connection timeout, in seconds.
+        :return: A SMTPTransport instance.
+        """
+        self.host = host
+        self.port = port
+        self.source = source
+        self.recipients = recipients
+        self.timeout = timeout
+
+    def send(self, subject, body):
+        msg = MIMEText(body)
+        msg['Subject'] = subject
+        msg['From'] = self.source
+        msg['To'] = ', '.join(self.recipients)
+        server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            server.sendmail(self.source, self.recipients, msg.as_string())
+        finally:
+            server.quit()
+
+
+class FileTransport(object):
+    """
+    Appends messages to a file.
+    """
+    def __init__(self, path):
+        """
+        :param path: The path to the file.
+        :return: A FileTransport instance.
+        """
+        self.path = path
+        self._lock = threading.Lock()
+
+    def send(self, subject, body):
+        with self._lock:
+            with open(self.path, 'a') as f:
+                f.write('Subject: %s\n\n%s\n\n%s\n\n' % (subject, body,
+                                                        '=' * 70))
+
+
+class MemoryTransport(object):
+    """
+    Keeps messages in a list, as (subject, body) tuples.
+    """
+    def __init__(self):
+        self.messages = []
+
+    def send(self, subject, body):
+        self.messages.append((subject, body))
+
+
+class _Pending(object):
+    """
+    The notifications of a key that have yet to be sent.
+    """
+    def __init__(self):
+        self.events = []  # the first (time, subject, body) events
+        self.count = 0  # the number of events, including those not kept
+        self.next_send = 0  # the earliest time the next message may be sent
+
+
+class Notifier(object):
+    """
+    Sends notifications from a background thread, with per-key digests and
+    an overall rate limit.
+    """
+    def __init__(self, transport, window=NOTIFICATION_DIGEST_WINDOW,
+                 rate=NOTIFICATION_RATE, burst=NOTIFICATION_BURST,
+                 max_events=NOTIFICATION_MAX_DIGEST_EVENTS,
+                 max_keys=NOTIFICATION_MAX_KEYS):
+        """
+        :param transport: The transport, an object with a send(subject, body)
+                          method.
+        :param window: The least time between two messages of a key, in
+                       seconds.
+        :param rate: The rate at which messages may be sent, per second.
+        :param burst: The most messages that may be sent at once.
+        :param max_events: The most events listed in a digest; the rest are
+                           counted.
+        :param max_keys: The most keys that may be pending; notifications of
+                         other keys are gathered into a single digest.
+        :return: A Notifier instance.
+        """
+        self.transport = transport
+        self.window = window
+        self.max_events = max_events
+        self.max_keys = max_keys
+        self._bucket = TokenBucket(rate, burst)
+        self._pending = {}  # maps keys to _Pending
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stopped = False
+
+    def start(self):
+        """
+        Starts the dispatcher thread; notifications made before it starts are
+        held until it does. The notifications still pending when the process
+        exits are sent.
+        """
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name='notifier')
+        self._thread.daemon = True
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def notify(self, subject, body, key=None):
+        """
+        Queues a notification. This never blocks on the transport.
+
+        :param subject: The subject of the message.
+        :param body: The body of the message.
+        :param key: The key under which the notification is rate limited and
+                    digested. [def: the subject]
+        """
+        key = key or subject
+        with self._cond:
+            if key not in self._pending and \
+                    len(self._pending) >= self.max_keys:
+                key = _OVERFLOW_KEY
+            pending = self._pending.setdefault(key, _Pending())
+            pending.count += 1
+            if len(pending.events) < self.max_events:
+                pending.events.append((time.time(), subject, body))
+            self._cond.notify()
+
+    def _message(self, key, events, count):
+        """
+        Returns the subject and body of the message for a key's events.
+        """
+        if count == 1:
+            return events[0][1], events[0][2]
+        if key == _OVERFLOW_KEY:
+            subject = '[%i notifications] Other notifications' % count
+        else:
+            subject = '[%i notifications] %s' % (count, events[0][1])
+        elems = []
+        for t, subj, body in events:
+            stamp = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(t))
+            elems.append('%s - %s\n\n%s' % (stamp, subj, body))
+        if count > len(events):
+            elems.append('... and %i more.' % (count - len(events)))
+        return subject, '\n\n----------------------------\n\n'.join(elems)
+
+    def _take_due(self, now, force=False):
+        """
+        Removes and returns the events of a key whose message is due, or
+        None if there is none. Must be called with the lock held.
+
+        :return: The key, its events and their count, or None; and the time
+                 at which the next message will be due, or None.
+        """
+        next_due = None
+        for key, pending in self._pending.iteritems():
+            if not pending.count:
+                continue
+            if force or pending.next_send <= now:
+                if not force and not self._bucket.try_acquire():
+                    return None, now + 1. / self._bucket.rate
+                taken = (key, pending.events, pending.count)
+                pending.events = []
+                pending.count = 0
+                pending.next_send = now + self.window
+                return taken, None
+            if next_due is None or pending.next_send < next_due:
+                next_due = pending.next_send
+        return None, next_due
+
+    def _expire(self, now):
+        """
+        Forgets the keys that have nothing pending and whose window has
+        passed. Must be called with the lock held.
+        """
+        for key in [k for k, p in self._pending.iteritems()
+                    if not p.count and p.next_send <= now]:
+            del self._pending[key]
+
+    def _requeue(self, key, events, count):
+        """
+        Puts back the events of a message that could not be sent, so that
+        they are sent with the key's next message.
+        """
+        with self._cond:
+            pending = self._pending.setdefault(key, _Pending())
+            pending.count += count
+            pending.events = (events + pending.events)[:self.max_events]
+
+    def _send(self, key, events, count):
+        subject, body = self._message(key, events, count)
+        try:
+            self.transport.send(subject, body)
+        except Exception as e:
+            _log.error('Could not send notification %r: %s', subject,
+                       e.message)
+            try:
+                _n_notifications_failed.increment()
+            except Exception as e:
+                _log.warn('Could not increment statemons: %s' % e.message)
+            self._requeue(key, events, count)
+            return
+        try:
+            _n_notifications_sent.increment()
+            _n_notifications_digested.increment(count - 1)
+        except Exception as e:
+            _log.warn('Could not increment statemons: %s' % e.message)
+
+    def flush(self):
+        """
+        Sends everything that is pending now, regardless of the windows and
+        the rate limit. Each key is attempted once.
+        """
+        with self._cond:
+            now = time.time()
+            taken = []
+            while True:
+                item, _ = self._take_due(now, force=True)
+                if item is None:
+                    break
+                taken.append(item)
+        for item in taken:
+            self._send(*item)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    if self._stopped:
+                        return
+                    now = time.time()
+                    self._expire(now)
+                    taken, next_due = self._take_due(now)
+                    if taken is not None:
+                        break
+                    self._cond.wait(None if next_due is None else
+                                    max(next_due - now, 0.01))
+            self._send(*taken)
+
+    def stop(self):
+        """
+        Stops the dispatcher thread and sends everything that is pending.
+        """
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join(10)
+        self.flush()
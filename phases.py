@@ -0,0 +1,167 @@
+"""
+Records the time spent in each phase of a request, e.g., the MTurk calls,
+the database reads and the page generation of /task.
+
+A view is wrapped with the request() decorator, which keeps a span recorder
+on Flask's g for the duration of the request, and the phases within it are
+wrapped with the phase() context manager:
+
+    @app.route('/task')
+    @phases.request('task')
+    def task():
+        with phases.phase('get_hit'):
+            hit = mt.get_hit(hit_id)
+
+The duration of every phase is observed by a statemon timer,
+ms_phase_<name>, whether or not it is within a request. Requests that take
+longer than SLOW_REQUEST_THRESHOLD milliseconds are logged as a single JSON
+line, with the start, duration and nesting depth of each of their phases
+and a summary of the database calls they made (see dbpool).
+"""
+
+import functools
+import json
+import threading
+import time
+from flask import g
+from flask import has_request_context
+import dbpool
+import logger
+import statemon
+from conf import *
+
+_log = logger.setup_logger(__name__)
+
+# maps phase names to their timers.
+_timers = {}
+_timers_lock = threading.Lock()
+
+
+def _timer(name):
+    """
+    Returns the statemon timer of a phase, defining it if need be.
+
+    :param name: The name of the phase.
+    :return: The statemon.Timer.
+    """
+    try:
+        return _timers[name]
+    except KeyError:
+        with _timers_lock:
+            if name not in _timers:
+                _timers[name] = statemon.state.define_histogram(
+                    'ms_phase_%s' % name, timer=True)
+            return _timers[name]
+
+
+class _Recorder(object):
+    """
+    Records the phases of a single request.
+    """
+    def __init__(self, name):
+        self.name = name
+        self.start = time.time()
+        # [phase name, start offset ms, duration ms, nesting depth]
+        self.spans = []
+        self.depth = 0  # the number of phases currently open
+        self.annotations = {}
+
+    def record(self, name, start, end, depth):
+        self.spans.append([name, round((start - self.start) * 1000., 1),
+                           round((end - start) * 1000., 1), depth])
+
+
+def _recorder():
+    """
+    Returns the recorder of the current request, or None if there is none.
+    """
+    if not has_request_context():
+        return None
+    return getattr(g, '_phase_recorder', None)
+
+
+class phase(object):
+    """
+    A context manager that records the time spent in a phase.
+    """
+    def __init__(self, name):
+        """
+        :param name: The name of the phase.
+        """
+        self.name = name
+
+    def __enter__(self):
+        self._recorder = _recorder()
+        if self._recorder is not None:
+            self._depth = self._recorder.depth
+            self._recorder.depth += 1
+        self._start = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        end = time.time()
+        try:
+            _timer(self.name).observe((end - self._start) * 1000.)
+            if self._recorder is not None:
+                self._recorder.depth = self._depth
+                self._recorder.record(self.name, self._start, end,
+                                      self._depth)
+        except Exception as e:
+            _log.warn('Could not record phase %s: %s', self.name, e.message)
+        return False
+
+
+def annotate(**kwargs):
+    """
+    Adds fields to the slow request log line of the current request, e.g.,
+    the HIT ID. Does nothing outside a request.
+    """
+    recorder = _recorder()
+    if recorder is not None:
+        recorder.annotations.update(kwargs)
+
+
+def _log_if_slow(recorder, end, scope):
+    """
+    Logs a request if it took longer than SLOW_REQUEST_THRESHOLD, with its
+    phases and the database calls it made.
+    """
+    total = (end - recorder.start) * 1000.
+    if total < SLOW_REQUEST_THRESHOLD:
+        return
+    accounted = sum(span[2] for span in recorder.spans if not span[3])
+    entry = {'request': recorder.name,
+             'ms': round(total, 1),
+             'phases': sorted(recorder.spans,
+                              key=lambda span: (span[1], span[3])),
+             'ms_unaccounted': round(max(total - accounted, 0.), 1)}
+    if scope is not None:
+        entry['db'] = scope.summary()
+    entry.update(recorder.annotations)
+    _log.warn('Slow request: %s', json.dumps(entry, sort_keys=True))
+
+
+def request(name):
+    """
+    Decorates a Flask view so that the phases of its requests are recorded.
+
+    :param name: The name of the request, as it appears in the log.
+    :return: The decorator.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def recorded(*args, **kwargs):
+            recorder = _Recorder(name)
+            g._phase_recorder = recorder
+            scope = None
+            try:
+                with dbpool.attribute(name) as scope:
+                    return func(*args, **kwargs)
+            finally:
+                g._phase_recorder = None
+                try:
+                    _log_if_slow(recorder, time.time(), scope)
+                except Exception as e:
+                    _log.warn('Could not log request phases: %s', e.message)
+        return recorded
+    return decorator
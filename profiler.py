@@ -0,0 +1,184 @@
+"""
+Exports on-demand profilers for a running process, which need no restart.
+
+sample_stacks() samples the stack of every thread (but its own) at a fixed
+interval for a number of seconds, using sys._current_frames(), and
+collapse() formats the samples as collapsed stacks--one line per distinct
+stack, its frames from the outermost to the innermost separated by
+semicolons, followed by the number of samples--which flamegraph.pl and
+speedscope read directly.
+
+RequestProfiler runs cProfile over the next K requests: it is armed with
+arm(K), and start() and stop() are called at the beginning and the end of
+every request; report() returns the accumulated statistics.
+"""
+
+import cProfile
+import collections
+import os.path
+import pstats
+import sys
+import thread
+import threading
+import time
+import cStringIO
+import logger
+
+_log = logger.setup_logger(__name__)
+
+# the longest a sampling run may last, in seconds.
+MAX_SAMPLE_SECONDS = 300
+# the shortest interval between samples, in seconds.
+MIN_SAMPLE_INTERVAL = 0.001
+
+# only one sampling run at a time.
+_sampling_lock = threading.Lock()
+
+
+def _frame_label(frame):
+    """
+    Returns the label of a frame in a collapsed stack, which identifies its
+    function (rather than the line being executed, so that the samples of a
+    function are not split by line).
+    """
+    code = frame.f_code
+    return '%s (%s:%d)' % (code.co_name, os.path.basename(code.co_filename),
+                           code.co_firstlineno)
+
+
+def sample_stacks(seconds, interval=0.005, by_thread=False):
+    """
+    Samples the stacks of every other thread.
+
+    :param seconds: How long to sample for, at most MAX_SAMPLE_SECONDS.
+    :param interval: The time between samples, in seconds.
+    :param by_thread: If True, the root of each stack is its thread's name.
+    :return: A Counter mapping collapsed stacks to their number of samples,
+             and the number of times the threads were sampled; or None, None
+             if another sampling run is in progress.
+    """
+    seconds = min(max(seconds, 0), MAX_SAMPLE_SECONDS)
+    interval = max(interval, MIN_SAMPLE_INTERVAL)
+    if not _sampling_lock.acquire(False):
+        return None, None
+    try:
+        _log.info('Sampling stacks for %.1fs every %.3fs', seconds, interval)
+        me = thread.get_ident()
+        counts = collections.Counter()
+        labels = {}  # caches the labels of code objects
+        n_samples = 0
+        deadline = time.time() + seconds
+        while time.time() < deadline:
+            names = {}
+            if by_thread:
+                names = dict((t.ident, t.name) for t in threading.enumerate())
+            for ident, frame in sys._current_frames().iteritems():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    label = labels.get(code)
+                    if label is None:
+                        label = labels[code] = _frame_label(frame)
+                    stack.append(label)
+                    frame = frame.f_back
+                if by_thread:
+                    stack.append(names.get(ident, str(ident)))
+                stack.reverse()
+                counts[';'.join(stack)] += 1
+            n_samples += 1
+            time.sleep(interval)
+        return counts, n_samples
+    finally:
+        _sampling_lock.release()
+
+
+def collapse(counts):
+    """
+    Formats sampled stacks as collapsed stacks.
+
+    :param counts: A mapping of collapsed stacks to their number of samples,
+                   as returned by sample_stacks().
+    :return: The collapsed stacks, as a string.
+    """
+    return ''.join('%s %d\n' % (stack, n) for stack, n in
+                   sorted(counts.iteritems()))
+
+
+class RequestProfiler(object):
+    """
+    Profiles the next K requests with cProfile. Each request is profiled in
+    the thread that serves it, and the statistics of all of them are
+    accumulated.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._remaining = 0  # the number of requests left to profile
+        self._stats = None
+        self.n_profiled = 0
+
+    def arm(self, n):
+        """
+        Profiles the next n requests, discarding the statistics of earlier
+        ones.
+
+        :param n: The number of requests.
+        """
+        with self._lock:
+            self._remaining = n
+            self._stats = None
+            self.n_profiled = 0
+        _log.info('Profiling the next %i requests', n)
+
+    @property
+    def remaining(self):
+        return self._remaining
+
+    def start(self):
+        """
+        Starts profiling the current request, if the profiler is armed.
+        """
+        if self._remaining <= 0:
+            return
+        with self._lock:
+            if self._remaining <= 0:
+                return
+            self._remaining -= 1
+        profile = cProfile.Profile()
+        self._local.profile = profile
+        profile.enable()
+
+    def stop(self):
+        """
+        Stops profiling the current request, if it is being profiled.
+        """
+        profile = getattr(self._local, 'profile', None)
+        if profile is None:
+            return
+        profile.disable()
+        self._local.profile = None
+        with self._lock:
+            if self._stats is None:
+                self._stats = pstats.Stats(profile)
+            else:
+                self._stats.add(profile)
+            self.n_profiled += 1
+
+    def report(self, sort='cumulative', limit=100):
+        """
+        Returns the accumulated statistics.
+
+        :param sort: The pstats sort key.
+        :param limit: The number of functions to list.
+        :return: The statistics, as a string, or None if no requests have
+                 been profiled.
+        """
+        with self._lock:
+            if self._stats is None:
+                return None
+            out = cStringIO.StringIO()
+            self._stats.stream = out
+            self._stats.sort_stats(sort).print_stats(limit)
+            return out.getvalue()
@@ -0,0 +1,186 @@
+"""
+Computes bootstrap confidence intervals for the scores returned by
+rank_from_wm.rank(). Each replicate resamples the individual win
+observations with Poisson(1) weights--so the count W_ij becomes a
+Poisson(W_ij) draw, which takes a single pass over the nonzeros of W--and
+re-ranks the result. Replicates are ranked in a process pool, each warm
+started from the solution for the original matrix, and partial intervals
+may be consumed as replicates finish.
+"""
+
+import copy
+import logging
+import multiprocessing
+import time
+import numpy as np
+from ranking.ranker import Ranker
+from ranking.ranker import _clean_win_matrix
+
+_log = logging.getLogger(__name__)
+
+# the state shared by the replicates in a worker process, set by _init_worker.
+_worker_W = None
+_worker_ranker = None
+
+
+def resample(W, seed):
+    """
+    Draws a bootstrap replicate of a win matrix, giving each win observation
+    a Poisson(1) weight.
+
+    :param W: The N x N win matrix, in CSR format.
+    :param seed: The random seed of the replicate.
+    :return: The resampled N x N win matrix, in CSR format.
+    """
+    rs = np.random.RandomState(seed)
+    Wr = W.copy()
+    Wr.data = rs.poisson(W.data).astype(float)
+    Wr.eliminate_zeros()
+    return Wr
+
+
+def _init_worker(W, ranker):
+    """
+    Stores the win matrix and the ranker, which holds the solution for the
+    original matrix, in a worker process.
+    """
+    global _worker_W, _worker_ranker
+    _worker_W = W
+    _worker_ranker = ranker
+
+
+def _replicate(seed):
+    """
+    Ranks a single bootstrap replicate in a worker process, warm started from
+    the solution for the original matrix.
+
+    :param seed: The random seed of the replicate.
+    :return: The seed and the replicate's scores, as float32.
+    """
+    # Ranker.rank() replaces, rather than modifies, its state, so a shallow
+    # copy leaves the original solution intact for the next replicate.
+    ranker = copy.copy(_worker_ranker)
+    scores = ranker.rank(resample(_worker_W, seed))
+    return seed, scores.astype(np.float32)
+
+
+def _intervals(samples, alpha):
+    """
+    Computes percentile intervals from bootstrap samples.
+
+    :param samples: An R x N array of the replicates' scores.
+    :param alpha: The intervals cover 1 - alpha of the replicates.
+    :return: The lower and upper bounds, as length-N arrays.
+    """
+    lo, hi = np.percentile(samples, [50. * alpha, 100 - 50. * alpha], axis=0)
+    return lo, hi
+
+
+def iter_bootstrap(W, n_replicates=200, alpha=0.05, mean=1.0, tol=1e-8,
+                   workers=None, seed=0, timeout=None, report_every=10):
+    """
+    Computes bootstrap confidence intervals for the ranks of a win matrix,
+    yielding the intervals computed so far as replicates finish. If the
+    timeout elapses, the outstanding replicates are abandoned and the final
+    intervals are those of the replicates that finished.
+
+    NOTES:
+        The replicates' scores are kept as float32, which for 200 replicates
+        of 1M items is 800MB.
+
+    :param W: An N x N win matrix, as in rank_from_wm.rank().
+    :param n_replicates: The number of bootstrap replicates.
+    :param alpha: The intervals cover 1 - alpha of the replicates.
+    :param mean: The mean value of the rankings, as in rank_from_wm.rank().
+    :param tol: The tolerance of the iterative solver; the replicates need
+                far less precision than their spread.
+    :param workers: The number of processes. [def: the number of CPUs]
+    :param seed: The random seed; replicate i uses seed + i, so the results
+                 do not depend on the number of workers.
+    :param timeout: The maximum time to spend on replicates, in seconds, or
+                    None.
+    :param report_every: Yield partial intervals after this many replicates.
+    :return: A generator of (number of replicates, lower bounds, upper
+             bounds) tuples, the last of which covers all the replicates
+             that finished.
+    """
+    W = _clean_win_matrix(W)
+    ranker = Ranker(mean=mean, tol=tol)
+    ranker.rank(W)
+    return _iter_bootstrap(W, ranker, n_replicates, alpha, workers, seed,
+                           timeout, report_every)
+
+
+def _iter_bootstrap(W, ranker, n_replicates, alpha, workers, seed, timeout,
+                    report_every):
+    """
+    Runs the replicates for iter_bootstrap(), given the cleaned win matrix
+    and a ranker holding its solution.
+    """
+    n = W.shape[0]
+    workers = workers or multiprocessing.cpu_count()
+    samples = np.zeros((n_replicates, n), dtype=np.float32)
+    done = 0
+    deadline = None if timeout is None else time.time() + timeout
+    pool = multiprocessing.Pool(workers, initializer=_init_worker,
+                                initargs=(W, ranker))
+    try:
+        results = pool.imap_unordered(_replicate,
+                                      range(seed, seed + n_replicates))
+        while done < n_replicates:
+            if deadline is None:
+                _, scores = results.next()
+            else:
+                remaining = deadline - time.time()
+                try:
+                    if remaining <= 0:
+                        raise multiprocessing.TimeoutError()
+                    _, scores = results.next(timeout=remaining)
+                except multiprocessing.TimeoutError:
+                    _log.warning('Bootstrap timed out after %i of %i '
+                                 'replicates', done, n_replicates)
+                    break
+            # replicates are stored in the order they finish; the intervals
+            # do not depend on it.
+            samples[done] = scores
+            done += 1
+            if done < n_replicates and not done % report_every:
+                yield (done,) + _intervals(samples[:done], alpha)
+    finally:
+        pool.terminate()
+        pool.join()
+    if not done:
+        yield 0, np.full(n, np.nan), np.full(n, np.nan)
+        return
+    yield (done,) + _intervals(samples[:done], alpha)
+
+
+def bootstrap(W, n_replicates=200, alpha=0.05, mean=1.0, tol=1e-8,
+              workers=None, seed=0, timeout=None):
+    """
+    Computes the ranks of a win matrix along with bootstrap confidence
+    intervals for them.
+
+    :param W: An N x N win matrix, as in rank_from_wm.rank().
+    :param n_replicates: The number of bootstrap replicates.
+    :param alpha: The intervals cover 1 - alpha of the replicates.
+    :param mean: The mean value of the rankings, as in rank_from_wm.rank().
+    :param tol: The tolerance of the iterative solver for the replicates.
+    :param workers: The number of processes. [def: the number of CPUs]
+    :param seed: The random seed.
+    :param timeout: The maximum time to spend on replicates, in seconds, or
+                    None.
+    :return: The scores, the lower and upper bounds of their intervals (all
+             length-N arrays) and the number of replicates used.
+    """
+    W = _clean_win_matrix(W)
+    ranker = Ranker(mean=mean)
+    scores = ranker.rank(W)
+    # the replicates are warm started from the precise solution, but only
+    # solved to the looser tolerance.
+    ranker.tol = tol
+    for n_done, lo, hi in _iter_bootstrap(W, ranker, n_replicates, alpha,
+                                          workers, seed, timeout,
+                                          n_replicates):
+        pass
+    return scores, lo, hi, n_done
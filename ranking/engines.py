@@ -0,0 +1,250 @@
+"""
+Exports interchangeable ranking engines. Every engine accepts the same input
+as rank_from_wm.rank()--an N x N win matrix W, dense or sparse, whose entry
+i,j is the number of times item i was chosen over item j--and returns a
+length-N array of scores, normalized so that within each connected group of
+items the mean score is `mean` (or, if mean is None, the scores sum to 1).
+
+    RankCentralityEngine    - RankCentrality, solved with GMRES (rank())
+    PowerIterationEngine    - RankCentrality, solved by power iteration
+    BradleyTerryMMEngine    - Bradley-Terry maximum likelihood, by MM
+
+Engines are registered by name in ENGINES; use get_engine() to build one.
+"""
+
+import logging
+import numpy as np
+from scipy import sparse
+from ranking.rank_from_wm import _markov_stationary_components
+from ranking.rank_from_wm import _w_to_p
+
+_log = logging.getLogger(__name__)
+
+
+def _clean_win_matrix(W):
+    """
+    Converts a win matrix into a float COO matrix without self-comparisons,
+    explicit zeros or duplicate entries.
+
+    :param W: An N x N win matrix.
+    :return: The N x N COO win matrix.
+    """
+    W = sparse.coo_matrix(W, dtype=float)
+    keep = (W.row != W.col) & (W.data != 0)
+    W = sparse.coo_matrix((W.data[keep], (W.row[keep], W.col[keep])),
+                          shape=W.shape)
+    W.sum_duplicates()
+    return W
+
+
+def _transition_matrix(W):
+    """
+    Builds the RankCentrality transition matrix of a win matrix, which the
+    RankCentrality engines find the stationary state of.
+
+    :param W: An N x N win matrix.
+    :return: The N x N sparse transition matrix P, as in
+             rank_from_wm._w_to_p().
+    """
+    return _w_to_p(W)
+
+
+def _normalize(p, labels, mean=1.0):
+    """
+    Rescales scores so that each group's mean is `mean`, or so that each
+    group's scores sum to 1 if mean is None.
+
+    :param p: A length-N array of non-negative scores.
+    :param labels: A length-N array of group labels.
+    :param mean: The mean score, as in rank_from_wm.rank().
+    :return: The rescaled scores.
+    """
+    sums = np.bincount(labels, weights=p)
+    if mean is None:
+        totals = np.ones(len(sums))
+    else:
+        totals = np.bincount(labels) * float(mean)
+    scale = np.ones(len(sums))
+    np.divide(totals, sums, out=scale, where=sums > 0)
+    return p * scale[labels]
+
+
+class RankingEngine(object):
+    """
+    The base class of the ranking engines. Subclasses implement _rank(),
+    which is only called for win matrices with more than one item.
+    """
+    name = None
+
+    def __init__(self, mean=1.0):
+        """
+        :param mean: The mean value of the rankings, as in
+                     rank_from_wm.rank().
+        :return: A RankingEngine instance.
+        """
+        self.mean = mean
+
+    def rank(self, W):
+        """
+        Computes the scores of the items in a win matrix.
+
+        :param W: An N x N matrix whose entries i,j are integers, indicating
+                  the number of times i has been chosen over j.
+        :return: A length-N numpy array of floats corresponding to the ranks
+                 of each item.
+        """
+        if 1 >= W.size:
+            return np.array([1.0]*W.size)
+        return self._rank(W)
+
+    def _rank(self, W):
+        raise NotImplementedError()
+
+
+class RankCentralityEngine(RankingEngine):
+    """
+    RankCentrality, solving each strongly connected component with GMRES.
+    This is rank_from_wm.rank().
+    """
+    name = 'rank_centrality'
+
+    def __init__(self, mean=1.0, tol=1e-12, workers=None):
+        """
+        :param mean: The mean value of the rankings, as in
+                     rank_from_wm.rank().
+        :param tol: The tolerance, as in rank_from_wm.rank().
+        :param workers: The number of processes, as in rank_from_wm.rank().
+        :return: A RankCentralityEngine instance.
+        """
+        super(RankCentralityEngine, self).__init__(mean)
+        self.tol = tol
+        self.workers = workers
+
+    def _rank(self, W):
+        return _markov_stationary_components(
+            _transition_matrix(W), mean=self.mean, tol=self.tol,
+            workers=self.workers)
+
+
+class PowerIterationEngine(RankingEngine):
+    """
+    RankCentrality, finding the stationary state of every strongly connected
+    component at once by power iteration on the block-diagonal part of P.
+    Each step is a single sparse mat-vec, followed by rescaling each
+    component; the lazy chain (I + P) / 2 is used since it has the same
+    stationary state but is guaranteed to be aperiodic.
+    """
+    name = 'power_iteration'
+
+    def __init__(self, mean=1.0, tol=1e-10, max_iter=10000):
+        """
+        :param mean: The mean value of the rankings, as in
+                     rank_from_wm.rank().
+        :param tol: The largest change in any (normalized) score at which
+                    the iteration is deemed to have converged.
+        :param max_iter: The maximum number of iterations.
+        :return: A PowerIterationEngine instance.
+        """
+        super(PowerIterationEngine, self).__init__(mean)
+        self.tol = tol
+        self.max_iter = max_iter
+        self.n_iter = 0
+
+    def _rank(self, W):
+        P = _transition_matrix(W).tocoo()
+        n = P.shape[0]
+        _, labels = sparse.csgraph.connected_components(
+            P, directed=True, connection='strong')
+        # drop the transitions between components.
+        keep = labels[P.row] == labels[P.col]
+        PT = sparse.csr_matrix((P.data[keep] / 2, (P.col[keep], P.row[keep])),
+                               shape=(n, n))
+        p = _normalize(np.ones(n), labels, self.mean)
+        for self.n_iter in xrange(1, self.max_iter + 1):
+            p_new = _normalize(PT.dot(p) + p / 2, labels, self.mean)
+            delta = np.max(np.abs(p_new - p))
+            p = p_new
+            if delta < self.tol:
+                break
+        else:
+            _log.warning('Power iteration did not converge, delta is %g',
+                         delta)
+        return p
+
+
+class BradleyTerryMMEngine(RankingEngine):
+    """
+    The maximum likelihood Bradley-Terry scores, found with the MM algorithm
+    of Hunter, 2004:
+
+        p_i <- w_i / sum_j n_ij / (p_i + p_j)
+
+    where w_i is the number of wins of item i and n_ij the number of
+    comparisons between i and j. Each iteration is vectorized over the
+    nonzero entries of W. Since the MLE does not exist for items that never
+    win (or never lose), every compared pair is given `prior` pseudo-wins in
+    each direction.
+    """
+    name = 'bradley_terry'
+
+    def __init__(self, mean=1.0, tol=1e-10, max_iter=10000, prior=0.5):
+        """
+        :param mean: The mean value of the rankings, as in
+                     rank_from_wm.rank().
+        :param tol: The largest change in any (normalized) score at which
+                    the iteration is deemed to have converged.
+        :param max_iter: The maximum number of iterations.
+        :param prior: The pseudo-wins given to either item of every compared
+                      pair.
+        :return: A BradleyTerryMMEngine instance.
+        """
+        super(BradleyTerryMMEngine, self).__init__(mean)
+        self.tol = tol
+        self.max_iter = max_iter
+        self.prior = prior
+        self.n_iter = 0
+
+    def _rank(self, W):
+        W = _clean_win_matrix(W)
+        n = W.shape[0]
+        # N = W + W^T, the number of comparisons of each pair.
+        N = (W + W.T).tocoo()
+        i, j = N.row, N.col
+        n_ij = N.data + 2 * self.prior
+        wins = np.asarray(W.sum(1)).ravel() + \
+            self.prior * np.bincount(i, minlength=n)
+        _, labels = sparse.csgraph.connected_components(N, directed=False)
+        p = _normalize(np.ones(n), labels, self.mean)
+        for self.n_iter in xrange(1, self.max_iter + 1):
+            denom = np.bincount(i, weights=n_ij / (p[i] + p[j]), minlength=n)
+            p_new = p.copy()
+            np.divide(wins, denom, out=p_new, where=denom > 0)
+            p_new = _normalize(p_new, labels, self.mean)
+            delta = np.max(np.abs(p_new - p))
+            p = p_new
+            if delta < self.tol:
+                break
+        else:
+            _log.warning('MM did not converge, delta is %g', delta)
+        return p
+
+
+ENGINES = dict((engine.name, engine) for engine in
+               [RankCentralityEngine, PowerIterationEngine,
+                BradleyTerryMMEngine])
+
+
+def get_engine(name, **kwargs):
+    """
+    Instantiates a ranking engine by name.
+
+    :param name: The engine's name, a key of ENGINES.
+    :param kwargs: The keyword arguments to the engine's constructor.
+    :return: The engine.
+    """
+    try:
+        engine = ENGINES[name]
+    except KeyError:
+        raise ValueError('Unknown ranking engine %s, choose from %s' %
+                         (name, ', '.join(sorted(ENGINES))))
+    return engine(**kwargs)
@@ -0,0 +1,201 @@
+"""
+Exports metrics that score estimated item scores against the ground truth.
+Every metric accepts the estimated scores o and the ground truth scores w,
+as length-N arrays, and higher is *always* better.
+
+    weighted_kemeny_distance        - the metric of the Shah paper
+    weighted_kemeny_distance_ratio  - the above, normalized by its maximum
+    kendall_tau_score               - Kendall's tau-b
+    spearman_score                  - Spearman's rank correlation
+
+The weighted Kemeny distances weight each pair of items whose order is
+wrong (or tied in o) by the squared difference of their true scores. Rather
+than visiting every pair, the misordered pairs are summed in O(N log N) with
+Fenwick trees, and the total over all pairs has a closed form. The O(N^2)
+loops they replace are kept as the *_reference functions.
+"""
+
+import numpy as np
+import scipy.stats
+
+
+def _misordered_weight(o, w):
+    """
+    Sums (w_i - w_j)^2 over the pairs of items that o orders the opposite
+    way to w, or ties.
+
+    Items are visited in ascending order of o; for each, the pairs with the
+    items already visited whose w is strictly higher are discordant, and
+
+        sum_i (w_i - w_j)^2 = c w_j^2 - 2 w_j sum_i w_i + sum_i w_i^2
+
+    so Fenwick trees over the rank of w accumulate the count, sum and sum of
+    squares of the visited items. The pairs within a group of items tied in
+    o sum to g sum_i (w_i - mean(w))^2 over the group's g items.
+
+    :param o: The estimated scores.
+    :param w: The ground truth scores.
+    :return: The sum, as a float.
+    """
+    n = len(w)
+    order = np.argsort(o, kind='mergesort')
+    o_sorted = o[order]
+    w_sorted = w[order]
+    # the 1-based rank of each w among the distinct values of w.
+    values, ranks = np.unique(w_sorted, return_inverse=True)
+    m = len(values)
+    ranks = (ranks + 1).tolist()
+    w_list = w_sorted.tolist()
+    o_list = o_sorted.tolist()
+    cnt = [0] * (m + 1)
+    s1 = [0.] * (m + 1)
+    s2 = [0.] * (m + 1)
+    tot_cnt = 0
+    tot_s1 = 0.
+    tot_s2 = 0.
+    total = 0.
+    start = 0
+    while start < n:
+        stop = start + 1
+        while stop < n and o_list[stop] == o_list[start]:
+            stop += 1
+        for k in xrange(start, stop):
+            # the items with a strictly higher w are those visited, less
+            # those with a lower or equal w.
+            idx = ranks[k]
+            c = 0
+            a = 0.
+            b = 0.
+            while idx > 0:
+                c += cnt[idx]
+                a += s1[idx]
+                b += s2[idx]
+                idx -= idx & -idx
+            c = tot_cnt - c
+            if c:
+                wk = w_list[k]
+                total += (c * wk * wk - 2 * wk * (tot_s1 - a) +
+                          (tot_s2 - b))
+        if stop - start > 1:
+            group = w_sorted[start:stop]
+            total += (stop - start) * np.sum((group - np.mean(group)) ** 2)
+        for k in xrange(start, stop):
+            idx = ranks[k]
+            wk = w_list[k]
+            tot_cnt += 1
+            tot_s1 += wk
+            tot_s2 += wk * wk
+            while idx <= m:
+                cnt[idx] += 1
+                s1[idx] += wk
+                s2[idx] += wk * wk
+                idx += idx & -idx
+        start = stop
+    return total
+
+
+def _kemeny_sums(o, w):
+    """
+    Computes the weight of the pairs of items that are misordered and the
+    weight of all pairs.
+
+    :param o: The estimated scores.
+    :param w: The ground truth scores.
+    :return: The misordered weight and the total weight, as floats.
+    """
+    o = np.asarray(o, dtype=float)
+    w = np.asarray(w, dtype=float)
+    # sum_{i<j} (w_i - w_j)^2 = N sum_i (w_i - mean(w))^2
+    total = len(w) * np.sum((w - np.mean(w)) ** 2)
+    return max(_misordered_weight(o, w), 0.), total
+
+
+def weighted_kemeny_distance(o, w):
+    """
+    The scoring metric in the Shah paper.
+
+    :param o: The item-wise calculated scores.
+    :param w: The item-wise ground truth scores.
+    :return: The score quantity.
+    """
+    sum_score, _ = _kemeny_sums(o, w)
+    denom = 2 * len(w) * np.sum(np.asarray(w, dtype=float) ** 2)
+    return 1 - np.sqrt(sum_score / denom)
+
+
+def weighted_kemeny_distance_ratio(o, w):
+    """
+    The scoring metric in the Shah paper, divided by its largest possible
+    value.
+
+    :param o: The item-wise calculated scores.
+    :param w: The item-wise ground truth scores.
+    :return: The score quantity.
+    """
+    sum_score, tot_pos_score = _kemeny_sums(o, w)
+    if not tot_pos_score:
+        return np.nan
+    return 1 - np.sqrt(sum_score / tot_pos_score)
+
+
+def kendall_tau_score(o, w):
+    """
+    Kendall's tau-b between the calculated and the ground truth scores.
+
+    :param o: The item-wise calculated scores.
+    :param w: The item-wise ground truth scores.
+    :return: The score quantity.
+    """
+    return scipy.stats.kendalltau(o, w)[0]
+
+
+def spearman_score(o, w):
+    """
+    Spearman's rank correlation between the calculated and the ground truth
+    scores.
+
+    :param o: The item-wise calculated scores.
+    :param w: The item-wise ground truth scores.
+    :return: The score quantity.
+    """
+    return scipy.stats.spearmanr(o, w)[0]
+
+
+def weighted_kemeny_distance_reference(o, w):
+    """
+    The scoring metric in the Shah paper, computed over every pair.
+
+    :param o: The item-wise calculated scores.
+    :param w: The item-wise ground truth scores.
+    :return: The score quantity.
+    """
+    sum_score = 0
+    for j in range(len(w)):
+        for i in range(j):
+            # note that the formula in the shaw paper is wrong.
+            q = (w[i] - w[j])**2
+            if ((w[i] - w[j])*(o[i] - o[j])) <= 0:
+                sum_score += q
+    denom = 2 * len(w) * np.sum(w ** 2)
+    return 1 - np.sqrt(sum_score / denom)
+
+
+def weighted_kemeny_distance_ratio_reference(o, w):
+    """
+    The scoring metric in the Shah paper, computed over every pair.
+
+    :param o: The item-wise calculated scores.
+    :param w: The item-wise ground truth scores.
+    :return: The score quantity.
+    """
+    sum_score = 0
+    tot_pos_score = 0  # the upper limit of the bad scores
+    for j in range(len(w)):
+        for i in range(j):
+            # note that the formula in the shaw paper is wrong.
+            q = (w[i] - w[j])**2
+            tot_pos_score += q
+            if ((w[i] - w[j])*(o[i] - o[j])) <= 0:
+                sum_score += q
+    denom = 2 * len(w) * np.sum(w ** 2)
+    return 1 - np.sqrt(sum_score / denom) / np.sqrt(tot_pos_score / denom)
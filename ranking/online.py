@@ -0,0 +1,88 @@
+"""
+Exports an online Bradley-Terry rating updater, which adjusts the ratings of
+the items involved in each comparison as it arrives rather than recomputing
+them from the whole win matrix. Each item carries a mean rating mu and a
+variance sigma^2, updated with the Bradley-Terry full-pair rule of Weng and
+Lin, 2011 ("A Bayesian Approximation Method for Online Ranking"):
+
+    c^2 = 2 beta^2 + sigma_w^2 + sigma_l^2
+    p_w = exp(mu_w / c) / (exp(mu_w / c) + exp(mu_l / c))
+    mu_w += sigma_w^2 / c * (1 - p_w)
+    mu_l -= sigma_l^2 / c * (1 - p_w)
+    sigma_i^2 *= max(1 - sigma_i^2 / c^2 * p_w * (1 - p_w), kappa)
+
+The update is order-dependent and only approximates the offline rank(),
+which remains the exact periodic recompute.
+"""
+
+import numpy as np
+
+
+class OnlineBradleyTerry(object):
+    """
+    Applies the Weng-Lin Bradley-Terry update to ratings held as a dict
+    mapping item IDs to (mu, sigma^2) tuples.
+    """
+    def __init__(self, beta=25. / 6, init_mu=25., init_var=(25. / 3) ** 2,
+                 kappa=1e-4):
+        """
+        :param beta: The performance noise; larger values make each
+                     comparison less informative.
+        :param init_mu: The rating of an item that has not been compared.
+        :param init_var: The variance of an item that has not been compared.
+        :param kappa: The smallest factor by which a variance may shrink in a
+                      single update, which keeps it positive.
+        :return: An OnlineBradleyTerry instance.
+        """
+        self.beta = float(beta)
+        self.init_mu = float(init_mu)
+        self.init_var = float(init_var)
+        self.kappa = float(kappa)
+
+    def default(self):
+        """
+        Returns the rating of an item that has not been compared.
+
+        :return: The (mu, sigma^2) tuple.
+        """
+        return self.init_mu, self.init_var
+
+    def update_pair(self, winner, loser):
+        """
+        Updates the ratings of a single comparison.
+
+        :param winner: The (mu, sigma^2) tuple of the winner.
+        :param loser: The (mu, sigma^2) tuple of the loser.
+        :return: The updated (mu, sigma^2) tuples of the winner and loser.
+        """
+        mu_w, var_w = winner
+        mu_l, var_l = loser
+        c2 = 2 * self.beta ** 2 + var_w + var_l
+        c = np.sqrt(c2)
+        # p_w = 1 / (1 + exp((mu_l - mu_w) / c)), computed stably.
+        p_w = 0.5 * (1 + np.tanh((mu_w - mu_l) / (2 * c)))
+        p_l = 1 - p_w
+        mu_w += var_w / c * p_l
+        mu_l -= var_l / c * p_l
+        info = p_w * p_l / c2
+        var_w *= max(1 - var_w * info, self.kappa)
+        var_l *= max(1 - var_l * info, self.kappa)
+        return (mu_w, var_w), (mu_l, var_l)
+
+    def update(self, ratings, outcomes):
+        """
+        Applies a sequence of comparisons in order.
+
+        :param ratings: A dict mapping item IDs to (mu, sigma^2) tuples,
+                        which is updated in place. Items not in it are given
+                        the default rating.
+        :param outcomes: An iterable of (winner ID, loser ID) tuples.
+        :return: The ratings dict.
+        """
+        for w, l in outcomes:
+            if w == l:
+                continue
+            ratings[w], ratings[l] = self.update_pair(
+                ratings.get(w, self.default()),
+                ratings.get(l, self.default()))
+        return ratings
@@ -7,6 +7,7 @@ RankCentrality method  as described by Negahban, Oh and Shah, 2014.
 
 
 import logging
+import multiprocessing
 import numpy as np
 from scipy import sparse
 from scipy.sparse.linalg import gmres, spsolve
@@ -28,54 +29,193 @@ def _comp_dmax(W):
 
 def _w_to_p(W):
     """
-    Computes the time-independent transition matrix P
+    Computes the time-independent transition matrix P. This is built directly
+    from the sparse arrays: the ratio L_ij / (L_ij + L_ji) is obtained by
+    multiplying the loss matrix L = W^T with the elementwise reciprocal of
+    L + L^T (whose sparsity pattern is the union of both), and the diagonal
+    is set in a single step.
+
+    NOTES:
+        Self-comparisons (entries on the diagonal of W) are ignored.
+
     :param W: An N x N win matrix, as in rank()
     :return: The time-independent transition matrix P
     """
-    # ensure that the win matrix is LIL-type sparse matrix. Also transpose
-    # it, effectively converting it to a 'loss' matrix.
-    W = sparse.lil_matrix(W.T, dtype=np.int)
-    rdmax = _comp_dmax(W)
-    # this is an inefficient method, but I can't think of a better way to do it.
-    a, b = W.nonzero()
-    P = W.astype(float)
-    P[a, b] = W[a, b] / (W[a, b] + W[b, a])
-    P = P.tocsr()
+    # transpose the win matrix, effectively converting it to a 'loss' matrix,
+    # and drop self-comparisons and explicit zeros.
+    W = sparse.coo_matrix(W, dtype=float)
+    keep = (W.row != W.col) & (W.data != 0)
+    n = W.shape[0]
+    L = sparse.csr_matrix((W.data[keep], (W.col[keep], W.row[keep])),
+                          shape=(n, n))
+    if not L.nnz:
+        # no comparisons, every item is its own component.
+        return sparse.identity(n, format='csr')
+    rdmax = _comp_dmax(L)
+    # S_ij = L_ij + L_ji is positive wherever either is.
+    S = L + L.T
+    P = L.multiply(S.power(-1)).tocsr()
     P = P.multiply(rdmax)  # normalize
-    dr, dc = np.diag_indices_from(P)  # obtain the diagonal indices.
     # constrain the rows to sum to precisely 1.
-    P[dr, dc] = 1 - np.squeeze(P.sum(1).A)
+    P = (P + sparse.diags(1 - np.asarray(P.sum(1)).ravel())).tocsr()
     P.eliminate_zeros()
     return P
 
 
-def _markov_stationary_components(P, mean=1.0, tol=1e-12):
+# components at least this large are solved in the process pool, if there is
+# one; smaller ones are cheaper to solve than to ship to another process.
+_MIN_PARALLEL_SIZE = 1000
+
+
+def _group_components(labels, n_components):
+    """
+    Groups the items by their component label with a single sort.
+
+    :param labels: A length-N array of component labels.
+    :param n_components: The number of components.
+    :return: The item indices ordered by component, and the boundaries of
+             each component within them--component j's items are
+             order[bounds[j]:bounds[j + 1]].
+    """
+    order = np.argsort(labels, kind='mergesort')
+    sizes = np.bincount(labels, minlength=n_components)
+    bounds = np.concatenate([[0], np.cumsum(sizes)])
+    return order, bounds
+
+
+def _small_component_stationary(P, order, bounds, sizes, mean=1.0):
+    """
+    Computes the stationary state of every component of size one or two in
+    closed form.
+
+    :param P: The N x N transition matrix.
+    :param order: The item indices ordered by component, as returned by
+                  _group_components.
+    :param bounds: The component boundaries, as returned by
+                   _group_components.
+    :param sizes: The component sizes.
+    :param mean: The mean value of the rankings, as in rank().
+    :return: The indices of the items in small components and their values.
+    """
+    # each component's values sum to its size times the mean (or to 1).
+    singles = order[bounds[:-1][sizes == 1]]
+    single_vals = np.ones(len(singles)) * (1. if mean is None else mean)
+    # for a pair, detailed balance gives p_a * P_ab = p_b * P_ba.
+    starts = bounds[:-1][sizes == 2]
+    a = order[starts]
+    b = order[starts + 1]
+    if len(a):
+        p_ab = np.asarray(P[a, b]).ravel()
+        p_ba = np.asarray(P[b, a]).ravel()
+    else:
+        p_ab = p_ba = np.zeros(0)
+    tot = 1. if mean is None else 2. * mean
+    return (np.concatenate([singles, a, b]),
+            np.concatenate([single_vals, tot * p_ba / (p_ab + p_ba),
+                            tot * p_ab / (p_ab + p_ba)]))
+
+
+def _solve_component(args):
+    """
+    Unpacks the arguments to _markov_stationary_component, so it may be used
+    with Pool.map.
+    """
+    return _markov_stationary_component(*args)
+
+
+def _solve_components(P, order, bounds, comps, mean=1.0, tol=1e-12,
+                      workers=None, x0=None, direct=False):
+    """
+    Finds the stationary state of each of a set of connected components of P
+    iteratively, solving the largest ones in a process pool.
+
+    :param P: The N x N transition matrix, in CSR format.
+    :param order: The item indices ordered by component, as returned by
+                  _group_components.
+    :param bounds: The component boundaries, as returned by
+                   _group_components.
+    :param comps: The indices of the components to solve.
+    :param mean: The mean value of the rankings, as in rank().
+    :param tol: The tolerance, as in rank()
+    :param workers: The number of processes to use, as in rank().
+    :param x0: A length-N array of initial guesses, or None.
+    :param direct: If True, uses a direct method, as in
+                   _markov_stationary_component.
+    :return: The indices of the items in those components and their values.
+    """
+    comps = np.asarray(comps, dtype=int)
+    sizes = bounds[comps + 1] - bounds[comps]
+    if workers is not None and workers > 1:
+        parallel = comps[sizes >= _MIN_PARALLEL_SIZE]
+        serial = comps[sizes < _MIN_PARALLEL_SIZE]
+    else:
+        parallel = comps[:0]
+        serial = comps
+
+    def _args(comp):
+        idx = order[bounds[comp]:bounds[comp + 1]]
+        sub_x0 = None if x0 is None else x0[idx]
+        return idx, (P[idx, :][:, idx], mean, tol, direct, sub_x0)
+
+    indices = []
+    vals = []
+    pool = None
+    if len(parallel):
+        pool = multiprocessing.Pool(min(workers, len(parallel)))
+        par_indices, par_args = zip(*[_args(c) for c in parallel])
+        result = pool.map_async(_solve_component, par_args)
+    try:
+        # solve the remaining components while the pool works.
+        for comp in serial:
+            idx, args = _args(comp)
+            indices.append(idx)
+            vals.append(_markov_stationary_component(*args))
+        if pool is not None:
+            indices.extend(par_indices)
+            vals.extend(result.get())
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    if not indices:
+        return np.zeros(0, dtype=int), np.zeros(0)
+    return np.concatenate(indices), np.concatenate(vals)
+
+
+def _markov_stationary_components(P, mean=1.0, tol=1e-12, workers=None):
     """
     Splits the transition matrix P into connected components and finds the
     stationary state for each.
 
     :param P: The N x N transition matrix, as obtained from the win matrix
               computed by _w_to_p()
-    :param mean: The mean value of the rankings, as in rank()
+    :param mean: The mean value of the rankings, as in rank().
     :param tol: The tolerance, as in rank()
+    :param workers: The number of processes to use, as in rank().
     :return: A length-N numpy array of floats corresponding to the ranks of
              each item
     """
     n = P.shape[0]
+    P = P.tocsr()
     n_components, labels = \
         sparse.csgraph.connected_components(P, directed=True,
                                             connection='strong')
-    sizes = [(labels == j).sum() for j in range(n_components)]
-    _log.debug('%i components, larges is %i'%(max(labels) + 1, max(sizes)))
+    order, bounds = _group_components(labels, n_components)
+    sizes = np.diff(bounds)
+    _log.debug('%i components, largest is %i'%(n_components, sizes.max()))
     p = np.zeros(n)
-    for comp in range(n_components):
-        indices = np.flatnonzero(labels == comp)
-        subP = P[indices, :][:, indices]
-        p[indices] = _markov_stationary_component(subP, mean, tol)
+    indices, vals = _small_component_stationary(P, order, bounds, sizes,
+                                                mean)
+    p[indices] = vals
+    indices, vals = _solve_components(P, order, bounds,
+                                      np.flatnonzero(sizes > 2), mean, tol,
+                                      workers)
+    p[indices] = vals
     return p
 
 
-def _markov_stationary_component(subP, mean=1.0, tol=1e-12, direct=False):
+def _markov_stationary_component(subP, mean=None, tol=1e-12, direct=False,
+                                 x0=None):
     """
     Returns the stationary state of the Markov chain for a single connected
     component P called subP.
@@ -85,6 +225,8 @@ def _markov_stationary_component(subP, mean=1.0, tol=1e-12, direct=False):
     :param tol: The tolerance of the estimate, as in rank()
     :param direct: If True, uses a direct method (spsolve), else it uses an
                    iterative method.
+    :param x0: An initial guess for the iterative method (e.g., a previous
+               solution), which is rescaled to the component's total.
     :return: A length-M numpy array of floats corresponding to the rankings
              for this connected component.
     """
@@ -93,20 +235,28 @@ def _markov_stationary_component(subP, mean=1.0, tol=1e-12, direct=False):
         return np.array([1.0]*subP.size)
     n = subP.shape[0]
     dP = subP - sparse.eye(n)
-    A = sparse.vstack([np.ones(n), dP.T[1:, :]])
+    A = sparse.vstack([np.ones(n), dP.T[1:, :]], format='csr')
     rhs = np.zeros((n,))
-    rhs[0] = n * mean
+    if mean is None:
+        rhs[0] = 1
+    else:
+        rhs[0] = n * mean
     if direct:
         return spsolve(A, rhs)
-    else:
-        # use GMRES
-        p, info = gmres(A, rhs, tol=tol)
+    if x0 is not None:
+        x0 = np.asarray(x0, dtype=float)
+        if x0.sum() > 0:
+            x0 = x0 * (rhs[0] / x0.sum())
+        else:
+            x0 = None
+    # use GMRES
+    p, info = gmres(A, rhs, x0=x0, tol=tol)
     if info:
         _log.warning("GMRES did not converge!")
     return p
 
 
-def rank(W, mean=1.0, tol=1e-12):
+def rank(W, mean=1.0, tol=1e-12, workers=None):
     """
     Computes the rank for an arbitrary number of items given a win matrix.
     The win matrix is defined as a matrix W where each entry W_i,j = N means
@@ -116,14 +266,18 @@ def rank(W, mean=1.0, tol=1e-12):
     :param W: An N x N matrix whose entries i,j are integers, indicating the
               number of times i has been chosen over j.
     :param mean: The mean value of the rankings, such that the average score
-                 is equal to mean.
+                 is equal to mean. If this is None, then the sum of the
+                 rankings will be 1, and their mean will be 1./N.
     :param tol: The epsilon tolerance, used during iterative estimation of
                 the ranks.
+    :param workers: The number of processes with which to solve the large
+                    connected components. If None, they are solved serially.
     :return: A length-N numpy array of floats corresponding to the ranks of
              each item.
     """
     if 1 >= W.size:
         return np.array([1.0]*W.size)
     P = _w_to_p(W)
-    return _markov_stationary_components(P, mean=mean, tol=tol)
+    return _markov_stationary_components(P, mean=mean, tol=tol,
+                                         workers=workers)
 
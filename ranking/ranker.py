@@ -0,0 +1,230 @@
+"""
+Exports a stateful RankCentrality ranker, for re-ranking a win matrix that
+changes only a little between runs (e.g., the hourly re-rank of every image).
+
+The stationary distribution of the RankCentrality chain does not depend on
+the normalization 1/d_max: P = I + (R - diag(R 1)) / d_max, where R holds the
+ratios L_ij / (L_ij + L_ji). So the ranker keeps R, and when the win matrix
+changes it recomputes only the rows of R that belong to items whose wins or
+losses changed. Components whose items are all untouched and which are
+otherwise unchanged keep their previous solution, and the rest are solved by
+GMRES warm-started from it.
+"""
+
+import logging
+import numpy as np
+from scipy import sparse
+from ranking.rank_from_wm import _group_components
+from ranking.rank_from_wm import _small_component_stationary
+from ranking.rank_from_wm import _solve_components
+
+_log = logging.getLogger(__name__)
+
+
+def _ratio_rows(Wc, rows):
+    """
+    Computes the rows of the ratio matrix R, R_ij = L_ij / (L_ij + L_ji) for
+    the loss matrix L = W^T, belonging to a subset of items.
+
+    :param Wc: The N x N win matrix, in CSC format.
+    :param rows: The indices of the items, as an array of ints.
+    :return: A len(rows) x N CSR matrix of those rows of R.
+    """
+    # the rows of L are the columns of W, and the rows of L^T those of W.
+    L = Wc[:, rows].T.tocsr()
+    S = L + Wc.tocsr()[rows, :]
+    R = L.multiply(S.power(-1)).tocsr()
+    # drop self-comparisons.
+    R = R.tocoo()
+    keep = rows[R.row] != R.col
+    return sparse.csr_matrix((R.data[keep], (R.row[keep], R.col[keep])),
+                             shape=R.shape)
+
+
+def _clean_win_matrix(W):
+    """
+    Converts a win matrix into a float CSR matrix without self-comparisons
+    or explicit zeros.
+
+    :param W: An N x N win matrix, as in rank_from_wm.rank()
+    :return: The N x N CSR win matrix.
+    """
+    W = sparse.coo_matrix(W, dtype=float)
+    keep = (W.row != W.col) & (W.data != 0)
+    W = sparse.csr_matrix((W.data[keep], (W.row[keep], W.col[keep])),
+                          shape=W.shape)
+    W.sum_duplicates()
+    return W
+
+
+def _pad(M, n):
+    """
+    Pads a sparse matrix with empty rows and columns to be n x n.
+    """
+    M = M.tocoo()
+    return sparse.csr_matrix((M.data, (M.row, M.col)), shape=(n, n))
+
+
+class Ranker(object):
+    """
+    Ranks items by RankCentrality, as rank_from_wm.rank() does, but keeps the
+    ratio matrix, the component labelling and the solution from the previous
+    call so that subsequent calls only redo the work affected by the change
+    in the win matrix. The win matrix may grow between calls (items are
+    appended), but items must not be removed or reordered.
+    """
+    def __init__(self, mean=1.0, tol=1e-12, workers=None, direct=False):
+        """
+        :param mean: The mean value of the rankings, as in
+                     rank_from_wm.rank().
+        :param tol: The tolerance of the iterative solver.
+        :param workers: The number of processes with which to solve the
+                        large connected components, as in
+                        rank_from_wm.rank().
+        :param direct: If True, solves the components with a direct method
+                       rather than GMRES. This is far faster for long,
+                       chain-like components, on which GMRES converges
+                       slowly, but suffers heavy fill-in on well-mixed ones.
+        :return: A Ranker instance.
+        """
+        self.mean = mean
+        self.tol = tol
+        self.workers = workers
+        self.direct = direct
+        self.last_stats = {}
+        self.reset()
+
+    def reset(self):
+        """
+        Discards the state from previous calls, so the next one is solved
+        from scratch.
+        """
+        self._W = None  # the previous (cleaned) win matrix, CSR
+        self._R = None  # the ratio matrix R, CSR
+        self._labels = None  # the previous component labels
+        self._p = None  # the previous ranks
+
+    def _update_ratios(self, W):
+        """
+        Updates the ratio matrix for a new win matrix, recomputing only the
+        rows that have changed.
+
+        :param W: The N x N (cleaned) win matrix, CSR.
+        :return: A length-N boolean array, True for the items whose rows of R
+                 changed.
+        """
+        n = W.shape[0]
+        if self._W is None:
+            dirty = np.ones(n, dtype=bool)
+            self._R = _ratio_rows(W.tocsc(), np.arange(n))
+            return dirty
+        n_old = self._W.shape[0]
+        dirty = np.zeros(n, dtype=bool)
+        dirty[n_old:] = True
+        old_W = self._W if n_old == n else _pad(self._W, n)
+        D = (W - old_W).tocoo()
+        changed = D.data != 0
+        # a change to W_ij alters both R_ij and R_ji.
+        dirty[D.row[changed]] = True
+        dirty[D.col[changed]] = True
+        rows = np.flatnonzero(dirty)
+        R = self._R if n_old == n else _pad(self._R, n)
+        if len(rows):
+            # zero the stale rows and add in their replacements.
+            keep = sparse.diags((~dirty).astype(float))
+            new_rows = _ratio_rows(W.tocsc(), rows).tocoo()
+            R = keep.dot(R) + sparse.csr_matrix(
+                (new_rows.data, (rows[new_rows.row], new_rows.col)),
+                shape=(n, n))
+        self._R = R.tocsr()
+        return dirty
+
+    def _transition_matrix(self):
+        """
+        Returns the transition matrix P for the current ratio matrix.
+        """
+        R = self._R
+        n = R.shape[0]
+        if not R.nnz:
+            return sparse.identity(n, format='csr')
+        rdmax = 1. / np.max(np.diff(R.indptr))
+        P = R.multiply(rdmax)
+        P = (P + sparse.diags(1 - np.asarray(P.sum(1)).ravel())).tocsr()
+        P.eliminate_zeros()
+        return P
+
+    def rank(self, W):
+        """
+        Computes the ranks for a win matrix, reusing the work of the previous
+        call.
+
+        :param W: An N x N matrix whose entries i,j are integers, indicating
+                  the number of times i has been chosen over j.
+        :return: A length-N numpy array of floats corresponding to the ranks
+                 of each item.
+        """
+        if 1 >= W.size:
+            return np.array([1.0]*W.size)
+        W = _clean_win_matrix(W)
+        n = W.shape[0]
+        if self._W is not None and self._W.shape[0] > n:
+            _log.warn('Win matrix shrank from %i to %i items, starting over',
+                      self._W.shape[0], n)
+            self.reset()
+        dirty = self._update_ratios(W)
+        n_components, labels = sparse.csgraph.connected_components(
+            self._R, directed=True, connection='strong')
+        order, bounds = _group_components(labels, n_components)
+        sizes = np.diff(bounds)
+        P = self._transition_matrix()
+        p = np.zeros(n)
+        indices, vals = _small_component_stationary(P, order, bounds, sizes,
+                                                    self.mean)
+        p[indices] = vals
+        large = np.flatnonzero(sizes > 2)
+        x0 = None
+        if self._p is not None and len(large):
+            # a component is unchanged if none of its items are dirty and all
+            # of its items--and only those--formed one component before.
+            n_old = len(self._labels)
+            old_labels = -np.ones(n, dtype=int)
+            old_labels[:n_old] = self._labels
+            old_sizes = np.bincount(self._labels)
+            grouped = old_labels[order]
+            starts = bounds[:-1][large]
+            lo = np.minimum.reduceat(grouped, bounds[:-1])[large]
+            hi = np.maximum.reduceat(grouped, bounds[:-1])[large]
+            n_dirty = np.add.reduceat(dirty[order].astype(int),
+                                      bounds[:-1])[large]
+            same = (lo == hi) & (lo >= 0) & (n_dirty == 0)
+            same[same] = old_sizes[lo[same]] == sizes[large][same]
+            for comp in large[same]:
+                idx = order[bounds[comp]:bounds[comp + 1]]
+                p[idx] = self._p[idx]
+            large = large[~same]
+            # warm start from the previous solution; new items start at the
+            # mean of the items already in their component (or at 1).
+            x0 = np.zeros(n)
+            x0[:n_old] = self._p
+            x0[n_old:] = np.nan
+            for comp in large:
+                idx = order[bounds[comp]:bounds[comp + 1]]
+                sub = x0[idx]
+                fill = np.nanmean(sub) if np.isfinite(sub).any() else 1.
+                sub[np.isnan(sub)] = fill
+                x0[idx] = sub
+            _log.debug('Reusing %i of %i large components',
+                       len(starts) - len(large), len(starts))
+        indices, vals = _solve_components(P, order, bounds, large, self.mean,
+                                          self.tol, self.workers, x0,
+                                          self.direct)
+        p[indices] = vals
+        self.last_stats = {'n_items': n,
+                           'n_dirty': int(dirty.sum()),
+                           'n_components': n_components,
+                           'n_solved': len(large),
+                           'warm_start': x0 is not None}
+        self._W = W
+        self._labels = labels
+        self._p = p
+        return p
@@ -0,0 +1,35 @@
+import unittest
+from ranking.bootstrap import bootstrap
+from ranking.bootstrap import iter_bootstrap
+from ranking.bootstrap import resample
+from scipy import sparse
+import numpy as np
+
+
+class TestBootstrap(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(0)
+        WM = np.random.randint(0, 20, (30, 30))
+        np.fill_diagonal(WM, 0)
+        self.WM = sparse.csr_matrix(WM)
+
+    def test_resample(self):
+        a = resample(self.WM, 1)
+        self.assertEqual((a - resample(self.WM, 1)).nnz, 0)
+        self.assertNotEqual((a - resample(self.WM, 2)).nnz, 0)
+        self.assertAlmostEqual(a.sum() / self.WM.sum(), 1., delta=0.05)
+
+    def test_intervals(self):
+        scores, lo, hi, n = bootstrap(self.WM, 20, workers=2)
+        self.assertEqual(n, 20)
+        self.assertTrue(np.all(lo <= hi))
+        self.assertGreater(np.mean((lo <= scores) & (scores <= hi)), 0.9)
+
+    def test_partial_results(self):
+        counts = [n for n, _, _ in iter_bootstrap(self.WM, 6, workers=2,
+                                                  report_every=2)]
+        self.assertEqual(counts, [2, 4, 6])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,41 @@
+import unittest
+from ranking.engines import ENGINES
+from ranking.engines import get_engine
+from ranking.rank_from_wm import rank
+import numpy as np
+
+
+class TestEngines(unittest.TestCase):
+
+    def setUp(self):
+        self.eps = 1e-3
+        self.n = 5
+        self.tot_games = 1e7
+        p = np.random.rand(self.n) + 0.1
+        self.p = p / np.mean(p)
+        self.WM = np.zeros((self.n, self.n))
+        for n, i in enumerate(self.p):
+            for m, j in enumerate(self.p):
+                if m <= n:
+                    continue
+                self.WM[n, m] = int(self.tot_games * (i / (i + j)))
+                self.WM[m, n] = int(self.tot_games * (j / (i + j)))
+
+    def test_recover_scores(self):
+        for name in ENGINES:
+            r = get_engine(name).rank(self.WM)
+            for i in np.abs(r - self.p):
+                self.assertAlmostEquals(i, 0.0, delta=self.eps)
+
+    def test_power_iteration_matches_rank(self):
+        WM = np.random.randint(0, 3, (30, 30))
+        np.fill_diagonal(WM, 0)
+        r = get_engine('power_iteration', tol=1e-12).rank(WM)
+        for i in np.abs(r - rank(WM)):
+            self.assertAlmostEquals(i, 0.0, delta=1e-6)
+
+    def test_unknown_engine(self):
+        self.assertRaises(ValueError, get_engine, 'nope')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+import unittest
+from ranking import metrics
+import numpy as np
+
+
+def _kendall_tau_b(o, w):
+    conc = disc = tie_o = tie_w = 0
+    for j in range(len(w)):
+        for i in range(j):
+            s = np.sign(o[i] - o[j]) * np.sign(w[i] - w[j])
+            if s > 0:
+                conc += 1
+            elif s < 0:
+                disc += 1
+            elif o[i] == o[j] and w[i] != w[j]:
+                tie_o += 1
+            elif w[i] == w[j] and o[i] != o[j]:
+                tie_w += 1
+    return (conc - disc) / np.sqrt((conc + disc + tie_o) *
+                                   (conc + disc + tie_w))
+
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.eps = 1e-9
+        np.random.seed(0)
+        self.cases = []
+        for n in [2, 5, 40, 200]:
+            w = np.random.beta(2., 5., n)
+            o = w + np.random.randn(n) * 0.2
+            self.cases.append((o, w))
+            # ties in both the estimates and the ground truth.
+            self.cases.append((np.round(o, 1), np.round(w, 1)))
+        w = np.random.rand(50)
+        self.cases.append((w * 3, w))
+        self.cases.append((-w, w))
+
+    def test_weighted_kemeny_distance(self):
+        for o, w in self.cases:
+            self.assertAlmostEqual(
+                metrics.weighted_kemeny_distance(o, w),
+                metrics.weighted_kemeny_distance_reference(o, w),
+                delta=self.eps)
+
+    def test_weighted_kemeny_distance_ratio(self):
+        for o, w in self.cases:
+            self.assertAlmostEqual(
+                metrics.weighted_kemeny_distance_ratio(o, w),
+                metrics.weighted_kemeny_distance_ratio_reference(o, w),
+                delta=self.eps)
+
+    def test_rank_correlations(self):
+        for o, w in self.cases[2:]:
+            self.assertAlmostEqual(metrics.kendall_tau_score(o, w),
+                                   _kendall_tau_b(o, w), delta=self.eps)
+            rank_o = np.argsort(np.argsort(o))
+            rank_w = np.argsort(np.argsort(w))
+            if len(np.unique(o)) == len(o) and len(np.unique(w)) == len(w):
+                self.assertAlmostEqual(metrics.spearman_score(o, w),
+                                       np.corrcoef(rank_o, rank_w)[0, 1],
+                                       delta=self.eps)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,37 @@
+import unittest
+from ranking.online import OnlineBradleyTerry
+import numpy as np
+
+
+class TestOnline(unittest.TestCase):
+
+    def setUp(self):
+        self.rater = OnlineBradleyTerry()
+
+    def test_update_pair(self):
+        prior = self.rater.default()
+        (mu_w, var_w), (mu_l, var_l) = self.rater.update_pair(prior, prior)
+        self.assertGreater(mu_w, prior[0])
+        self.assertLess(mu_l, prior[0])
+        self.assertAlmostEquals(mu_w - prior[0], prior[0] - mu_l)
+        self.assertLess(var_w, prior[1])
+        self.assertLess(var_l, prior[1])
+
+    def test_recovers_order(self):
+        np.random.seed(0)
+        p = np.array([1., 2., 4., 8.])
+        outcomes = []
+        for _ in range(2000):
+            i, j = np.random.choice(len(p), 2, replace=False)
+            if np.random.rand() < p[i] / (p[i] + p[j]):
+                outcomes.append((i, j))
+            else:
+                outcomes.append((j, i))
+        ratings = self.rater.update({}, outcomes)
+        mus = [ratings[i][0] for i in range(len(p))]
+        self.assertEqual(list(np.argsort(mus)), range(len(p)))
+        for i in range(len(p)):
+            self.assertLess(ratings[i][1], self.rater.init_var)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,10 @@
+import multiprocessing
 import unittest
+import mock
+from ranking import rank_from_wm
 from ranking.rank_from_wm import rank
+from ranking.rank_from_wm import _w_to_p
+from ranking.ranker import Ranker
 import numpy as np
 
 
@@ -38,5 +43,67 @@ class TestRank(unittest.TestCase):
         for i in diff:
             self.assertAlmostEquals(i, 0.0, delta=self.eps)
 
+    def test_transition_matrix(self):
+        WM = np.random.randint(0, 4, (20, 20)) * (np.random.rand(20, 20) < .3)
+        np.fill_diagonal(WM, 0)
+        P = _w_to_p(WM).toarray()
+        d_max = float(np.max(np.sum(WM.T > 0, 1)))
+        for i in range(20):
+            for j in range(20):
+                if i == j or not WM[j, i]:
+                    continue
+                self.assertAlmostEquals(
+                    P[i, j], WM[j, i] / float(WM[i, j] + WM[j, i]) / d_max)
+        diff = np.abs(P.sum(1) - 1)
+        for i in diff:
+            self.assertAlmostEquals(i, 0.0, delta=self.eps)
+
+    def test_small_components(self):
+        # items 0 and 1 only play each other, item 2 only ever loses to 3.
+        WM = np.zeros((4, 4))
+        WM[0, 1] = 3
+        WM[1, 0] = 1
+        WM[3, 2] = 2
+        r = rank(WM, mean=2.0)
+        self.assertAlmostEquals(r[0] / r[1], 3.0, delta=self.eps)
+        self.assertAlmostEquals(r[0] + r[1], 4.0, delta=self.eps)
+        self.assertAlmostEquals(r[2], 2.0, delta=self.eps)
+        self.assertAlmostEquals(r[3], 2.0, delta=self.eps)
+
+    def test_parallel_components(self):
+        # two components of 30 and 20 items, which are solved in the pool
+        # once the threshold is lowered, and one of 3 that is not.
+        WM = np.zeros((53, 53))
+        for start, stop in [(0, 30), (30, 50), (50, 53)]:
+            n = stop - start
+            WM[start:stop, start:stop] = np.random.randint(1, 5, (n, n))
+        np.fill_diagonal(WM, 0)
+        r = rank(WM)
+        with mock.patch.object(rank_from_wm, '_MIN_PARALLEL_SIZE', 10), \
+                mock.patch.object(rank_from_wm.multiprocessing, 'Pool',
+                                  side_effect=multiprocessing.Pool) as pool:
+            rp = rank(WM, workers=2)
+        pool.assert_called_once_with(2)
+        for i in np.abs(r - rp):
+            self.assertAlmostEquals(i, 0.0, delta=self.eps)
+
+    def test_ranker_update(self):
+        WM = np.random.randint(0, 5, (40, 40))
+        np.fill_diagonal(WM, 0)
+        ranker = Ranker()
+        r = ranker.rank(WM)
+        for i in np.abs(r - rank(WM)):
+            self.assertAlmostEquals(i, 0.0, delta=self.eps)
+        # re-ranking an unchanged matrix reuses the previous solution.
+        ranker.rank(WM)
+        self.assertEqual(ranker.last_stats['n_solved'], 0)
+        WM[3, 7] += 10
+        WM = np.pad(WM, ((0, 2), (0, 2)), 'constant')
+        WM[40, 0] = WM[1, 40] = WM[41, 40] = 1
+        r = ranker.rank(WM)
+        self.assertEqual(ranker.last_stats['n_dirty'], 6)
+        for i in np.abs(r - rank(WM)):
+            self.assertAlmostEquals(i, 0.0, delta=self.eps)
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,110 @@
+"""
+Exports tools for throttling and retrying calls to external services (i.e.,
+MTurk), which are used by the bulk operations that would otherwise hammer the
+API from many threads at once.
+
+    TokenBucket         - a thread-safe token bucket rate limiter
+    retry_with_backoff  - calls a function, retrying with exponential backoff
+"""
+
+import threading
+import time
+import random
+import logger
+
+_log = logger.setup_logger(__name__)
+
+
+class TokenBucket(object):
+    """
+    A thread-safe token bucket. Tokens accumulate at a fixed rate up to the
+    capacity of the bucket, and each call consumes tokens--blocking until
+    they are available. This permits short bursts while bounding the
+    long-run rate.
+    """
+    def __init__(self, rate, capacity=None):
+        """
+        :param rate: The rate at which tokens are added, per second.
+        :param capacity: The maximum number of tokens the bucket can hold.
+                         [def: rate, i.e., at most one second's burst]
+        :return: A TokenBucket instance.
+        """
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else
+                              max(rate, 1))
+        self._tokens = self.capacity
+        self._last = time.time()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        """
+        Adds the tokens that have accumulated since the last refill. Must be
+        called with the lock held.
+        """
+        now = time.time()
+        self._tokens = min(self.capacity,
+                           self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def try_acquire(self, n=1):
+        """
+        Attempts to remove tokens from the bucket without blocking.
+
+        :param n: The number of tokens to remove.
+        :return: True if the tokens were removed, False otherwise.
+        """
+        with self._lock:
+            self._refill()
+            if self._tokens >= n:
+                self._tokens -= n
+                return True
+            return False
+
+    def acquire(self, n=1):
+        """
+        Removes tokens from the bucket, blocking until they are available.
+
+        :param n: The number of tokens to remove.
+        :return: The time spent waiting, in seconds.
+        """
+        waited = 0.
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= n:
+                    self._tokens -= n
+                    return waited
+                wait = (n - self._tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
+
+
+def retry_with_backoff(func, args=(), kwargs=None, retries=3, base_delay=1.,
+                       max_delay=30., retry_on=(Exception,)):
+    """
+    Calls a function, retrying it with (jittered) exponential backoff if it
+    raises. The final exception is re-raised once the retries are exhausted.
+
+    :param func: The function to call.
+    :param args: The positional arguments to the function.
+    :param kwargs: The keyword arguments to the function.
+    :param retries: The number of times to retry after the first attempt.
+    :param base_delay: The delay before the first retry, in seconds.
+    :param max_delay: The maximum delay between attempts, in seconds.
+    :param retry_on: A tuple of the exception types that warrant a retry.
+    :return: The function's return value.
+    """
+    kwargs = kwargs or {}
+    attempt = 0
+    while True:
+        try:
+            return func(*args, **kwargs)
+        except retry_on as e:
+            if attempt >= retries:
+                raise
+            delay = min(max_delay, base_delay * (2 ** attempt))
+            delay *= random.uniform(0.5, 1.)
+            _log.debug('Attempt %i of %s failed (%s), retrying in %.2f sec',
+                       attempt + 1, getattr(func, '__name__', func), e, delay)
+            time.sleep(delay)
+            attempt += 1
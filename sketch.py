@@ -0,0 +1,95 @@
+"""
+Exports a fixed, logarithmically-bucketed quantile sketch. Values are
+counted in buckets whose boundaries grow geometrically, so every quantile
+estimate is within a fixed relative error of the true value. Since the
+buckets are fixed, sketches are merged (or differenced) simply by adding (or
+subtracting) their bucket counts, which lets them be maintained with
+counters--whether HBase counters or shared-memory values.
+"""
+
+import numpy as np
+
+
+class LogBucketSketch(object):
+    """
+    Maps values onto logarithmically spaced buckets and estimates quantiles
+    from bucket counts. The sketch itself is stateless; the counts are kept
+    by the caller as a sequence of length n_buckets.
+
+    Bucket 0 holds values below min_value, and the last bucket holds values
+    at or above max_value. Every other bucket i holds values in
+    [min_value * growth^(i-1), min_value * growth^i).
+    """
+    def __init__(self, min_value=1., max_value=3600., growth=1.1):
+        """
+        :param min_value: The smallest value that is resolved.
+        :param max_value: The largest value that is resolved.
+        :param growth: The ratio between successive bucket boundaries, which
+                       bounds the relative error of the estimates.
+        :return: A LogBucketSketch instance.
+        """
+        self.min_value = float(min_value)
+        self.max_value = float(max_value)
+        self.growth = float(growth)
+        self._log_growth = np.log(self.growth)
+        self.n_buckets = int(np.ceil(np.log(self.max_value / self.min_value) /
+                                     self._log_growth)) + 2
+
+    def bucket(self, value):
+        """
+        Returns the bucket a value falls into.
+
+        :param value: The value, as a number.
+        :return: The bucket index, as an int.
+        """
+        if value < self.min_value:
+            return 0
+        if value >= self.max_value:
+            return self.n_buckets - 1
+        idx = int(np.log(value / self.min_value) / self._log_growth) + 1
+        return min(idx, self.n_buckets - 2)
+
+    def bucket_value(self, idx):
+        """
+        Returns the representative value of a bucket, which is the geometric
+        mean of its boundaries.
+
+        :param idx: The bucket index, as an int.
+        :return: The representative value, as a float.
+        """
+        if idx <= 0:
+            return self.min_value
+        if idx >= self.n_buckets - 1:
+            return self.max_value
+        return self.min_value * self.growth ** (idx - 0.5)
+
+    def quantiles(self, counts, qs):
+        """
+        Estimates quantiles from bucket counts.
+
+        :param counts: The bucket counts, a sequence of length n_buckets.
+        :param qs: A sequence of quantiles, each in [0, 1].
+        :return: A list of the estimated values, or Nones if the counts are
+                 empty.
+        """
+        counts = np.asarray(counts, dtype=float)
+        total = counts.sum()
+        if total <= 0:
+            return [None for _ in qs]
+        cum = np.cumsum(counts)
+        # the bucket containing the q-th quantile is the first whose
+        # cumulative count reaches q * total (and is non-empty).
+        ranks = np.maximum(np.clip(qs, 0, 1) * total, total * 1e-12)
+        idxs = np.searchsorted(cum, ranks)
+        idxs = np.minimum(np.maximum(idxs, 0), self.n_buckets - 1)
+        return [self.bucket_value(i) for i in idxs]
+
+    def quantile(self, counts, q):
+        """
+        Estimates a single quantile from bucket counts.
+
+        :param counts: The bucket counts, a sequence of length n_buckets.
+        :param q: The quantile, in [0, 1].
+        :return: The estimated value, or None if the counts are empty.
+        """
+        return self.quantiles(counts, [q])[0]
@@ -25,6 +25,37 @@ started using multiprocessing. To view the variable value, simply:
 When incrementing or decrementing, you should use the increment() or
 decrement() functions instead of += because it is thread safe.
 
+Looking a variable up by name inspects the stack to find the calling
+module, so a hot code path should instead keep the handle returned by
+define() and use it directly:
+
+  n_served = statemon.define("n_served")
+
+  def handle_request():
+    n_served.increment()
+
+define() returns a Counter, whose increments go to a per-thread shard, so
+incrementing takes no lock. The shards are flushed into the shared value
+when the counter is read, when the process exits and, by a background
+thread, every COUNTER_FLUSH_INTERVAL seconds, so other processes see a
+counter's value at most that far behind.
+define_gauge() returns a Gauge, which is read and written directly, for
+variables that are set rather than incremented.
+
+define_histogram() returns a Histogram, which counts observed values in the
+fixed logarithmic buckets of a sketch.LogBucketSketch, so quantiles of the
+values can be estimated. define_timer() returns a Timer, a Histogram of
+durations in milliseconds, which times a block or a function:
+
+  gen_time = statemon.define_timer("gen_time")
+
+  with gen_time.time():
+    generate()
+
+  @gen_time
+  def generate():
+    ...
+
 TODO(mdesnoyer): Have the variables be visible from an outside monitoring tool
 
 Author: Mark Desnoyer (desnoyer@neon-lab.com)
@@ -32,19 +63,288 @@ Copyright 2013 Neon Labs
 
 """
 
-import inspect
+import functools
 import multiprocessing
+import multiprocessing.util
+import os
 import os.path
+import sys
+import thread
+import threading
+import time
+import weakref
+from sketch import LogBucketSketch
+
+# the longest a counter's increments are held in a thread's shard before
+# they are visible to other processes, in seconds.
+COUNTER_FLUSH_INTERVAL = 1.0
+
+# the default bucketing of histograms and of timers, in milliseconds.
+DEFAULT_HISTOGRAM_SKETCH = LogBucketSketch(min_value=1., max_value=1e6,
+                                           growth=1.1)
+DEFAULT_TIMER_SKETCH = LogBucketSketch(min_value=0.1, max_value=6e5,
+                                       growth=1.1)
 
 class Error(Exception):
     """Exception raised by errors in the statemon module."""
     pass
 
+class Gauge(object):
+    '''A handle to a monitoring variable that is read and written
+    directly in shared memory.'''
+    def __init__(self, name, typ, default=None):
+        if typ == int:
+            typech = 'i'
+        elif typ == float:
+            typech = 'f'
+        else:
+            raise Error('Invalid type: %s' % typ)
+        self.name = name
+        self._typ = typ
+        self._value = multiprocessing.Value(typech)
+        if default is not None:
+            self._value.value = default
+
+    def get_lock(self):
+        return self._value.get_lock()
+
+    def get(self):
+        return self._value.value
+
+    def set(self, value):
+        self._value.value = value
+
+    value = property(lambda self: self.get(), lambda self, v: self.set(v))
+
+    def increment(self, diff=1, safe=True):
+        '''Increments the variable
+
+        Inputs:
+        diff - Amount to increment
+        safe - If True, the increment is done with a lock.
+        '''
+        if safe:
+            with self._value.get_lock():
+                self._value.value += diff
+        else:
+            self._value.value += diff
+
+    def decrement(self, diff=1, safe=True):
+        self.increment(-diff, safe)
+
+    def reset(self):
+        with self._value.get_lock():
+            self.set(self._typ(0))
+
+# the counters of this process, and the process whose thread flushes them
+# periodically (see _start_flusher).
+_counters = weakref.WeakSet()
+_flusher_pid = None
+_flusher_lock = threading.Lock()
+
+def flush_counters():
+    '''Flushes the shards of every counter of this process.'''
+    alive = sys._current_frames()
+    for counter in list(_counters):
+        counter.flush(alive)
+
+def _flush_periodically():
+    while True:
+        time.sleep(COUNTER_FLUSH_INTERVAL)
+        flush_counters()
+
+def _start_flusher():
+    '''Starts the thread that flushes the counters, and registers their
+    flush at exit, once per process.'''
+    global _flusher_pid
+    with _flusher_lock:
+        if _flusher_pid == os.getpid():
+            return
+        _flusher_pid = os.getpid()
+        t = threading.Thread(target=_flush_periodically,
+                             name='statemon-flusher')
+        t.daemon = True
+        t.start()
+        # unlike atexit, this also runs when a multiprocessing child exits.
+        multiprocessing.util.Finalize(None, flush_counters, exitpriority=0)
+
+class Counter(Gauge):
+    '''A handle to a monitoring variable that is mostly incremented.
+
+    Each thread increments the total of its own shard, without a lock; the
+    value is the shared value plus what the shards hold beyond what has
+    been flushed from them. Flushing, which any thread may do, moves that
+    into the shared value under its lock. A thread flushes its own shard
+    once COUNTER_FLUSH_INTERVAL has passed since it last did so, and the
+    shards of all the threads are flushed on reads and periodically (see
+    flush_counters), when those of exited threads are dropped.
+    '''
+    def __init__(self, name, typ, default=None):
+        super(Counter, self).__init__(name, typ, default)
+        # maps thread ident -> [total, amount flushed, time of the next flush]
+        self._shards = {}
+        # a child process must not flush its parent's increments.
+        multiprocessing.util.register_after_fork(self, Counter._after_fork)
+        _counters.add(self)
+        _start_flusher()
+
+    def _after_fork(self):
+        self._shards = {}
+        _start_flusher()
+
+    def _flush_shard(self, shard):
+        # the lock must be held. Only the owning thread writes the total.
+        total = shard[0]
+        self._value.value += total - shard[1]
+        shard[1] = total
+
+    def _pending(self):
+        with self._value.get_lock():
+            return sum(shard[0] - shard[1]
+                       for shard in self._shards.values())
+
+    def flush(self, alive=None):
+        '''Flushes the shards of all the threads into the shared value, and
+        drops those of the threads that have exited.
+
+        Inputs:
+        alive - The idents of the live threads, as keys. If not set,
+                sys._current_frames()
+        '''
+        if alive is None:
+            alive = sys._current_frames()
+        with self._value.get_lock():
+            for ident, shard in self._shards.items():
+                if ident not in alive:
+                    # dropped before it is flushed: if its ident has been
+                    # reused by a new thread meanwhile, that thread sees it
+                    # is gone and flushes it again itself.
+                    del self._shards[ident]
+                self._flush_shard(shard)
+
+    def get(self):
+        with self._value.get_lock():
+            self.flush()
+            return self._value.value + self._pending()
+
+    def set(self, value):
+        # the other threads' shards are theirs to write, so offset them.
+        with self._value.get_lock():
+            self._value.value = value - self._pending()
+
+    def increment(self, diff=1, safe=True):
+        '''Increments the variable
+
+        Inputs:
+        diff - Amount to increment
+        safe - Ignored, the increment is always safe.
+        '''
+        ident = thread.get_ident()
+        shard = self._shards.get(ident)
+        if shard is None:
+            shard = [self._typ(0), self._typ(0), 0.]
+            with self._value.get_lock():
+                self._shards[ident] = shard
+        shard[0] += diff
+        now = time.time()
+        if now >= shard[2] or self._shards.get(ident) is not shard:
+            with self._value.get_lock():
+                self._flush_shard(shard)
+            shard[2] = now + COUNTER_FLUSH_INTERVAL
+
+class Histogram(object):
+    '''A handle to a monitoring variable that counts observed values in
+    the buckets of a LogBucketSketch. The bucket counts and the sum of the
+    values are kept in shared memory.'''
+    def __init__(self, name, sketch=None):
+        self.name = name
+        self.sketch = sketch or DEFAULT_HISTOGRAM_SKETCH
+        self._counts = multiprocessing.Array('l', self.sketch.n_buckets)
+        self._sum = multiprocessing.Value('d', lock=False)
+
+    def get_lock(self):
+        return self._counts.get_lock()
+
+    def observe(self, value):
+        '''Records a value.'''
+        idx = self.sketch.bucket(value)
+        with self._counts.get_lock():
+            self._counts[idx] += 1
+            self._sum.value += value
+
+    def snapshot(self):
+        '''Returns a copy of the bucket counts, as a list, and the sum of
+        the values.'''
+        with self._counts.get_lock():
+            return self._counts[:], self._sum.value
+
+    def quantiles(self, qs, counts=None):
+        '''Estimates quantiles of the values.
+
+        Inputs:
+        qs - A sequence of quantiles, each in [0, 1]
+        counts - The bucket counts to use, e.g., the difference of two
+                 snapshots. If not set, all the values observed so far
+
+        Returns:
+        A list of the estimates, or Nones if there are no values
+        '''
+        if counts is None:
+            counts = self.snapshot()[0]
+        return self.sketch.quantiles(counts, qs)
+
+    @property
+    def count(self):
+        return sum(self.snapshot()[0])
+
+    @property
+    def value(self):
+        '''The number of values observed.'''
+        return self.count
+
+    def reset(self):
+        with self._counts.get_lock():
+            for i in range(len(self._counts)):
+                self._counts[i] = 0
+            self._sum.value = 0.
+
+class _Timing(object):
+    '''Times a block, recording its duration in a Timer.'''
+    def __init__(self, timer):
+        self._timer = timer
+
+    def __enter__(self):
+        self._start = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._timer.observe((time.time() - self._start) * 1000.)
+        return False
+
+class Timer(Histogram):
+    '''A Histogram of durations, in milliseconds. Durations are recorded
+    whether or not the timed block raises.'''
+    def __init__(self, name, sketch=None):
+        super(Timer, self).__init__(name, sketch or DEFAULT_TIMER_SKETCH)
+
+    def time(self):
+        '''Returns a context manager that times its block.'''
+        return _Timing(self)
+
+    def __call__(self, func):
+        '''Decorates a function to time its calls.'''
+        @functools.wraps(func)
+        def timed(*args, **kwargs):
+            with _Timing(self):
+                return func(*args, **kwargs)
+        return timed
+
 class State(object):
     '''A collection of state variables.'''
     def __init__(self):
         self._lock = multiprocessing.RLock()
         self._vars = {}
+        self._prefixes = {} # module file -> variable name prefix
 
         # We're going to assume that statemon is in the toplevel directory,
         # so we don't need to worry about trying to find it--which we do in
@@ -65,21 +365,19 @@ class State(object):
                 raise AttributeError("Unrecognized option %r" % global_name)
 
     def __getitem__(self, name):
-        with self._lock:
-            global_name = self._local2global(name)
-            return self._vars[global_name].value
+        global_name = self._local2global(name)
+        return self._vars[global_name].value
 
     def __setattr__(self, name, value):
         if name.startswith('_'):
             self.__dict__[name] = value
             return 
         
-        with self._lock:
-            global_name = self._local2global(name)
-            try:
-                self._vars[global_name].value = value
-            except KeyError:
-                raise AttributeError("Unrecognized variable %r" % global_name)
+        global_name = self._local2global(name)
+        try:
+            self._vars[global_name].value = value
+        except KeyError:
+            raise AttributeError("Unrecognized variable %r" % global_name)
 
     def _local2global(self, local, stack_depth=2):
         '''Converts the local name of the variable to a global one.
@@ -88,21 +386,23 @@ class State(object):
 
         Stack depth controls how far back the module is found.
         Normally this is 2.
+
+        The prefix is cached by the module's file.
         '''
         
-        frame = inspect.currentframe()
-        for i in range(stack_depth):
-            frame = frame.f_back
-        mod = inspect.getmodule(frame)
-
-        apath = os.path.abspath(mod.__file__)
-        relpath = os.path.relpath(apath, self._NEON_ROOT)
-        relpath = os.path.splitext(relpath)[0]
-        prefix = '.'.join(relpath.split('/'))
+        mod_file = sys._getframe(stack_depth).f_globals['__file__']
+        try:
+            prefix = self._prefixes[mod_file]
+        except KeyError:
+            apath = os.path.abspath(mod_file)
+            relpath = os.path.relpath(apath, self._NEON_ROOT)
+            relpath = os.path.splitext(relpath)[0]
+            prefix = '.'.join(relpath.split('/'))
+            self._prefixes[mod_file] = prefix
 
         return '%s.%s' % (prefix, local)
 
-    def define(self, name, typ, default=None, stack_depth=2):
+    def define(self, name, typ, default=None, stack_depth=2, gauge=False):
         '''Define a new monitoring variable
 
         Inputs:
@@ -111,25 +411,48 @@ class State(object):
         default - Default value for the parameter. If not set, takes the 
                   type's default value
         stack_depth - Stack depth to your module
+        gauge - If True, the variable is a Gauge rather than a Counter
+
+        Returns:
+        The variable's handle
         '''
 
         global_name = self._local2global(name, stack_depth=stack_depth)
-        
-        if global_name in self._vars:
-            # It's redefined, so ignore
-            return
 
-        typech = None
-        if typ == int:
-            typech = 'i'
-        elif typ == float:
-            typech = 'f'
-        else:
-            raise Error('Invalid type: %s' % typ)
+        with self._lock:
+            if global_name in self._vars:
+                # It's redefined, so ignore
+                return self._vars[global_name]
 
-        self._vars[global_name] = multiprocessing.Value(typech)
-        if default is not None:
-            self._vars[global_name].value = default
+            cls = Gauge if gauge else Counter
+            self._vars[global_name] = cls(global_name, typ, default)
+            return self._vars[global_name]
+
+    def define_histogram(self, name, sketch=None, timer=False,
+                         stack_depth=2):
+        '''Define a new histogram monitoring variable
+
+        Inputs:
+        name - Name of the variable
+        sketch - The LogBucketSketch that buckets the values. If not set,
+                 DEFAULT_HISTOGRAM_SKETCH (or DEFAULT_TIMER_SKETCH)
+        timer - If True, the variable is a Timer
+        stack_depth - Stack depth to your module
+
+        Returns:
+        The variable's handle
+        '''
+
+        global_name = self._local2global(name, stack_depth=stack_depth)
+
+        with self._lock:
+            if global_name in self._vars:
+                # It's redefined, so ignore
+                return self._vars[global_name]
+
+            cls = Timer if timer else Histogram
+            self._vars[global_name] = cls(global_name, sketch)
+            return self._vars[global_name]
 
     def increment(self, name=None, diff=1, ref=None, safe=True,
                   stack_depth=1):
@@ -139,7 +462,7 @@ class State(object):
         name - Name of the variable (Either this or ref must be set)
         diff - Amount to increment
         ref - Reference to the variable so that the lookup is skipped. Use get_ref() to get it.
-        safe - If True, the increment is done with a thread lock.
+        safe - If True, the increment of a Gauge is done with a thread lock.
                If it's ok to miss some increments in order to speed up the
                increment, this can be set to false.
         stack_depth - Stack depth to your module
@@ -150,11 +473,7 @@ class State(object):
         if ref is None:
             ref = self.get_ref(name, stack_depth+1)
 
-        if safe:
-            with ref.get_lock():
-                ref.value += diff
-        else:
-            ref.value += diff
+        ref.increment(diff, safe)
 
     def decrement(self, name=None, diff=1, ref=None, safe=True,
                   stack_depth=1):
@@ -214,16 +533,27 @@ class State(object):
         
         with self._lock:
             for value in self._vars.itervalues():
-                with value.get_lock():
-                    try:
-                        value.value = 0
-                    except TypeError:
-                        value.value = 0.0
+                value.reset()
 
 state = State()
 '''Global state variable object'''
 
 def define(name, typ=int, default=None):
+    '''Defines a Counter and returns its handle.'''
     return state.define(name, typ, default=default, stack_depth=3)
+
+def define_gauge(name, typ=float, default=None):
+    '''Defines a Gauge and returns its handle.'''
+    return state.define(name, typ, default=default, stack_depth=3,
+                        gauge=True)
             
         
+
+def define_histogram(name, sketch=None):
+    '''Defines a Histogram and returns its handle.'''
+    return state.define_histogram(name, sketch=sketch, stack_depth=3)
+
+def define_timer(name, sketch=None):
+    '''Defines a Timer and returns its handle.'''
+    return state.define_histogram(name, sketch=sketch, timer=True,
+                                  stack_depth=3)
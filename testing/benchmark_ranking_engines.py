@@ -0,0 +1,116 @@
+"""
+Benchmarks the ranking engines in ranking.engines on synthetic data from the
+rank test harness: items with scores drawn from the harness' beta
+distribution are compared by the random selector, and each engine ranks the
+resulting win matrix. Reports the wall time, the peak additional memory
+(measured in a separate process per engine) and the accuracy against the
+ground truth.
+
+Usage (from the repository root):
+    python -m testing.benchmark_ranking_engines [--sizes 500 2000]
+                                                [--samples 25] [--seed 0]
+"""
+
+import argparse
+import multiprocessing
+import Queue
+import resource
+import sys
+import time
+import numpy as np
+from scipy import sparse
+from ranking.engines import ENGINES
+from ranking.engines import get_engine
+from testing.rank_test_harness import Harness
+from testing.rank_test_harness import RandomSelector
+from testing.rank_test_harness import beta_distribution
+from testing.rank_test_harness import corrcoef_score
+from testing.rank_test_harness import prop_activator_generator
+from testing.rank_test_harness import weighted_kemeny_distance_ratio
+
+
+def harness_data(n, samples, seed=0):
+    """
+    Simulates comparisons with the test harness.
+
+    :param n: The number of items.
+    :param samples: The number of comparisons per item.
+    :param seed: The random seed.
+    :return: The sparse win matrix and the ground truth scores.
+    """
+    np.random.seed(seed)
+    h = Harness(n, RandomSelector(), beta_distribution,
+                prop_activator_generator(7.5), n, [])
+    h.iterate(n * samples)
+    return sparse.csr_matrix(h.stats.win_matrix), h.ground_truth
+
+
+def _max_rss_mb():
+    """
+    Returns the maximum resident set size of this process so far, in MB.
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+
+
+def _measure(name, W, queue):
+    """
+    Measures a single engine; runs in a child process and reports (seconds,
+    peak MB, scores) through the queue.
+    """
+    engine = get_engine(name)
+    base_rss = _max_rss_mb()
+    start = time.time()
+    scores = engine.rank(W)
+    elapsed = time.time() - start
+    queue.put((elapsed, _max_rss_mb() - base_rss, scores))
+
+
+def benchmark(name, W):
+    """
+    Measures an engine in a separate process.
+
+    :param name: The engine name, a key of ENGINES.
+    :param W: The win matrix.
+    :return: The elapsed time in seconds, the peak additional memory in MB
+             and the scores, or Nones if it failed.
+    """
+    queue = multiprocessing.Queue()
+    proc = multiprocessing.Process(target=_measure, args=(name, W, queue))
+    proc.start()
+    result = None
+    while result is None:
+        alive = proc.is_alive()
+        try:
+            result = queue.get(timeout=1.)
+        except Queue.Empty:
+            # checked before the get, so a result put just before the child
+            # exited has been read by now.
+            if not alive:
+                break
+    proc.join()
+    if result is None or proc.exitcode:
+        return None, None, None
+    return result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[500, 2000])
+    parser.add_argument('--samples', type=int, default=25,
+                        help='number of comparisons per item')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    print '%8s %16s %10s %10s %10s %10s' % ('n', 'engine', 'seconds',
+                                            'peak MB', 'kemeny', 'corrcoef')
+    for n in args.sizes:
+        W, truth = harness_data(n, args.samples, args.seed)
+        for name in sorted(ENGINES):
+            elapsed, peak, scores = benchmark(name, W)
+            if elapsed is None:
+                print '%8i %16s %10s' % (n, name, 'failed')
+                continue
+            print '%8i %16s %10.3f %10.1f %10.4f %10.4f' % (
+                n, name, elapsed, peak,
+                weighted_kemeny_distance_ratio(scores, truth),
+                corrcoef_score(scores, truth))
+            sys.stdout.flush()
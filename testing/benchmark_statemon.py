@@ -0,0 +1,106 @@
+"""
+Benchmarks the cost of incrementing a statemon variable, comparing the
+original lookup-by-name (which inspected the stack and searched the loaded
+modules on every call) with the cached lookup-by-name and with the handles
+returned by statemon.define() and statemon.define_gauge().
+
+Each method is run by one or more threads, each incrementing the same
+variable, and the final value is checked against the number of increments.
+
+Usage (from the repository root):
+    python -m testing.benchmark_statemon [--increments 200000]
+                                         [--threads 1 4]
+"""
+
+import argparse
+import inspect
+import os.path
+import threading
+import time
+import statemon
+
+_n_by_name = statemon.define('n_by_name')
+_n_counter = statemon.define('n_counter')
+_n_gauge = statemon.define_gauge('n_gauge', int)
+_n_original = statemon.define_gauge('n_original', int)
+
+
+def _original_increment(name, diff=1):
+    """
+    The original State.increment(name=...), which resolves the calling
+    module with inspect and increments the shared value under its lock.
+    """
+    frame = inspect.currentframe().f_back
+    mod = inspect.getmodule(frame)
+    apath = os.path.abspath(mod.__file__)
+    relpath = os.path.relpath(apath, statemon.state._NEON_ROOT)
+    relpath = os.path.splitext(relpath)[0]
+    ref = statemon.state.get_all_variables()[
+        '%s.%s' % ('.'.join(relpath.split('/')), name)]
+    with ref.get_lock():
+        ref.value += diff
+
+
+def _run_original(n):
+    for _ in xrange(n):
+        _original_increment('n_original')
+
+
+def _run_by_name(n):
+    for _ in xrange(n):
+        statemon.state.increment('n_by_name')
+
+
+def _run_gauge(n):
+    for _ in xrange(n):
+        _n_gauge.increment()
+
+
+def _run_counter(n):
+    for _ in xrange(n):
+        _n_counter.increment()
+
+
+METHODS = [('original', _run_original, _n_original),
+           ('by_name', _run_by_name, _n_by_name),
+           ('gauge', _run_gauge, _n_gauge),
+           ('counter', _run_counter, _n_counter)]
+
+
+def benchmark(run, handle, increments, n_threads):
+    """
+    Measures a method of incrementing.
+
+    :param run: A function that increments the variable n times.
+    :param handle: The variable's handle.
+    :param increments: The total number of increments.
+    :param n_threads: The number of threads among which the increments are
+                      divided.
+    :return: The mean time per increment in microseconds and whether the
+             variable's final value is correct.
+    """
+    handle.reset()
+    per_thread = increments // n_threads
+    threads = [threading.Thread(target=run, args=(per_thread,))
+               for _ in range(n_threads)]
+    start = time.time()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.time() - start
+    total = per_thread * n_threads
+    return elapsed * 1e6 / total, handle.value == total
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--increments', type=int, default=200000)
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 4])
+    args = parser.parse_args()
+    print '%10s %8s %12s %8s' % ('method', 'threads', 'us/incr', 'correct')
+    for n_threads in args.threads:
+        for name, run, handle in METHODS:
+            usec, correct = benchmark(run, handle, args.increments,
+                                      n_threads)
+            print '%10s %8i %12.3f %8s' % (name, n_threads, usec, correct)
@@ -0,0 +1,135 @@
+"""
+Benchmarks the construction of the RankCentrality transition matrix P from a
+win matrix W, comparing the original LIL-based implementation with the
+vectorized one in ranking.rank_from_wm.
+
+Each measurement runs in its own process, so that the peak memory (the
+increase in the maximum resident set size over the course of the call) of
+one does not mask another's.
+
+Usage:
+    python testing/benchmark_w_to_p.py [--sizes 10000 100000 1000000]
+                                       [--degree 20] [--max-old 100000]
+"""
+
+import argparse
+import multiprocessing
+import resource
+import sys
+import time
+import numpy as np
+from scipy import sparse
+from ranking.rank_from_wm import _w_to_p
+
+
+def _w_to_p_lil(W):
+    """
+    The original implementation of _w_to_p, which assigns elements of a LIL
+    matrix using fancy indexing.
+
+    :param W: An N x N win matrix.
+    :return: The time-independent transition matrix P
+    """
+    W = sparse.lil_matrix(W.T, dtype=np.int)
+    row_counts = np.diff(W.tocsr().indptr)
+    rdmax = 1 / float(np.max(row_counts))
+    a, b = W.nonzero()
+    P = W.astype(float)
+    P[a, b] = W[a, b] / (W[a, b] + W[b, a])
+    P = P.tocsr()
+    P = P.multiply(rdmax)
+    dr, dc = np.diag_indices_from(P)
+    P[dr, dc] = 1 - np.squeeze(P.sum(1).A)
+    P.eliminate_zeros()
+    return P
+
+
+IMPLEMENTATIONS = {'old': _w_to_p_lil, 'new': _w_to_p}
+
+
+def random_win_matrix(n, degree, seed=0):
+    """
+    Generates a random sparse win matrix, in which each item has been
+    compared against (on average) degree others, with each comparison won in
+    either direction between 0 and 4 times.
+
+    :param n: The number of items.
+    :param degree: The mean number of items each item is compared with.
+    :param seed: The random seed.
+    :return: An N x N CSR win matrix.
+    """
+    rs = np.random.RandomState(seed)
+    m = n * degree // 2
+    i = rs.randint(0, n, m)
+    j = rs.randint(0, n, m)
+    keep = i != j
+    i, j = i[keep], j[keep]
+    w_ij = rs.randint(0, 5, len(i))
+    w_ji = rs.randint(0, 5, len(i))
+    return sparse.csr_matrix((np.concatenate([w_ij, w_ji]),
+                              (np.concatenate([i, j]),
+                               np.concatenate([j, i]))), shape=(n, n))
+
+
+def _max_rss_mb():
+    """
+    Returns the maximum resident set size of this process so far, in MB.
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+
+
+def _measure(impl, n, degree, queue):
+    """
+    Measures a single implementation at a single size; runs in a child
+    process and reports (seconds, peak MB, nnz of P) through the queue.
+    """
+    W = random_win_matrix(n, degree)
+    base_rss = _max_rss_mb()
+    start = time.time()
+    P = IMPLEMENTATIONS[impl](W)
+    elapsed = time.time() - start
+    queue.put((elapsed, _max_rss_mb() - base_rss, P.nnz))
+
+
+def benchmark(impl, n, degree):
+    """
+    Measures an implementation in a separate process.
+
+    :param impl: The implementation name, a key of IMPLEMENTATIONS.
+    :param n: The number of items.
+    :param degree: The mean number of comparisons per item.
+    :return: The elapsed time in seconds, the peak additional memory in MB
+             and the number of nonzeros in P, or Nones if it failed.
+    """
+    queue = multiprocessing.Queue()
+    proc = multiprocessing.Process(target=_measure,
+                                   args=(impl, n, degree, queue))
+    proc.start()
+    proc.join()
+    if proc.exitcode:
+        return None, None, None
+    return queue.get()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[10000, 100000, 1000000])
+    parser.add_argument('--degree', type=int, default=20,
+                        help='mean number of comparisons per item')
+    parser.add_argument('--max-old', type=int, default=100000,
+                        help='skip the old implementation above this size')
+    args = parser.parse_args()
+    print '%10s %5s %10s %12s %12s' % ('n', 'impl', 'seconds', 'peak MB',
+                                       'nnz(P)')
+    for n in args.sizes:
+        for impl in ['old', 'new']:
+            if impl == 'old' and n > args.max_old:
+                print '%10i %5s %10s' % (n, impl, 'skipped')
+                continue
+            elapsed, peak, nnz = benchmark(impl, n, args.degree)
+            if elapsed is None:
+                print '%10i %5s %10s' % (n, impl, 'failed')
+                continue
+            print '%10i %5s %10.2f %12.1f %12i' % (n, impl, elapsed, peak, nnz)
+            sys.stdout.flush()
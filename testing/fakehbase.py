@@ -0,0 +1,242 @@
+"""
+Exports ConnectionPool, an in-memory stand-in for happybase.ConnectionPool,
+so that db.Get and db.Set (and everything built on them) can be run without
+HBase:
+
+    pool = ConnectionPool()
+    dbget = Get(pool)
+    dbset = Set(pool)
+    dbset.force_regen_tables()
+
+The tables implement the subset of happybase.Table that db.py uses: row,
+rows, scan, put, delete, batch and the counters. Scans support row ranges,
+prefixes, limits and the SingleColumnValueFilter expressions that db.py
+builds (joined by AND or OR); other filters are ignored. Cells keep only
+their latest version, and are given the time in milliseconds as their
+timestamp, as in HBase, so that cells written in the same millisecond share
+a timestamp.
+
+All the connections of a pool share its tables, which are guarded by a lock
+per table, so the pool may be used by many threads.
+"""
+
+import re
+import struct
+import threading
+import time
+from contextlib import contextmanager
+
+_SCVF = re.compile(r"SingleColumnValueFilter\s*\(\s*'([^']*)'\s*,\s*"
+                   r"'([^']*)'\s*,\s*([<>=!]+)\s*,\s*'([a-z]+):([^']*)'"
+                   r"(?:\s*,\s*(true|false)\s*,\s*(true|false))?\s*\)")
+
+_COMPARE = {'=': lambda a, b: a == b, '!=': lambda a, b: a != b,
+            '>=': lambda a, b: a >= b, '>': lambda a, b: a > b,
+            '<=': lambda a, b: a <= b, '<': lambda a, b: a < b}
+
+
+def _compile_filter(filter_string):
+    """
+    Compiles a filter string to a predicate of a row's cells.
+
+    :param filter_string: An HBase filter string, or None.
+    :return: A function that accepts a row (a dict mapping columns to
+             (value, timestamp) tuples) and returns whether it passes.
+    """
+    terms = _SCVF.findall(filter_string or '')
+    if not terms:
+        return lambda row: True
+    conjunction = ' OR ' not in filter_string
+
+    def passes(term, row):
+        family, qualifier, op, comparator, value, if_missing, _ = term
+        column = '%s:%s' % (family, qualifier)
+        if column not in row:
+            # filterIfMissing defaults to false, which passes the row.
+            return if_missing != 'true'
+        cell = row[column][0]
+        if comparator == 'regexstring':
+            matches = re.search(value, cell) is not None
+            return matches if op == '=' else not matches
+        return _COMPARE[op](cell, value)
+
+    def predicate(row):
+        results = (passes(term, row) for term in terms)
+        return all(results) if conjunction else any(results)
+    return predicate
+
+
+def _selected(column, columns):
+    """
+    Returns whether a column is among the requested columns or families.
+    """
+    family = column.split(':')[0]
+    return any(column == c or family == c.rstrip(':') for c in columns)
+
+
+class _Batch(object):
+    """
+    Buffers the mutations of a table until it is sent.
+    """
+    def __init__(self, table):
+        self._table = table
+        self._mutations = []
+
+    def put(self, row, data):
+        self._mutations.append((self._table.put, (row, data)))
+
+    def delete(self, row, columns=None):
+        self._mutations.append((self._table.delete, (row, columns)))
+
+    def send(self):
+        with self._table._lock:
+            for func, args in self._mutations:
+                func(*args)
+        self._mutations = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.send()
+
+
+class Table(object):
+    """
+    An in-memory table, whose rows map columns to (value, timestamp) tuples.
+    """
+    def __init__(self, name, families=None):
+        self.name = name
+        self.families = dict(families or {})
+        self._rows = {}
+        self._lock = threading.RLock()
+
+    def _project(self, row, columns, include_timestamp):
+        return {column: cell if include_timestamp else cell[0]
+                for column, cell in row.iteritems()
+                if not columns or _selected(column, columns)}
+
+    def row(self, row, columns=None, timestamp=None,
+            include_timestamp=False):
+        with self._lock:
+            return self._project(self._rows.get(row, {}), columns,
+                                 include_timestamp)
+
+    def rows(self, rows, columns=None, timestamp=None,
+             include_timestamp=False):
+        with self._lock:
+            return [(row, self._project(self._rows[row], columns,
+                                        include_timestamp))
+                    for row in rows if row in self._rows]
+
+    def scan(self, row_start=None, row_stop=None, row_prefix=None,
+             columns=None, filter=None, timestamp=None,
+             include_timestamp=False, batch_size=1000, scan_batching=None,
+             limit=None, sorted_columns=False, reverse=False):
+        predicate = _compile_filter(filter)
+        with self._lock:
+            keys = sorted(self._rows, reverse=reverse)
+        n = 0
+        for key in keys:
+            if row_prefix is not None and not key.startswith(row_prefix):
+                continue
+            if row_start is not None and key < row_start:
+                continue
+            if row_stop is not None and key >= row_stop:
+                continue
+            with self._lock:
+                row = self._rows.get(key)
+                if row is None or not predicate(row):
+                    continue
+                data = self._project(row, columns, include_timestamp)
+            yield key, data
+            n += 1
+            if limit is not None and n >= limit:
+                return
+
+    def put(self, row, data, timestamp=None, wal=True):
+        with self._lock:
+            if timestamp is None:
+                timestamp = int(time.time() * 1000)
+            cells = self._rows.setdefault(row, {})
+            for column, value in data.iteritems():
+                cells[column] = (value, timestamp)
+
+    def delete(self, row, columns=None, timestamp=None, wal=True):
+        with self._lock:
+            cells = self._rows.get(row, {})
+            for column in list(columns or cells):
+                cell = cells.get(column)
+                if cell is not None and (timestamp is None or
+                                         cell[1] <= timestamp):
+                    del cells[column]
+            if not cells:
+                self._rows.pop(row, None)
+
+    def batch(self, timestamp=None, batch_size=None, transaction=False,
+              wal=True):
+        return _Batch(self)
+
+    def counter_get(self, row, column):
+        with self._lock:
+            cell = self._rows.get(row, {}).get(column)
+        if cell is None:
+            return 0
+        return struct.unpack('>q', cell[0])[0]
+
+    def counter_set(self, row, column, value=0):
+        self.put(row, {column: struct.pack('>q', value)})
+
+    def counter_inc(self, row, column, value=1):
+        with self._lock:
+            value += self.counter_get(row, column)
+            self.counter_set(row, column, value)
+            return value
+
+    def counter_dec(self, row, column, value=1):
+        return self.counter_inc(row, column, -value)
+
+
+class Connection(object):
+    """
+    A connection to the tables of a pool.
+    """
+    def __init__(self, tables, lock):
+        self._tables = tables
+        self._lock = lock
+
+    def tables(self):
+        with self._lock:
+            return sorted(self._tables)
+
+    def create_table(self, name, families):
+        with self._lock:
+            if name in self._tables:
+                raise ValueError('Table %s already exists' % name)
+            self._tables[name] = Table(name, families)
+
+    def delete_table(self, name, disable=False):
+        with self._lock:
+            self._tables.pop(name, None)
+
+    def table(self, name, use_prefix=True):
+        with self._lock:
+            return self._tables[name]
+
+
+class ConnectionPool(object):
+    """
+    A pool of connections to the same in-memory tables.
+    """
+    def __init__(self, size=1, **kwargs):
+        """
+        :param size: Ignored; any number of connections may be open at once.
+        :return: A ConnectionPool instance.
+        """
+        self._tables = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def connection(self, timeout=None):
+        yield Connection(self._tables, self._lock)
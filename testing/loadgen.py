@@ -0,0 +1,536 @@
+"""
+Generates load on the webserver's /task and /submit endpoints with simulated
+workers, and reports the throughput, the latency percentiles and the rates of
+refusals and errors of each endpoint, so that performance changes can be
+compared with the same tool.
+
+The webserver is imported with SIMULATED_BACKENDS set (see conf.py), so that
+it runs against the in-memory HBase and MTurk stand-ins of testing/, and is
+driven in-process through Flask's test client. Each worker repeatedly:
+
+    1. picks an assignable HIT on the simulated MTurk (a practice, until it
+       has passed one) and previews it (/task with the preview assignment);
+    2. accepts it on the simulated MTurk and requests it (/task);
+    3. answers every trial of the task's blocks and submits the jsPsych data
+       (/submit), contradicting itself on a fraction of the image tuples and
+       answering a fraction of the trials too fast.
+
+A fraction of the workers are new, and must pass a practice (and provide
+their demographics) first; the rest are returning workers, who are
+qualified from the start. The housekeeping that follows submissions (storing
+the outcomes, banning, topping up the HITs) runs on the webserver's job
+queue, as it does in production.
+
+A response is counted as an error if it has an error status or raises, and
+as a refusal if it is the error page or a plain-text refusal (e.g., 'You
+have been banned.').
+
+Usage (from the repository root):
+    python -m testing.loadgen [--workers 20] [--duration 60]
+                              [--contradiction-rate 0.02]
+                              [--too-fast-rate 0.02] [--new-workers 0.2]
+                              [--mturk-latency 0.05] [--mturk-error-rate 0]
+"""
+
+import argparse
+import collections
+import json
+import logging
+import math
+import random
+import re
+import threading
+import time
+import numpy as np
+import boto.mturk.connection
+from geoip import geolite2
+import conf
+from conf import *
+
+N_IMAGES = 50000  # the number of synthetic images to seed the database with
+
+ENDPOINTS = ['preview', 'task', 'submit']
+
+_TASK_ID = re.compile(r'var task_id = "([^"]*)";')
+_COLLECT_DEMO = re.compile(r'var collect_demo = true;')
+_COLLECT_VALIDATING_DEMO = re.compile(r'var collect_validating_demo = true;')
+_BANNED = 'You have been banned.'
+
+
+def seed_database(dbset, n_images=N_IMAGES):
+    """
+    Creates the tables and registers active, synthetic images. Unlike
+    register_images, this does not fetch the images to measure them.
+
+    WARNING: This regenerates all the tables!
+
+    :param dbset: A database Set object.
+    :param n_images: The number of images.
+    :return: None
+    """
+    dbset.force_regen_tables()
+    dbset.create_task_json_table(clobber=True)
+    with dbset.pool.connection() as conn:
+        table = conn.table(IMAGE_TABLE)
+        b = table.batch()
+        for i in xrange(n_images):
+            b.put('im%07i' % i,
+                  {'metadata:width': '640', 'metadata:height': '480',
+                   'metadata:aspect_ratio': '1.333',
+                   'metadata:url': 'https://images.example.com/im%07i.jpg' % i,
+                   'metadata:is_active': TRUE})
+        b.send()
+
+
+class LoadStats(object):
+    """
+    Records the latency and the outcome of every request, by endpoint.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._latencies = collections.defaultdict(list)  # in milliseconds
+        self._outcomes = collections.defaultdict(collections.Counter)
+        self.counts = collections.Counter()  # other events, e.g., 'banned'
+
+    def record(self, endpoint, ms, outcome):
+        """
+        :param endpoint: The endpoint name.
+        :param ms: The latency, in milliseconds.
+        :param outcome: 'ok', 'refused' or 'error'.
+        :return: None
+        """
+        with self._lock:
+            self._latencies[endpoint].append(ms)
+            self._outcomes[endpoint][outcome] += 1
+
+    def count(self, event, n=1):
+        with self._lock:
+            self.counts[event] += n
+
+    def report(self, elapsed):
+        """
+        Returns the per-endpoint report as a string.
+
+        :param elapsed: The duration of the run, in seconds.
+        :return: The report.
+        """
+        lines = ['%-8s %8s %8s %8s %8s %8s %8s %8s %8s' % (
+            'endpoint', 'requests', 'req/s', 'p50 ms', 'p90 ms', 'p99 ms',
+            'max ms', 'refused', 'errors')]
+        with self._lock:
+            for endpoint in ENDPOINTS:
+                latencies = self._latencies[endpoint]
+                outcomes = self._outcomes[endpoint]
+                n = len(latencies)
+                if not n:
+                    lines.append('%-8s %8i' % (endpoint, 0))
+                    continue
+                p50, p90, p99 = np.percentile(latencies, [50, 90, 99])
+                lines.append(
+                    '%-8s %8i %8.2f %8.1f %8.1f %8.1f %8.1f %7.2f%% %7.2f%%' %
+                    (endpoint, n, n / elapsed, p50, p90, p99,
+                     max(latencies), 100. * outcomes['refused'] / n,
+                     100. * outcomes['error'] / n))
+        return '\n'.join(lines)
+
+
+def _worker_ip(rng):
+    """
+    Returns a random IP address that can be located, since the demographics
+    of workers who cannot be are not stored.
+    """
+    while True:
+        ip = '%i.%i.%i.%i' % tuple(rng.randint(1, 223) for _ in range(4))
+        if geolite2.lookup(ip) is not None:
+            return ip
+
+
+def _outcome(response):
+    """
+    Classifies a response as 'ok', 'refused' or 'error'.
+    """
+    if response.status_code >= 400:
+        return 'error'
+    body = response.get_data()
+    if not body.lstrip().startswith('<') or '<title>Error</title>' in body:
+        return 'refused'
+    return 'ok'
+
+
+def make_payload(blocks, worker_id, hit_id, assignment_id, task_id,
+                 is_practice, demographics=None, contradiction_rate=0.,
+                 too_fast_rate=0., rng=random):
+    """
+    Builds the data that jsPsych submits for a task, as the task page would:
+    the demographics (if they were asked for), the instructions and a trial
+    for every image tuple of the blocks, with the properties that the page
+    adds to every trial.
+
+    A consistent worker keeps the image of a tuple with the least task-wide
+    index and rejects the one with the greatest; a worker that contradicts
+    itself on a tuple keeps and rejects the same image.
+
+    :param blocks: The task blocks, as returned by Get.get_task_blocks.
+    :param worker_id: The worker ID.
+    :param hit_id: The HIT ID.
+    :param assignment_id: The assignment ID.
+    :param task_id: The task ID.
+    :param is_practice: Whether the task is a practice.
+    :param demographics: A (gender, birthyear) tuple, if the page asked for
+                         them.
+    :param contradiction_rate: The probability that a tuple is contradicted.
+    :param too_fast_rate: The probability that a trial is answered faster
+                          than MIN_TRIAL_RT.
+    :param rng: The random number generator.
+    :return: The payload (a list of dicts) and whether the worker passes the
+             practice, by the thresholds of the practice's debrief.
+    """
+    data = []
+    elapsed = 0
+    if demographics is not None:
+        elapsed += rng.randint(5000, 20000)
+        data.append({'trial_type': 'html', 'rt': elapsed,
+                     'time_elapsed': elapsed, 'gender': demographics[0],
+                     'birthyear': str(demographics[1])})
+    contradicted = {}
+    n_trials = n_too_fast = 0
+    for block in blocks:
+        rt = rng.randint(3000, 15000)
+        elapsed += rt
+        data.append({'trial_type': 'instructions', 'rt': rt,
+                     'time_elapsed': elapsed})
+        for images, widths, heights, tup_idx, idx_map in zip(
+                block['images'], block['ims_width'], block['ims_height'],
+                block['global_tup_idxs'], block['image_idx_map']):
+            if tup_idx not in contradicted:
+                contradicted[tup_idx] = rng.random() < contradiction_rate
+            ranked = sorted(range(len(idx_map)), key=lambda i: idx_map[i])
+            if block['type'] == KEEP_BLOCK or contradicted[tup_idx]:
+                choice_idx = ranked[0]
+            else:
+                choice_idx = ranked[-1]
+            if rng.random() < too_fast_rate:
+                rt = rng.randint(150, MIN_TRIAL_RT)
+                n_too_fast += 1
+            else:
+                rt = max(MIN_TRIAL_RT + 1,
+                         int(rng.lognormvariate(math.log(1500), 0.4)))
+            n_trials += 1
+            elapsed += rt + DEF_FEEDBACK_TIME + TIMING_POST_TRIAL
+            stims = [{'file': url, 'id': url.split('/')[-1].split('.')[0],
+                      'width': width, 'height': height}
+                     for url, width, height in zip(images, widths, heights)]
+            data.append({'trial_type': 'click-choice',
+                         'action_type': block['type'],
+                         'trial_images': stims, 'stims': stims,
+                         'choice': stims[choice_idx]['id'],
+                         'choice_idx': choice_idx, 'rt': rt,
+                         'time_elapsed': elapsed,
+                         'global_tup_idx': tup_idx,
+                         'image_idx_map': idx_map})
+    frac_contradictions = float(sum(contradicted.values())) * 2 / n_trials
+    passed = (float(n_too_fast) / n_trials <= MAX_FRAC_TOO_FAST and
+              frac_contradictions <= MAX_FRAC_CONTRADICTIONS)
+    for n, trial in enumerate(data):
+        trial.update({'trial_index': n, 'internal_node_id': '0-%i' % n,
+                      'is_practice': is_practice,
+                      'passed_practice': passed if is_practice else True,
+                      'assignmentId': assignment_id, 'hitId': hit_id,
+                      'workerId': worker_id, 'previewMode': False,
+                      'outsideTurk': False, 'taskId': task_id})
+    return data, passed
+
+
+class SimulatedWorker(object):
+    """
+    A worker that previews, accepts, requests and submits HITs until the run
+    ends.
+    """
+    def __init__(self, worker_id, webserver, stats, task_type, practice_type,
+                 qualified, contradiction_rate, too_fast_rate, think_time,
+                 seed):
+        """
+        :param worker_id: The worker ID.
+        :param webserver: The webserver module.
+        :param stats: The LoadStats to record requests to.
+        :param task_type: The task HIT type ID.
+        :param practice_type: The practice HIT type ID.
+        :param qualified: Whether the worker has already passed a practice.
+        :param contradiction_rate: See make_payload.
+        :param too_fast_rate: See make_payload.
+        :param think_time: The time between requesting and submitting a
+                           task, in seconds.
+        :param seed: The seed of the worker's random number generator.
+        :return: A SimulatedWorker instance.
+        """
+        self.worker_id = worker_id
+        self.webserver = webserver
+        self.sim = webserver.mtconn
+        self.stats = stats
+        self.task_type = task_type
+        self.practice_type = practice_type
+        self.qualified = qualified
+        self.contradiction_rate = contradiction_rate
+        self.too_fast_rate = too_fast_rate
+        self.think_time = think_time
+        self.rng = random.Random(seed)
+        self.client = webserver.app.test_client()
+        self.headers = {'X-Forwarded-For': _worker_ip(self.rng),
+                        'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64)'}
+        self.demographics = (self.rng.choice(['male', 'female']),
+                             self.rng.randint(1950, 1998))
+        self.banned = False
+
+    def _request(self, endpoint, method, path, **kwargs):
+        """
+        Makes and records a request.
+
+        :return: The response, or None if the request raised.
+        """
+        start = time.time()
+        try:
+            response = self.client.open(path, method=method,
+                                        headers=self.headers, **kwargs)
+            outcome = _outcome(response)
+        except Exception:
+            logging.exception('Request to %s raised', path)
+            response, outcome = None, 'error'
+        self.stats.record(endpoint, (time.time() - start) * 1000., outcome)
+        if response is not None and response.get_data() == _BANNED:
+            self.banned = True
+        return response
+
+    def _accept_hit(self, hit_type_id, deadline):
+        """
+        Picks an assignable HIT, previews and accepts it, waiting for one to
+        be posted if need be.
+
+        :return: The HIT ID and the assignment ID, or None if the run ends
+                 first.
+        """
+        while time.time() < deadline:
+            hit_ids = self.sim.assignable_hits(hit_type_id)
+            if not hit_ids:
+                self.stats.count('seconds spent waiting for HITs', 0.05)
+                time.sleep(0.05)
+                continue
+            hit_id = self.rng.choice(hit_ids)
+            self._request('preview', 'GET', '/task', query_string={
+                'assignmentId': PREVIEW_ASSIGN_ID, 'hitId': hit_id})
+            try:
+                return hit_id, self.sim.accept_hit(hit_id, self.worker_id)
+            except boto.mturk.connection.MTurkRequestError:
+                # another worker took it first.
+                self.stats.count('HITs taken first by another worker')
+                time.sleep(self.rng.uniform(0, 0.05))
+        return None
+
+    def run(self, deadline, max_tasks=None):
+        """
+        Works until the deadline, the worker has submitted max_tasks tasks
+        (not counting practices) or it is banned.
+
+        :param deadline: The end of the run, as a time.time() timestamp.
+        :param max_tasks: The most tasks to submit. [def: no limit]
+        :return: None
+        """
+        n_tasks = 0
+        while time.time() < deadline and not self.banned:
+            if max_tasks is not None and n_tasks >= max_tasks:
+                return
+            is_practice = not self.qualified
+            accepted = self._accept_hit(
+                self.practice_type if is_practice else self.task_type,
+                deadline)
+            if accepted is None:
+                return
+            hit_id, assignment_id = accepted
+            response = self._request('task', 'GET', '/task', query_string={
+                'assignmentId': assignment_id, 'hitId': hit_id,
+                'workerId': self.worker_id,
+                'turkSubmitTo': 'https://workersandbox.mturk.com'})
+            body = response.get_data() if response is not None else ''
+            match = _TASK_ID.search(body)
+            blocks = match and \
+                self.webserver.dbget.get_task_blocks(match.group(1))
+            if not blocks:
+                self.sim.return_assignment(assignment_id)
+                continue
+            if self.think_time:
+                time.sleep(self.rng.expovariate(1. / self.think_time))
+            ask_demographics = (_COLLECT_DEMO.search(body) or
+                                _COLLECT_VALIDATING_DEMO.search(body))
+            payload, passed = make_payload(
+                blocks, self.worker_id, hit_id, assignment_id,
+                match.group(1), is_practice,
+                demographics=self.demographics if ask_demographics else None,
+                contradiction_rate=self.contradiction_rate,
+                too_fast_rate=self.too_fast_rate, rng=self.rng)
+            response = self._request('submit', 'POST', '/submit',
+                                     data=json.dumps(payload),
+                                     content_type='application/json')
+            self.sim.submit_assignment(assignment_id)
+            if response is None or _outcome(response) != 'ok':
+                continue
+            if is_practice:
+                self.stats.count('practices submitted')
+                self.qualified = passed
+            else:
+                self.stats.count('tasks submitted')
+                n_tasks += 1
+
+
+def _import_webserver():
+    """
+    Imports the webserver against the simulated backends.
+    """
+    conf.SIMULATED_BACKENDS = True
+    conf.USE_DAEMON = False
+    conf.CONTINUOUS_MODE = True
+    import webserver
+    return webserver
+
+
+def _setup(webserver, n_images, n_hits, n_practices):
+    """
+    Seeds the database and posts the initial HITs and practices, as the
+    webserver's main does.
+
+    :return: The task HIT type ID and the practice HIT type ID.
+    """
+    import housekeeping
+    mt, dbget, dbset = webserver.mt, webserver.dbget, webserver.dbset
+    seed_database(dbset, n_images)
+    dbget.update_sampling()
+    task_type, practice_type = housekeeping.setup_hit_types(mt, dbget, dbset)
+    housekeeping.create_practices(mt, dbget, dbset, practice_type,
+                                  n=n_practices)
+    housekeeping.create_hits(mt, dbget, dbset, task_type, n=n_hits)
+    housekeeping.setup_indices(dbset)
+    return task_type, practice_type
+
+
+def _register_returning_worker(webserver, worker_id, demographics):
+    """
+    Registers a worker who has passed a practice and given their
+    demographics.
+    """
+    webserver.dbset.register_worker(worker_id)
+    webserver.dbset.worker_demographics(worker_id, *demographics)
+    webserver.mt.grant_worker_practice_passed(worker_id)
+
+
+def run(n_workers=20, duration=60., max_tasks=None, contradiction_rate=0.02,
+        too_fast_rate=0.02, new_workers=0.2, think_time=0.,
+        mturk_latency=0.05, mturk_jitter=0., mturk_error_rate=0.,
+        job_threads=NUM_THREADS, n_images=N_IMAGES, n_hits=None,
+        n_practices=None, seed=0, log_level='WARNING'):
+    """
+    Runs the simulated workers against the webserver.
+
+    :param n_workers: The number of concurrent workers.
+    :param duration: The length of the run, in seconds.
+    :param max_tasks: The most tasks each worker submits. [def: no limit]
+    :param contradiction_rate: See make_payload.
+    :param too_fast_rate: See make_payload.
+    :param new_workers: The fraction of workers who must pass a practice.
+    :param think_time: The mean time between requesting and submitting a
+                       task, in seconds.
+    :param mturk_latency: The least latency of the simulated MTurk calls,
+                          in seconds.
+    :param mturk_jitter: The mean latency added to it, in seconds.
+    :param mturk_error_rate: The probability that a simulated MTurk call
+                             fails.
+    :param job_threads: The number of threads of the webserver's job queue,
+                        which posts the HITs that replace submitted ones.
+    :param n_images: The number of synthetic images.
+    :param n_hits: The number of HITs posted initially. [def: twice
+                   n_workers]
+    :param n_practices: The number of practices posted initially. [def: the
+                        number of new workers]
+    :param seed: The seed of the workers and of the simulated MTurk.
+    :param log_level: The level of the webserver's logging.
+    :return: The LoadStats, the elapsed time and the webserver module.
+    """
+    webserver = _import_webserver()
+    for name in logging.Logger.manager.loggerDict:
+        if name.startswith('mturk'):
+            logging.getLogger(name).setLevel(log_level)
+    sim = webserver.mtconn
+    rng = random.Random(seed)
+    workers = []
+    stats = LoadStats()
+    n_new = int(round(n_workers * new_workers))
+    task_type, practice_type = _setup(webserver, n_images,
+                                      n_hits or 2 * n_workers,
+                                      n_practices or max(n_new, 1))
+    for n in range(n_workers):
+        worker = SimulatedWorker(
+            'LG%012i' % n, webserver, stats, task_type, practice_type,
+            n >= n_new, contradiction_rate, too_fast_rate, think_time,
+            rng.getrandbits(32))
+        if worker.qualified:
+            _register_returning_worker(webserver, worker.worker_id,
+                                       worker.demographics)
+        workers.append(worker)
+    # the simulated MTurk's latency and failures apply only to the run.
+    sim.latency, sim.jitter = mturk_latency, mturk_jitter
+    sim.error_rate = mturk_error_rate
+    sim.calls.clear()
+    webserver.job_queue.n_threads = job_threads
+    webserver.job_queue.start()
+    start = time.time()
+    deadline = start + duration
+    threads = [threading.Thread(target=w.run, args=(deadline, max_tasks),
+                                name='worker-%i' % n)
+               for n, w in enumerate(workers)]
+    for t in threads:
+        t.daemon = True
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.time() - start
+    stats.count('banned workers', sum(w.banned for w in workers))
+    stats.count('pending jobs at the end', webserver.job_queue.depth())
+    stats.count('simulated MTurk calls', sum(sim.calls.values()))
+    stats.count('simulated MTurk failures', sim.n_errors)
+    webserver.job_queue.stop()
+    return stats, elapsed, webserver
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--workers', type=int, default=20)
+    parser.add_argument('--duration', type=float, default=60.)
+    parser.add_argument('--max-tasks', type=int, default=None,
+                        help='the most tasks each worker submits')
+    parser.add_argument('--contradiction-rate', type=float, default=0.02)
+    parser.add_argument('--too-fast-rate', type=float, default=0.02)
+    parser.add_argument('--new-workers', type=float, default=0.2,
+                        help='the fraction of workers who take a practice')
+    parser.add_argument('--think-time', type=float, default=0.)
+    parser.add_argument('--mturk-latency', type=float, default=0.05)
+    parser.add_argument('--mturk-jitter', type=float, default=0.)
+    parser.add_argument('--mturk-error-rate', type=float, default=0.)
+    parser.add_argument('--job-threads', type=int, default=NUM_THREADS)
+    parser.add_argument('--images', type=int, default=N_IMAGES)
+    parser.add_argument('--hits', type=int, default=None)
+    parser.add_argument('--practices', type=int, default=None)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--log-level', default='WARNING',
+                        help='the level of the webserver\'s logging')
+    args = parser.parse_args()
+    stats, elapsed, _ = run(
+        n_workers=args.workers, duration=args.duration,
+        max_tasks=args.max_tasks, contradiction_rate=args.contradiction_rate,
+        too_fast_rate=args.too_fast_rate, new_workers=args.new_workers,
+        think_time=args.think_time, mturk_latency=args.mturk_latency,
+        mturk_jitter=args.mturk_jitter,
+        mturk_error_rate=args.mturk_error_rate,
+        job_threads=args.job_threads, n_images=args.images,
+        n_hits=args.hits, n_practices=args.practices, seed=args.seed,
+        log_level=args.log_level)
+    print '%i workers for %.1f s' % (args.workers, elapsed)
+    print stats.report(elapsed)
+    for event, n in sorted(stats.counts.iteritems()):
+        print '%s: %g' % (event, n)
@@ -0,0 +1,489 @@
+"""
+Exports MTurkSimulator, an in-process stand-in for the subset of boto's
+MTurkConnection that mturk.MTurk and the webserver use, so that the MTurk
+paths can be exercised and benchmarked without the live service or the
+sandbox:
+
+    sim = MTurkSimulator(seed=0, latency=0.05, error_rate=0.01)
+    mt = MTurk(sim)
+    mt.setup_quals()
+
+The simulator keeps the state of HIT types, HITs, assignments and
+qualification scores, and returns objects with the attributes boto's do
+(HITId, HITStatus, IntegerValue, ...), in lists as boto's ResultSets are.
+Failures are raised as boto.mturk.connection.MTurkRequestError.
+
+Every API call can be delayed, by a fixed latency plus an exponentially
+distributed jitter, and can fail at random, at a rate that may be set per
+method. The IDs, the delays and the failures are drawn from generators
+seeded with the seed, so that a run with one thread is reproducible; the
+calls made are counted in the calls attribute.
+
+The worker side of MTurk is simulated by accept_hit(), submit_assignment()
+and return_assignment().
+"""
+
+import collections
+import datetime
+import functools
+import hashlib
+import random
+import threading
+import time
+import boto.mturk.connection
+
+_ERROR_BODY = '<Error><Code>%s</Code><Message>%s</Message></Error>'
+
+
+def _error(code, message, status=400, reason='Bad Request'):
+    """
+    Returns an MTurkRequestError like those boto raises.
+    """
+    return boto.mturk.connection.MTurkRequestError(
+        status, reason, _ERROR_BODY % (code, message))
+
+
+class _Record(object):
+    """
+    A response element, whose fields are attributes.
+    """
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+
+    def __repr__(self):
+        return '<%s>' % ', '.join('%s=%r' % kv for kv in
+                                  sorted(self.__dict__.iteritems()))
+
+
+def _seconds(value):
+    """
+    Converts a duration given as seconds or as a timedelta to seconds.
+    """
+    if isinstance(value, datetime.timedelta):
+        return value.total_seconds()
+    return float(value)
+
+
+def _amount(value):
+    """
+    Converts a reward given as a number or as a boto Price to a float.
+    """
+    return float(getattr(value, 'amount', value) or 0)
+
+
+def _api(func):
+    """
+    Decorates a simulated API call, which is counted, delayed and may fail
+    before it is applied (under the simulator's lock).
+    """
+    name = func.__name__
+
+    @functools.wraps(func)
+    def call(self, *args, **kwargs):
+        self._before(name)
+        with self._lock:
+            return func(self, *args, **kwargs)
+    return call
+
+
+class MTurkSimulator(object):
+    """
+    Simulates the MTurk API calls used by mturk.MTurk and the webserver.
+    """
+    def __init__(self, seed=0, latency=0., jitter=0., error_rate=0.,
+                 error_rates=None, balance=10000., clock=time.time):
+        """
+        :param seed: The seed of the IDs, the delays and the failures.
+        :param latency: The least delay of every call, in seconds.
+        :param jitter: The mean of the exponentially distributed delay added
+                       to the latency, in seconds.
+        :param error_rate: The probability that a call fails.
+        :param error_rates: A dict mapping method names to the probability
+                            that calls to them fail, which overrides
+                            error_rate.
+        :param balance: The initial account balance, in USD.
+        :param clock: The function that returns the current time, which
+                      decides when HITs expire.
+        :return: A MTurkSimulator instance.
+        """
+        self.seed = seed
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_rates = dict(error_rates or {})
+        self.balance = float(balance)
+        self.clock = clock
+        self.calls = collections.Counter()
+        self.n_errors = 0
+        self.notifications = []  # (worker_ids, subject, message) tuples
+        self._ids = random.Random(seed)
+        self._faults = random.Random(seed + 1)
+        self._fault_lock = threading.Lock()
+        self._lock = threading.RLock()
+        self._quals = collections.OrderedDict()  # maps IDs to their fields
+        self._scores = {}  # maps (qualification ID, worker ID) to a value
+        self._hit_types = {}  # maps IDs to their fields
+        self._hits = collections.OrderedDict()  # maps IDs to their fields
+        self._assignments = collections.OrderedDict()  # maps IDs to fields
+
+    def _new_id(self, prefix):
+        """
+        Returns a new, deterministic 30-character ID.
+        """
+        digest = hashlib.sha1('%s%d' % (prefix, self._ids.getrandbits(64)))
+        return (prefix + digest.hexdigest().upper())[:30]
+
+    def _before(self, name):
+        """
+        Counts, delays and maybe fails a call.
+        """
+        with self._fault_lock:
+            self.calls[name] += 1
+            delay = self.latency
+            if self.jitter:
+                delay += self._faults.expovariate(1. / self.jitter)
+            rate = self.error_rates.get(name, self.error_rate)
+            fail = rate and self._faults.random() < rate
+            if fail:
+                self.n_errors += 1
+        if delay:
+            time.sleep(delay)
+        if fail:
+            raise _error('AWS.ServiceUnavailable',
+                         'Simulated failure of %s' % name, status=503,
+                         reason='Service Unavailable')
+
+    def _hit(self, hit_id):
+        try:
+            return self._hits[hit_id]
+        except KeyError:
+            raise _error('AWS.MechanicalTurk.HITDoesNotExist',
+                         'Hit %s does not exist.' % hit_id)
+
+    def _assignment(self, assignment_id):
+        try:
+            return self._assignments[assignment_id]
+        except KeyError:
+            raise _error('AWS.MechanicalTurk.AssignmentDoesNotExist',
+                         'Assignment %s does not exist.' % assignment_id)
+
+    def _qual(self, qualification_type_id):
+        try:
+            return self._quals[qualification_type_id]
+        except KeyError:
+            raise _error('AWS.MechanicalTurk.QualificationTypeDoesNotExist',
+                         'Qualification type %s does not exist.' %
+                         qualification_type_id)
+
+    def _hit_record(self, hit):
+        """
+        Returns the response element of a HIT, as of now.
+        """
+        now = self.clock()
+        expired = now >= hit['expiration']
+        assignments = [self._assignments[a] for a in hit['assignments']]
+        n_pending = sum(a['AssignmentStatus'] == 'Accepted'
+                        for a in assignments)
+        n_available = hit['max_assignments'] - len(assignments)
+        status = hit['status']
+        if status == 'Assignable' and (expired or not n_available):
+            status = 'Unassignable'
+        if status == 'Unassignable' and not n_pending and not n_available:
+            status = 'Reviewable'
+        return _Record(
+            HITId=hit['HITId'], HITTypeId=hit['HITTypeId'],
+            HITStatus=status, MaxAssignments=str(hit['max_assignments']),
+            RequesterAnnotation=hit['annotation'],
+            Expiration=datetime.datetime.utcfromtimestamp(
+                hit['expiration']).strftime('%Y-%m-%dT%H:%M:%SZ'),
+            NumberOfAssignmentsPending=str(n_pending),
+            NumberOfAssignmentsAvailable=str(max(n_available, 0)),
+            NumberOfAssignmentsCompleted=str(len(assignments) - n_pending),
+            expired=expired)
+
+    def _assignment_record(self, assignment):
+        return _Record(**assignment)
+
+    """
+    ACCOUNT
+    """
+
+    @_api
+    def get_account_balance(self):
+        return [_Record(amount=self.balance, currency_code='USD')]
+
+    """
+    HIT TYPES AND HITS
+    """
+
+    @_api
+    def register_hit_type(self, title, description, reward, duration,
+                          keywords=None, approval_delay=None, qual_req=None):
+        hit_type_id = self._new_id('T')
+        self._hit_types[hit_type_id] = dict(
+            title=title, description=description, reward=_amount(reward),
+            duration=_seconds(duration), keywords=keywords,
+            qual_req=qual_req)
+        return [_Record(HITTypeId=hit_type_id)]
+
+    @_api
+    def create_hit(self, hit_type=None, question=None, hit_layout=None,
+                   lifetime=datetime.timedelta(days=7), max_assignments=1,
+                   title=None, description=None, keywords=None, reward=None,
+                   duration=datetime.timedelta(days=7), approval_delay=None,
+                   annotation=None, **kwargs):
+        if hit_type not in self._hit_types:
+            raise _error('AWS.MechanicalTurk.HITTypeDoesNotExist',
+                         'Hit type %s does not exist.' % hit_type)
+        cost = self._hit_types[hit_type]['reward'] * max_assignments
+        if cost > self.balance:
+            raise _error('AWS.MechanicalTurk.InsufficientFunds',
+                         'Insufficient funds to create the HIT.')
+        self.balance -= cost
+        hit_id = self._new_id('H')
+        self._hits[hit_id] = dict(
+            HITId=hit_id, HITTypeId=hit_type, status='Assignable',
+            max_assignments=int(max_assignments), annotation=annotation,
+            expiration=self.clock() + _seconds(lifetime), assignments=[])
+        return [_Record(HITId=hit_id, HITTypeId=hit_type)]
+
+    @_api
+    def get_hit(self, hit_id, response_groups=None):
+        return [self._hit_record(self._hit(hit_id))]
+
+    @_api
+    def get_all_hits(self):
+        return iter([self._hit_record(hit) for hit in self._hits.values()
+                     if hit['status'] != 'Disposed'])
+
+    @_api
+    def disable_hit(self, hit_id, response_groups=None):
+        hit = self._hit(hit_id)
+        if hit['status'] == 'Disposed':
+            raise _error('AWS.MechanicalTurk.InvalidHITState',
+                         'Hit %s has been disposed.' % hit_id)
+        # submitted assignments are approved, pending ones are abandoned.
+        for assignment_id in hit['assignments']:
+            assignment = self._assignments[assignment_id]
+            if assignment['AssignmentStatus'] == 'Submitted':
+                assignment['AssignmentStatus'] = 'Approved'
+        hit['status'] = 'Disposed'
+        return []
+
+    @_api
+    def dispose_hit(self, hit_id):
+        hit = self._hit(hit_id)
+        if self._hit_record(hit).HITStatus != 'Reviewable':
+            raise _error('AWS.MechanicalTurk.InvalidHITState',
+                         'Hit %s is not reviewable.' % hit_id)
+        hit['status'] = 'Disposed'
+        return []
+
+    @_api
+    def extend_hit(self, hit_id, assignments_increment=None,
+                   expiration_increment=None):
+        hit = self._hit(hit_id)
+        if assignments_increment:
+            hit['max_assignments'] += int(assignments_increment)
+        if expiration_increment:
+            hit['expiration'] = max(hit['expiration'], self.clock()) + \
+                _seconds(expiration_increment)
+        return []
+
+    """
+    ASSIGNMENTS
+    """
+
+    @_api
+    def get_assignments(self, hit_id, status=None, sort_by='SubmitTime',
+                        sort_direction='Ascending', page_size=10,
+                        page_number=1, response_groups=None):
+        hit = self._hit(hit_id)
+        assignments = [self._assignments[a] for a in hit['assignments']]
+        # only assignments that have been submitted are listed.
+        return [self._assignment_record(a) for a in assignments
+                if a['AssignmentStatus'] != 'Accepted' and
+                (status is None or a['AssignmentStatus'] == status)]
+
+    @_api
+    def approve_assignment(self, assignment_id, feedback=None):
+        assignment = self._assignment(assignment_id)
+        if assignment['AssignmentStatus'] != 'Submitted':
+            raise _error('AWS.MechanicalTurk.InvalidAssignmentState',
+                         'Assignment %s is not submitted.' % assignment_id)
+        assignment['AssignmentStatus'] = 'Approved'
+        return []
+
+    @_api
+    def reject_assignment(self, assignment_id, feedback=None):
+        assignment = self._assignment(assignment_id)
+        if assignment['AssignmentStatus'] != 'Submitted':
+            raise _error('AWS.MechanicalTurk.InvalidAssignmentState',
+                         'Assignment %s is not submitted.' % assignment_id)
+        assignment['AssignmentStatus'] = 'Rejected'
+        # a rejected assignment's reward is returned to the requester.
+        hit = self._hits[assignment['HITId']]
+        self.balance += self._hit_types[hit['HITTypeId']]['reward']
+        return []
+
+    """
+    QUALIFICATIONS
+    """
+
+    @_api
+    def search_qualification_types(self, query=None, sort_by='Name',
+                                   sort_direction='Ascending', page_size=10,
+                                   page_number=1, must_be_requestable=True,
+                                   must_be_owned_by_caller=True):
+        return [_Record(QualificationTypeId=qid, Name=qual['name'])
+                for qid, qual in self._quals.iteritems()
+                if query is None or query.lower() in qual['name'].lower()]
+
+    @_api
+    def create_qualification_type(self, name, description, status,
+                                  keywords=None, retry_delay=None,
+                                  test=None, answer_key=None,
+                                  answer_key_xml=None, test_duration=None,
+                                  auto_granted=False, auto_granted_value=1,
+                                  **kwargs):
+        if any(q['name'] == name for q in self._quals.itervalues()):
+            raise _error('AWS.MechanicalTurk.QualificationTypeAlreadyExists',
+                         'You have already created a QualificationType with '
+                         'this name.')
+        qid = self._new_id('Q')
+        self._quals[qid] = dict(name=name, description=description,
+                                auto_granted=auto_granted,
+                                auto_granted_value=auto_granted_value)
+        return [_Record(QualificationTypeId=qid, Name=name)]
+
+    @_api
+    def get_qualification_score(self, qualification_type_id, worker_id):
+        qual = self._qual(qualification_type_id)
+        key = (qualification_type_id, worker_id)
+        if key not in self._scores:
+            if not qual['auto_granted']:
+                raise _error('AWS.MechanicalTurk.QualificationDoesNotExist',
+                             'You requested a Qualification that does not '
+                             'exist.')
+            self._scores[key] = int(qual['auto_granted_value'])
+        return [_Record(QualificationTypeId=qualification_type_id,
+                        SubjectId=worker_id,
+                        IntegerValue=str(self._scores[key]),
+                        Status='Granted')]
+
+    @_api
+    def assign_qualification(self, qualification_type_id, worker_id,
+                             value=1, send_notification=True):
+        self._qual(qualification_type_id)
+        key = (qualification_type_id, worker_id)
+        if key in self._scores:
+            raise _error('AWS.MechanicalTurk.QualificationAlreadyExists',
+                         'The worker already has the qualification.')
+        self._scores[key] = int(value)
+        return []
+
+    @_api
+    def update_qualification_score(self, qualification_type_id, worker_id,
+                                   value):
+        self._qual(qualification_type_id)
+        key = (qualification_type_id, worker_id)
+        if key not in self._scores:
+            raise _error('AWS.MechanicalTurk.QualificationDoesNotExist',
+                         'You requested a Qualification that does not '
+                         'exist.')
+        self._scores[key] = int(value)
+        return []
+
+    @_api
+    def revoke_qualification(self, subject_id, qualification_type_id,
+                             reason=None):
+        self._qual(qualification_type_id)
+        if self._scores.pop((qualification_type_id, subject_id),
+                            None) is None:
+            raise _error('AWS.MechanicalTurk.QualificationDoesNotExist',
+                         'You requested a Qualification that does not '
+                         'exist.')
+        return []
+
+    """
+    WORKERS
+    """
+
+    @_api
+    def notify_workers(self, worker_ids, subject, message_text):
+        if isinstance(worker_ids, basestring):
+            worker_ids = [worker_ids]
+        self.notifications.append((list(worker_ids), subject, message_text))
+        return []
+
+    @_api
+    def get_blocked_workers(self):
+        # workers are banned with a qualification rather than blocked.
+        return []
+
+    """
+    THE WORKER SIDE
+    """
+
+    def accept_hit(self, hit_id, worker_id):
+        """
+        Simulates a worker accepting a HIT.
+
+        :param hit_id: The HIT ID.
+        :param worker_id: The worker ID.
+        :return: The assignment ID.
+        """
+        with self._lock:
+            hit = self._hit(hit_id)
+            if self._hit_record(hit).HITStatus != 'Assignable':
+                raise _error('AWS.MechanicalTurk.HITNotAssignable',
+                             'Hit %s is not assignable.' % hit_id)
+            assignment_id = self._new_id('A')
+            self._assignments[assignment_id] = dict(
+                AssignmentId=assignment_id, HITId=hit_id, WorkerId=worker_id,
+                AssignmentStatus='Accepted')
+            hit['assignments'].append(assignment_id)
+            return assignment_id
+
+    def submit_assignment(self, assignment_id):
+        """
+        Simulates a worker submitting an assignment.
+
+        :param assignment_id: The assignment ID.
+        :return: None
+        """
+        with self._lock:
+            assignment = self._assignment(assignment_id)
+            if assignment['AssignmentStatus'] != 'Accepted':
+                raise _error('AWS.MechanicalTurk.InvalidAssignmentState',
+                             'Assignment %s is not accepted.' % assignment_id)
+            assignment['AssignmentStatus'] = 'Submitted'
+
+    def return_assignment(self, assignment_id):
+        """
+        Simulates a worker returning an assignment, which frees its place.
+
+        :param assignment_id: The assignment ID.
+        :return: None
+        """
+        with self._lock:
+            assignment = self._assignment(assignment_id)
+            if assignment['AssignmentStatus'] != 'Accepted':
+                raise _error('AWS.MechanicalTurk.InvalidAssignmentState',
+                             'Assignment %s is not accepted.' % assignment_id)
+            assignment['AssignmentStatus'] = 'Returned'
+            self._hits[assignment['HITId']]['assignments'].remove(
+                assignment_id)
+
+    def assignable_hits(self, hit_type_id=None):
+        """
+        Returns the IDs of the HITs that workers can accept.
+
+        :param hit_type_id: The HIT type ID. [def: any]
+        :return: A list of HIT IDs.
+        """
+        with self._lock:
+            return [hit_id for hit_id, hit in self._hits.iteritems()
+                    if (hit_type_id is None or
+                        hit['HITTypeId'] == hit_type_id) and
+                    self._hit_record(hit).HITStatus == 'Assignable']
@@ -13,6 +13,7 @@ so, back to the original plan of using the distinct column.
 
 from conf import *
 import happybase
+from db import Set
 import json
 
 _log = logger.setup_logger(__name__)
@@ -41,3 +42,7 @@ for n, (id, data) in enumerate(s):
     tot_time = jsn[-1]['time_elapsed']
     dst_table.put(id, {'completion_data:total_time': str(tot_time)})
 
+
+print 'Rebuilding the task time aggregate'
+Set(happybase.ConnectionPool(size=1, host=DATABASE_LOCATION)
+    ).rebuild_task_time_stats()
@@ -0,0 +1,281 @@
+"""
+Runs a parameter sweep of rank test harness simulations. Every cell of the
+grid of (selector, distribution, activator, gamma, activation chunk, seed) is
+simulated in a process pool, and the scores of each cell are checkpointed to
+a results file--one JSON object per line--at fixed iteration intervals. A
+cell is complete once a 'complete' record has been written for it, and
+re-running a sweep against the same results file skips the complete cells,
+so an interrupted sweep can be resumed.
+
+Each cell seeds numpy's random state with its own seed, so its results do
+not depend on the order in which cells are run or on the number of workers.
+
+Usage (from the repository root):
+    python -m testing.rank_sweep --results sweep.jsonl
+                                 [--selectors orig min_gap random]
+                                 [--activators prop] [--gammas 7.5]
+                                 [--chunks 100] [--seeds 0 1 2]
+                                 [--num-images 500] [--iterations 12500]
+                                 [--interval 100] [--workers 4]
+"""
+
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import time
+import uuid
+import numpy as np
+import logger
+from ranking.metrics import kendall_tau_score
+from ranking.metrics import spearman_score
+from testing.rank_test_harness import Harness
+from testing.rank_test_harness import MinimizeSamplingGapSelector
+from testing.rank_test_harness import OnlineOracleSelector
+from testing.rank_test_harness import OracleSelector
+from testing.rank_test_harness import OrigSelector
+from testing.rank_test_harness import RandomSelector
+from testing.rank_test_harness import beta_distribution
+from testing.rank_test_harness import corrcoef_score
+from testing.rank_test_harness import orig_activator_generator
+from testing.rank_test_harness import prop_activator_generator
+from testing.rank_test_harness import weighted_kemeny_distance_ratio
+
+_log = logger.setup_logger(__name__)
+
+SELECTORS = {'orig': OrigSelector,
+             'min_gap': MinimizeSamplingGapSelector,
+             'random': RandomSelector,
+             'oracle': OracleSelector,
+             'online_oracle': OnlineOracleSelector}
+DISTRIBUTIONS = {'beta': beta_distribution}
+# activators are generated from gamma.
+ACTIVATORS = {'orig': orig_activator_generator,
+              'prop': prop_activator_generator}
+METRICS = {'kemeny_ratio': weighted_kemeny_distance_ratio,
+           'corrcoef': corrcoef_score,
+           'kendall_tau': kendall_tau_score,
+           'spearman': spearman_score}
+# the selectors that compare items of similar scores, whose comparison graphs
+# are ranked far faster by a direct solver.
+_DIRECT_SOLVE_SELECTORS = ['oracle', 'online_oracle']
+
+# the lock that serializes writes to the results file, set by _init_worker.
+_results_lock = None
+
+
+def make_grid(selectors, distributions, activators, gammas, chunks, seeds):
+    """
+    Builds the cells of a sweep.
+
+    :param selectors: The selector names, keys of SELECTORS.
+    :param distributions: The distribution names, keys of DISTRIBUTIONS.
+    :param activators: The activator names, keys of ACTIVATORS.
+    :param gammas: The activator gammas.
+    :param chunks: The activation chunk sizes.
+    :param seeds: The random seeds.
+    :return: A list of cells, as dicts.
+    """
+    cells = []
+    for sel, dist, act, gamma, chunk, seed in itertools.product(
+            selectors, distributions, activators, gammas, chunks, seeds):
+        cells.append({'selector': sel, 'distribution': dist,
+                      'activator': act, 'gamma': gamma,
+                      'chunk': chunk, 'seed': seed})
+    return cells
+
+
+def cell_key(cell):
+    """
+    Returns the key identifying a cell in the results file.
+
+    :param cell: The cell, as a dict.
+    :return: The key, as a string.
+    """
+    return ','.join('%s=%s' % (k, cell[k]) for k in sorted(cell))
+
+
+def load_results(path):
+    """
+    Reads the checkpoints of the complete cells from a results file. If a
+    cell was run more than once (e.g., it was interrupted and resumed), only
+    the run that completed is returned.
+
+    :param path: The path to the results file.
+    :return: A dict mapping cell keys to the cell's parameters and its list
+             of (iteration, scores) checkpoints.
+    """
+    if not os.path.exists(path):
+        return {}
+    records = []
+    complete = {}
+    with open(path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # a partially-written line from an interrupted sweep.
+                continue
+            records.append(record)
+            if record.get('complete'):
+                complete[record['cell']] = record['run']
+    results = {}
+    for record in records:
+        key = record['cell']
+        if record.get('complete') or complete.get(key) != record['run']:
+            continue
+        result = results.setdefault(key, {'params': record['params'],
+                                          'checkpoints': []})
+        result['checkpoints'].append((record['iteration'],
+                                      record['scores']))
+    for result in results.itervalues():
+        result['checkpoints'].sort()
+    return results
+
+
+def _truncate_partial_line(path):
+    """
+    Removes the partially-written last line an interrupted sweep may have
+    left in a results file, so that the records appended on resuming start
+    on a line of their own.
+
+    :param path: The path to the results file.
+    :return: None
+    """
+    if not os.path.exists(path):
+        return
+    with open(path, 'r+b') as f:
+        f.seek(0, os.SEEK_END)
+        end = f.tell()
+        pos = end
+        while pos > 0:
+            step = min(4096, pos)
+            f.seek(pos - step)
+            chunk = f.read(step)
+            newline = chunk.rfind('\n')
+            if newline >= 0:
+                pos = pos - step + newline + 1
+                break
+            pos -= step
+        if pos < end:
+            _log.warn('Dropping a partial line from the end of %s', path)
+            f.truncate(pos)
+
+
+def _init_worker(lock):
+    """
+    Stores the results file lock in a worker process.
+    """
+    global _results_lock
+    _results_lock = lock
+
+
+def _write(path, record):
+    """
+    Appends a record to the results file.
+    """
+    with _results_lock:
+        with open(path, 'a') as f:
+            f.write(json.dumps(record) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+
+def run_cell(args):
+    """
+    Simulates a single cell, checkpointing its scores to the results file.
+
+    :param args: A tuple of the cell, the number of images, the number of
+                 iterations, the checkpoint interval, the metric names and
+                 the path to the results file.
+    :return: The cell's key and the time taken, in seconds.
+    """
+    cell, num_images, iterations, interval, metrics, path = args
+    key = cell_key(cell)
+    run = uuid.uuid4().hex
+    np.random.seed(cell['seed'])
+    harness = Harness(num_images,
+                      SELECTORS[cell['selector']](),
+                      DISTRIBUTIONS[cell['distribution']],
+                      ACTIVATORS[cell['activator']](cell['gamma']),
+                      cell['chunk'],
+                      [METRICS[m] for m in metrics],
+                      direct_solve=cell['selector'] in _DIRECT_SOLVE_SELECTORS)
+    start = time.time()
+    done = 0
+    while done < iterations:
+        step = min(interval, iterations - done)
+        harness.iterate(step)
+        done += step
+        scores = dict(zip(metrics, harness.get_scores()))
+        _write(path, {'cell': key, 'params': cell, 'run': run,
+                      'iteration': done, 'scores': scores,
+                      'elapsed': time.time() - start})
+    elapsed = time.time() - start
+    _write(path, {'cell': key, 'run': run, 'complete': True,
+                  'iterations': iterations, 'elapsed': elapsed})
+    return key, elapsed
+
+
+def sweep(cells, path, num_images=500, iterations=12500, interval=100,
+          metrics=('kemeny_ratio',), workers=None):
+    """
+    Runs the cells of a sweep that are not yet complete in the results file.
+
+    :param cells: The cells, as returned by make_grid.
+    :param path: The path to the results file.
+    :param num_images: The number of images in each simulation.
+    :param iterations: The number of comparisons in each simulation.
+    :param interval: The number of comparisons between checkpoints.
+    :param metrics: The names of the metrics to record, keys of METRICS.
+    :param workers: The number of processes. [def: the number of CPUs]
+    :return: The results, as returned by load_results.
+    """
+    _truncate_partial_line(path)
+    done = load_results(path)
+    todo = [c for c in cells if cell_key(c) not in done]
+    _log.info('%i of %i cells are complete, running %i', len(cells) -
+              len(todo), len(cells), len(todo))
+    if todo:
+        pool = multiprocessing.Pool(workers, initializer=_init_worker,
+                                    initargs=(multiprocessing.Lock(),))
+        try:
+            jobs = [(c, num_images, iterations, interval, list(metrics),
+                     path) for c in todo]
+            for n, (key, elapsed) in enumerate(
+                    pool.imap_unordered(run_cell, jobs)):
+                _log.info('Cell %i of %i complete in %.1fs: %s', n + 1,
+                          len(todo), elapsed, key)
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+    return load_results(path)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--results', required=True,
+                        help='the results file, which is appended to')
+    parser.add_argument('--selectors', nargs='+', default=['orig', 'min_gap',
+                                                           'random'],
+                        choices=sorted(SELECTORS))
+    parser.add_argument('--distributions', nargs='+', default=['beta'],
+                        choices=sorted(DISTRIBUTIONS))
+    parser.add_argument('--activators', nargs='+', default=['prop'],
+                        choices=sorted(ACTIVATORS))
+    parser.add_argument('--gammas', type=float, nargs='+', default=[7.5])
+    parser.add_argument('--chunks', type=int, nargs='+', default=[100])
+    parser.add_argument('--seeds', type=int, nargs='+', default=range(10))
+    parser.add_argument('--metrics', nargs='+', default=['kemeny_ratio'],
+                        choices=sorted(METRICS))
+    parser.add_argument('--num-images', type=int, default=500)
+    parser.add_argument('--iterations', type=int, default=12500)
+    parser.add_argument('--interval', type=int, default=100)
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+    grid = make_grid(args.selectors, args.distributions, args.activators,
+                     args.gammas, args.chunks, args.seeds)
+    sweep(grid, args.results, args.num_images, args.iterations,
+          args.interval, args.metrics, args.workers)
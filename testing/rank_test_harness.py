@@ -3,8 +3,10 @@ This is a test harness that will allow us to test the efficiacy of different
 sampling methodologies.
 """
 import numpy as np
+from scipy import sparse
 import logger
-import rank_centrality
+from ranking.metrics import weighted_kemeny_distance_ratio
+from ranking.ranker import Ranker
 
 _log = logger.setup_logger(__name__)
 
@@ -14,11 +16,17 @@ class _Statistics:
     and is held by the Harness and is passed to the selector and the
     activator. In particular, it maintains a sample counting array,
     a win matrix, and an active image array.
+
+    The win matrix is kept sparse: outcomes are appended to growable
+    (winner, loser) buffers, from which a CSR matrix is built on demand, and
+    the pairs that have been compared are kept as a set of integer keys.
     """
-    def __init__(self, num_images, ground_truth):
+    def __init__(self, num_images, ground_truth, direct_solve=False):
         """
         :param num_images: The number of images to run the simulation over.
         :param ground_truth: The ground truth.
+        :param direct_solve: Whether to rank with a direct solver rather than
+                             GMRES (see ranking.ranker.Ranker).
         :return: _Statistics object
         """
         self.num_images = num_images
@@ -26,28 +34,59 @@ class _Statistics:
         self.sampling_gap = -self.num_samples
         self.is_active = np.zeros(num_images, dtype=bool)
         self.num_active = 0
-        self.win_matrix = np.zeros((num_images, num_images))
         self.stop_activating = False
         self.pairs = set()
+        self._winners = np.zeros(1024, dtype=np.int32)
+        self._losers = np.zeros(1024, dtype=np.int32)
+        self._num_wins = 0
+        self._win_matrix = None
+        self._min_seen = 0
+        self._num_at_min = 0
+        self._ranker = Ranker(direct=direct_solve)
         self._rank = np.zeros(num_images) + 1.
         self._recomp_rank = False
         self._ground_truth = ground_truth
 
+    @property
+    def win_matrix(self):
+        """
+        :return: The sparse win matrix, whose entry i,j is 1 if i has beaten
+        j at least once.
+        """
+        if self._win_matrix is None:
+            n = self._num_wins
+            self._win_matrix = sparse.csr_matrix(
+                (np.ones(n), (self._winners[:n], self._losers[:n])),
+                shape=(self.num_images, self.num_images))
+            # repeated outcomes are not counted.
+            self._win_matrix.data[:] = 1
+        return self._win_matrix
+
     @property
     def min_seen(self):
         """
         :return: The number of times the least seen active image has been
         sampled.
         """
-        try:
-            return np.min(self.num_samples[self.is_active])
-        except:
-            return 0
+        return self._min_seen
+
+    def _update_min_seen(self):
+        """
+        Recounts the number of times the least seen active image has been
+        sampled, and how many active images have been sampled that often.
+        """
+        if not self.num_active:
+            self._min_seen = 0
+            self._num_at_min = 0
+            return
+        active_samples = self.num_samples[self.is_active]
+        self._min_seen = np.min(active_samples)
+        self._num_at_min = np.sum(active_samples == self._min_seen)
 
     @property
     def rank(self):
         if self._recomp_rank:
-            self._rank = rank_centrality.rank(self.win_matrix)
+            self._rank = self._ranker.rank(self.win_matrix)
             self._recomp_rank = False
         return self._rank[self.is_active]
 
@@ -77,6 +116,20 @@ class _Statistics:
             self.sampling_excess = -self.num_samples
         if self.num_active == self.num_images:
             self.stop_activating = True
+        self._update_min_seen()
+
+    def _sample(self, i):
+        """
+        Counts a sample of an item, keeping min_seen current.
+
+        :param i: The index of the item.
+        :return: None
+        """
+        if self.is_active[i] and self.num_samples[i] == self._min_seen:
+            self._num_at_min -= 1
+        self.num_samples[i] += 1
+        if not self._num_at_min:
+            self._update_min_seen()
 
     def add_win(self, win, lose):
         """
@@ -86,13 +139,30 @@ class _Statistics:
         :param lose: The index of the loser.
         :return: None
         """
-        self.pairs.add((win, lose))
-        self.pairs.add((lose, win))
-        self.win_matrix[win, lose] = 1
-        self.num_samples[win] += 1
-        self.num_samples[lose] += 1
+        self.pairs.add(self._pair_key(win, lose))
+        if self._num_wins == len(self._winners):
+            self._winners = np.resize(self._winners, 2 * self._num_wins)
+            self._losers = np.resize(self._losers, 2 * self._num_wins)
+        self._winners[self._num_wins] = win
+        self._losers[self._num_wins] = lose
+        self._num_wins += 1
+        self._win_matrix = None
+        self._sample(win)
+        self._sample(lose)
         self._recomp_rank = True
 
+    def _pair_key(self, i, j):
+        """
+        Returns the key of an unordered pair in the pair set.
+
+        :param i: First image idx
+        :param j: Second image idx
+        :return: An int.
+        """
+        if i > j:
+            i, j = j, i
+        return int(i) * self.num_images + int(j)
+
     def pair_exists(self, i, j):
         """
         Returns True if the pair exists or not.
@@ -101,7 +171,7 @@ class _Statistics:
         :param j: Second image idx
         :return: Boolean
         """
-        return (i, j) in self.pairs
+        return self._pair_key(i, j) in self.pairs
 
 
 class Harness:
@@ -114,7 +184,8 @@ class Harness:
                  distribution,
                  activation_criteria,
                  activation_chunk,
-                 scoring_metrics):
+                 scoring_metrics,
+                 direct_solve=False):
         """
         Instantiates the test harness.
 
@@ -128,6 +199,9 @@ class Harness:
         :param activation_chunk: The activation chunk size.
         :param scoring_metrics: A list of functions that accept the estimated
                                 scores and the ground truth and return a score.
+        :param direct_solve: Whether to rank with a direct solver, which is
+                             much faster when the selector compares items
+                             with similar scores (e.g., the oracles).
         :return: The various scores.
         """
         self.num_images = num_images
@@ -136,6 +210,7 @@ class Harness:
         self.activation_criteria = activation_criteria
         self.activation_chunk = activation_chunk
         self.scoring_metrics = scoring_metrics
+        self.direct_solve = direct_solve
         self.stats = None
         self._ground_truth = None
         self.stop_activating = False
@@ -157,7 +232,8 @@ class Harness:
         self.tot_iter = 0
         self._ground_truth = \
             np.array([self.distribution() for _ in range(self.num_images)])
-        self.stats = _Statistics(self.num_images, self._ground_truth)
+        self.stats = _Statistics(self.num_images, self._ground_truth,
+                                 self.direct_solve)
 
     def iterate(self, i=1):
         """
@@ -243,9 +319,20 @@ Selectors
 class OrigSelector():
     """
     This is approximately how the original selector worked.
+
+    Each item is considered in turn and accepted with a probability that
+    depends on how often it has been seen, until two have been accepted.
+    The acceptance draws are made for batches of items at once; batches
+    start small and grow, since an item is usually accepted early.
     """
-    def __init__(self):
-        pass
+    def __init__(self, min_batch=64, max_batch=16384):
+        """
+        :param min_batch: The size of the first batch of items considered.
+        :param max_batch: The largest batch of items considered at once.
+        :return: An OrigSelector instance.
+        """
+        self.min_batch = min_batch
+        self.max_batch = max_batch
 
     def prob_select(self, stats):
         base_prob = 2. / stats.num_active
@@ -264,12 +351,16 @@ class OrigSelector():
             attempts += 1
             cands = []
             while len(cands) < 2:
-                for i in range(stats.num_active):
-                    time_seen = stats.num_samples[i]
-                    if ps(time_seen) > np.random.rand():
-                        cands.append(i)
-                        if len(cands) == 2:
-                            break
+                start = 0
+                batch = self.min_batch
+                while start < stats.num_active and len(cands) < 2:
+                    stop = min(start + batch, stats.num_active)
+                    accepted = np.flatnonzero(
+                        ps(stats.num_samples[start:stop]) >
+                        np.random.rand(stop - start))
+                    cands.extend(start + accepted[:2 - len(cands)])
+                    start = stop
+                    batch = min(4 * batch, self.max_batch)
             i, j = cands
             if i != j:
                 if not stats.pair_exists(i, j):
@@ -280,25 +371,39 @@ class MinimizeSamplingGapSelector():
     """
     This selector works by only selecting pairs that have a greater-than-0
     sampling gap.
+
+    Each item is considered with probability 2 / num_active; rather than
+    drawing for every item, the distance to the next item considered is
+    drawn from the geometric distribution.
     """
-    def __init__(self):
-        pass
+    def __init__(self, batch=16):
+        """
+        :param batch: The number of skips drawn at once.
+        :return: A MinimizeSamplingGapSelector instance.
+        """
+        self.batch = batch
 
     def get(self, stats):
         attempts = 0
+        p = min(2. / stats.num_active, 1.)
         while True:
             if attempts > 10000:
                 import ipdb
                 ipdb.set_trace()
             attempts += 1
             cands = []
+            pos = -1
             while len(cands) < 2:
-                for i in range(stats.num_active):
-                    if 2. / stats.num_active > np.random.rand():
-                        if stats.sampling_gap_allow_selection(i):
-                            cands.append(i)
-                            if len(cands) == 2:
-                                break
+                for i in pos + np.cumsum(np.random.geometric(p, self.batch)):
+                    if i >= stats.num_active:
+                        # start another pass over the items.
+                        pos = -1
+                        break
+                    pos = i
+                    if stats.sampling_gap_allow_selection(i):
+                        cands.append(i)
+                        if len(cands) == 2:
+                            break
             i, j = cands
             if i != j:
                 if not stats.pair_exists(i, j):
@@ -326,17 +431,33 @@ class RandomSelector():
         return i, j
 
 
+def _sorted_positions(values):
+    """
+    Sorts items by value.
+
+    :param values: The items' values.
+    :return: The items in ascending order of value, and the position of each
+             item in that order.
+    """
+    order = np.argsort(values)
+    positions = np.empty(len(order), dtype=int)
+    positions[order] = np.arange(len(order))
+    return order, positions
+
+
 class OracleSelector():
     """
     Selects pairs that are close together in score.
     """
     def __init__(self):
         self._arg_srt_gt = None
-        pass
+        self._srt_pos = None
 
     def get(self, stats):
-        self._arg_srt_gt = list(np.argsort(stats._ground_truth[
-                                           :stats.num_active]))
+        if self._arg_srt_gt is None or \
+                len(self._arg_srt_gt) != stats.num_active:
+            self._arg_srt_gt, self._srt_pos = _sorted_positions(
+                stats._ground_truth[:stats.num_active])
         attempts = 0
         while True:
             if attempts > 10000:
@@ -344,7 +465,7 @@ class OracleSelector():
                 ipdb.set_trace()
             attempts += 1
             i = np.random.choice(stats.num_active)
-            i_idx = self._arg_srt_gt.index(i)
+            i_idx = self._srt_pos[i]
             j_idx = i_idx + int(np.random.randn() * 5)
             if j_idx < 0:
                 continue
@@ -364,11 +485,11 @@ class OnlineOracleSelector():
     """
     def __init__(self):
         self._arg_srt_gt = []
-        pass
+        self._srt_pos = None
 
     def get(self, stats):
         if len(self._arg_srt_gt) != stats.num_active:
-            self._arg_srt_gt = list(np.argsort(stats.rank))
+            self._arg_srt_gt, self._srt_pos = _sorted_positions(stats.rank)
         # recompute rank probabilistically
         # elif np.random.rand() < 0.01:
         #     self._arg_srt_gt = np.argsort(stats.rank)
@@ -381,8 +502,8 @@ class OnlineOracleSelector():
             i = np.random.choice(stats.num_active)
             if not stats.sampling_gap_allow_selection(i):
                 continue
-            i_idx = self._arg_srt_gt.index(i)
-            for d_j_idx in range(1, stats.num_active):
+            i_idx = self._srt_pos[i]
+            for d_j_idx in xrange(1, stats.num_active):
                 j_idx = i_idx + d_j_idx
                 if j_idx >= stats.num_active:
                     continue
@@ -402,132 +523,95 @@ For these, higher is *always* better!
 '''
 
 
-def weighted_kemeny_distance(o, w):
-    """
-    The scoring metric in the Shah paper.
-
-    :param o: The item-wise calculated scores.
-    :param w: The item-wise ground truth scores.
-    :return: The score quantity.
-    """
-    sum_score = 0
-    for j in range(len(w)):
-        for i in range(j):
-            # note that the formula in the shaw paper is wrong.
-            q = (w[i] - w[j])**2
-            if ((w[i] - w[j])*(o[i] - o[j])) <= 0:
-                sum_score += q
-    denom = 2 * len(w) * np.sum(w ** 2)
-    return 1 - np.sqrt(sum_score / denom)
-
-
-def weighted_kemeny_distance_ratio(o, w):
-    """
-    The scoring metric in the Shah paper.
-
-    :param o: The item-wise calculated scores.
-    :param w: The item-wise ground truth scores.
-    :return: The score quantity.
-    """
-    sum_score = 0
-    tot_pos_score = 0  # the upper limit of the bad scores
-    for j in range(len(w)):
-        for i in range(j):
-            # note that the formula in the shaw paper is wrong.
-            q = (w[i] - w[j])**2
-            tot_pos_score += q
-            if ((w[i] - w[j])*(o[i] - o[j])) <= 0:
-                sum_score += q
-    denom = 2 * len(w) * np.sum(w ** 2)
-    return 1 - np.sqrt(sum_score / denom) / np.sqrt(tot_pos_score / denom)
-
 def plot_win_mtx_by_sco(h):
     """
     :param h: a harness object
     :return: None
     """
     asrt = np.argsort(h.ground_truth)
-    xmtx = h.stats.win_matrix[asrt,:][:,asrt]
+    xmtx = h.stats.win_matrix[asrt,:][:,asrt].toarray()
     pcolor(xmtx + xmtx.T)
 
 def corrcoef_score(o, w):
     return np.corrcoef(o, w)[0,1]
 
-# our empirical estimates suggest gamma = 8.6, and we need 8.6 * n * log(n)
-# samples, when using the
-close('all')
-fig = figure()
-
-# kemeny_online_oracle = []
-# for i in range(1, 100001):
-#     if not i % 100:
-#         sco = h_online_oracle.get_scores()
-#         kemeny_online_oracle.append(sco[0])
-#         cla()
-#         plot(kemeny_online_oracle, label='kemeny_online_oracle')
-#         legend(loc='best')
-#         pause(0.1)
-#     h_online_oracle.iterate()
-
-
-results = []
-for j in range(100):
-    gamma = 7.5
-    orig_activator = orig_activator_generator(gamma)
-    prop_activator = prop_activator_generator(gamma)
-    os = OrigSelector()
-    msgs = MinimizeSamplingGapSelector()
-    rs = RandomSelector()
-    ors = OracleSelector()
-    oors = OnlineOracleSelector()
-
-    m = 500
-    h_o = Harness(m, os, beta_distribution, prop_activator, 100,
-                 [weighted_kemeny_distance_ratio])
-    h_msgs = Harness(m, msgs, beta_distribution, prop_activator, 100,
-                     [weighted_kemeny_distance_ratio])
-    h_rand = Harness(m, rs, beta_distribution, prop_activator, 100,
+if __name__ == '__main__':
+    from pylab import close, figure, plot, legend
+    # our empirical estimates suggest gamma = 8.6, and we need 8.6 * n * log(n)
+    # samples, when using the
+    close('all')
+    fig = figure()
+
+    # kemeny_online_oracle = []
+    # for i in range(1, 100001):
+    #     if not i % 100:
+    #         sco = h_online_oracle.get_scores()
+    #         kemeny_online_oracle.append(sco[0])
+    #         cla()
+    #         plot(kemeny_online_oracle, label='kemeny_online_oracle')
+    #         legend(loc='best')
+    #         pause(0.1)
+    #     h_online_oracle.iterate()
+
+
+    results = []
+    for j in range(100):
+        gamma = 7.5
+        orig_activator = orig_activator_generator(gamma)
+        prop_activator = prop_activator_generator(gamma)
+        os = OrigSelector()
+        msgs = MinimizeSamplingGapSelector()
+        rs = RandomSelector()
+        ors = OracleSelector()
+        oors = OnlineOracleSelector()
+
+        m = 500
+        h_o = Harness(m, os, beta_distribution, prop_activator, 100,
                      [weighted_kemeny_distance_ratio])
-    h_oracle = Harness(m, ors, beta_distribution, prop_activator, 100,
-                       [weighted_kemeny_distance_ratio])
-    h_online_oracle = Harness(m, oors, beta_distribution, prop_activator, 100,
-                              [weighted_kemeny_distance_ratio])
-    kemeny_o = []
-    kemeny_msgs = []
-    kemeny_rand = []
-    kemeny_oracle = []
-    kemeny_online_oracle = []
-    for i in range(1, m*25+1):
-        if not i % 100:
-            sco = h_o.get_scores()
-            kemeny_o.append(sco[0])
-            sco = h_msgs.get_scores()
-            kemeny_msgs.append(sco[0])
-            sco = h_rand.get_scores()
-            kemeny_rand.append(sco[0])
-            sco = h_online_oracle.get_scores()
-            kemeny_online_oracle.append(sco[0])
-            # cla()
-            # plot(kemeny_o, label='kemeny_orig')
-            # plot(kemeny_msgs, label='kemeny_msgs')
-            # plot(kemeny_rand, label='kemeny_rand')
-            # plot(kemeny_online_oracle, label='kemeny_online_oracle')
-            # legend(loc='best')
-            # pause(0.1)
-        h_o.iterate()
-        h_msgs.iterate()
-        h_rand.iterate()
-        h_online_oracle.iterate()
-    results.append([kemeny_o, kemeny_msgs, kemeny_rand, kemeny_online_oracle])
-
-# acquire the means of the various results
-m_orig = np.mean(np.array([x[0] for x in results]), 0)
-m_msgs = np.mean(np.array([x[1] for x in results]), 0)
-m_rand = np.mean(np.array([x[2] for x in results]), 0)
-m_oracle = np.mean(np.array([x[3] for x in results]), 0)
-# cla()
-plot(m_orig, label='kemeny_orig')
-plot(m_msgs, label='kemeny_msgs')
-plot(m_rand, label='kemeny_rand')
-plot(m_oracle, label='kemeny_oracle')
-legend(loc='best')
+        h_msgs = Harness(m, msgs, beta_distribution, prop_activator, 100,
+                         [weighted_kemeny_distance_ratio])
+        h_rand = Harness(m, rs, beta_distribution, prop_activator, 100,
+                         [weighted_kemeny_distance_ratio])
+        h_oracle = Harness(m, ors, beta_distribution, prop_activator, 100,
+                           [weighted_kemeny_distance_ratio])
+        h_online_oracle = Harness(m, oors, beta_distribution, prop_activator, 100,
+                                  [weighted_kemeny_distance_ratio])
+        kemeny_o = []
+        kemeny_msgs = []
+        kemeny_rand = []
+        kemeny_oracle = []
+        kemeny_online_oracle = []
+        for i in range(1, m*25+1):
+            if not i % 100:
+                sco = h_o.get_scores()
+                kemeny_o.append(sco[0])
+                sco = h_msgs.get_scores()
+                kemeny_msgs.append(sco[0])
+                sco = h_rand.get_scores()
+                kemeny_rand.append(sco[0])
+                sco = h_online_oracle.get_scores()
+                kemeny_online_oracle.append(sco[0])
+                # cla()
+                # plot(kemeny_o, label='kemeny_orig')
+                # plot(kemeny_msgs, label='kemeny_msgs')
+                # plot(kemeny_rand, label='kemeny_rand')
+                # plot(kemeny_online_oracle, label='kemeny_online_oracle')
+                # legend(loc='best')
+                # pause(0.1)
+            h_o.iterate()
+            h_msgs.iterate()
+            h_rand.iterate()
+            h_online_oracle.iterate()
+        results.append([kemeny_o, kemeny_msgs, kemeny_rand, kemeny_online_oracle])
+
+    # acquire the means of the various results
+    m_orig = np.mean(np.array([x[0] for x in results]), 0)
+    m_msgs = np.mean(np.array([x[1] for x in results]), 0)
+    m_rand = np.mean(np.array([x[2] for x in results]), 0)
+    m_oracle = np.mean(np.array([x[3] for x in results]), 0)
+    # cla()
+    plot(m_orig, label='kemeny_orig')
+    plot(m_msgs, label='kemeny_msgs')
+    plot(m_rand, label='kemeny_rand')
+    plot(m_oracle, label='kemeny_oracle')
+    legend(loc='best')
@@ -0,0 +1,89 @@
+"""
+Tests the durable job queue of the daemon, daemon.JobTable, against the
+in-memory database.
+
+Run from the repository root with:
+    python -m pytest testing/test_daemon.py
+"""
+
+import time
+import unittest
+import mock
+from conf import *
+from daemon import JobTable
+from db import Set
+from testing.fakehbase import ConnectionPool
+
+
+class TestJobTable(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = ConnectionPool()
+        Set(self.pool).create_job_table()
+        self.jobs = JobTable(self.pool)
+        with self.pool.connection() as conn:
+            self.table = conn.table(JOB_TABLE)
+
+    def add(self, count=1):
+        self.jobs.add('create_hits', ['type'], key=('create_hits', 'type'),
+                      count=count)
+
+    def test_done_removes_job(self):
+        self.add()
+        job, = self.jobs.take(1)
+        self.jobs.done(job)
+        self.assertEqual(self.jobs.take(1), [])
+
+    def test_job_added_while_done_is_kept(self):
+        self.add()
+        job, = self.jobs.take(1)
+        delete = self.table.delete
+
+        def racing_delete(*args, **kwargs):
+            # another job of the key is added between the decrement and the
+            # delete.
+            self.table.delete = delete
+            self.add(count=2)
+            return delete(*args, **kwargs)
+        self.table.delete = racing_delete
+        # everything happens in the same millisecond.
+        with mock.patch.object(time, 'time', return_value=1000.):
+            self.jobs.done(job)
+        job, = self.jobs.take(1)
+        self.assertEqual((job.name, job.args, job.count),
+                         ('create_hits', ['type'], 2))
+
+    def test_done_job_does_not_hold_a_place(self):
+        with mock.patch.object(time, 'time', return_value=1000.):
+            self.add()
+            job, = self.jobs.take(1)
+            self.jobs.done(job)
+        self.jobs.add('create_practices', ['type'])
+        job, = self.jobs.take(1)
+        self.assertEqual(job.name, 'create_practices')
+        self.add()
+        counts = sorted((job.name, job.count) for job in self.jobs.take(2))
+        self.assertEqual(counts, [('create_hits', 1),
+                                  ('create_practices', None)])
+
+    def test_kept_job_starts_over(self):
+        self.add()
+        job, = self.jobs.take(1)
+        self.assertTrue(self.jobs.failed(job))
+        self.add()
+        self.jobs.done(job)
+        self.assertEqual(self.table.counter_get(job.row_key, 'job:attempts'),
+                         0)
+
+    def test_only_the_rest_of_a_partial_failure_is_retried(self):
+        self.add(count=5)
+        self.jobs.add('create_practices', ['type'], count=3)
+        for job in self.jobs.take(2):
+            self.assertTrue(self.jobs.failed(job, n_done=2))
+        counts = sorted((job.name, job.count) for job in self.jobs.take(2))
+        self.assertEqual(counts, [('create_hits', 3),
+                                  ('create_practices', 1)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+"""
+Tests the accounting of dbpool.InstrumentedPool against a stand-in pool.
+
+Run from the repository root with:
+    python -m pytest testing/test_dbpool.py
+"""
+
+import contextlib
+import unittest
+import dbpool
+
+
+class _Batch(object):
+    def __init__(self, table):
+        self.table = table
+        self.puts = {}
+
+    def put(self, key, data):
+        self.puts[key] = data
+
+    def send(self):
+        self.table.data.update(self.puts)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.send()
+
+
+class _Table(object):
+    def __init__(self, data):
+        self.data = data
+
+    def row(self, key):
+        return self.data.get(key, {})
+
+    def put(self, key, data):
+        self.data[key] = data
+
+    def scan(self):
+        for key in sorted(self.data):
+            yield key, self.data[key]
+
+    def batch(self):
+        return _Batch(self)
+
+
+class _Pool(object):
+    def __init__(self):
+        self.tables = {}
+        self.checkouts = 0
+
+    @contextlib.contextmanager
+    def connection(self, timeout=None):
+        self.checkouts += 1
+        yield self
+
+    def table(self, name):
+        return _Table(self.tables.setdefault(name, {}))
+
+
+class TestInstrumentedPool(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = dbpool.InstrumentedPool(_Pool())
+
+    def test_counts_calls(self):
+        with dbpool.attribute('outer') as outer:
+            with self.pool.connection() as conn:
+                table = conn.table('t')
+                table.put('a', {'f:c': '1'})
+                self.assertEqual(table.row('a'), {'f:c': '1'})
+                with dbpool.attribute('inner') as inner:
+                    b = table.batch()
+                    b.put('b', {'f:c': '2'})
+                    b.send()
+                    with table.batch() as b:
+                        b.put('c', {'f:c': '3'})
+                self.assertEqual([k for k, _ in table.scan()],
+                                 ['a', 'b', 'c'])
+        self.assertEqual(inner.n_rpcs, 2)
+        self.assertEqual(inner.summary()['rpcs']['t.batch_send'][0], 2)
+        self.assertEqual(outer.n_rpcs, 5)
+        calls = dict((k, v[0]) for k, v in outer.summary()['rpcs'].items())
+        self.assertEqual(calls, {'t.put': 1, 't.row': 1, 't.batch_send': 2,
+                                 't.scan': 1})
+        self.assertIsNone(dbpool.current_scope())
+        self.assertEqual(self.pool._pool.checkouts, 1)
+
+    def test_attributed(self):
+        @dbpool.attributed()
+        def job():
+            with self.pool.connection() as conn:
+                conn.table('t').row('a')
+            return dbpool.current_scope()
+        scope = job()
+        self.assertEqual(scope.name, 'job')
+        self.assertEqual(scope.n_rpcs, 1)
+
+    def test_failed_call_is_counted(self):
+        with dbpool.attribute('failing') as scope:
+            with self.pool.connection() as conn:
+                with self.assertRaises(TypeError):
+                    conn.table('t').row()
+        self.assertEqual(scope.n_rpcs, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,192 @@
+"""
+Tests the periodic housekeeping jobs, and the ban and task indices they use,
+against the in-memory database and the MTurk simulator.
+
+Run from the repository root with:
+    python -m pytest testing/test_housekeeping.py
+"""
+
+import time
+import unittest
+import mock
+import db
+import housekeeping
+from conf import *
+from db import Get
+from db import Set
+from db import _get_ban_index_key
+from db import dumps
+from mturk import MTurk
+from testing.fakehbase import ConnectionPool
+from testing.mturk_sim import MTurkSimulator
+
+
+class TestUnbanWorkers(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = ConnectionPool()
+        self.dbget = Get(self.pool)
+        self.dbset = Set(self.pool)
+        self.dbset.create_worker_table()
+        self.dbset.create_ban_table()
+        self.mt = MTurk(MTurkSimulator(seed=0))
+        self.mt.setup_quals()
+        self.dbset.register_worker('worker')
+
+    def move_ban_index(self, expires):
+        """
+        Moves the worker's ban index entry, as though its key had been
+        computed at a different time than the ban was recorded.
+        """
+        index_key = _get_ban_index_key(expires, 'worker')
+        with self.pool.connection() as conn:
+            table = conn.table(WORKER_TABLE)
+            old_key = table.row('worker')['status:ban_index_key']
+            table.put('worker', {'status:ban_index_key': index_key})
+            table = conn.table(BAN_TABLE)
+            table.delete(old_key)
+            table.put(index_key, {'metadata:worker_id': 'worker',
+                                  'metadata:expires': index_key[:12]})
+
+    def test_still_banned_worker_is_reindexed(self):
+        self.dbset.ban_worker('worker', duration=3600)
+        self.move_ban_index(time.time() - 1)
+        self.assertEqual(len(list(self.dbget.get_expired_bans())), 1)
+        housekeeping.unban_workers(self.mt, self.dbget, self.dbset)
+        self.assertTrue(self.dbget.worker_is_banned('worker'))
+        self.assertEqual(list(self.dbget.get_expired_bans()), [])
+        self.assertEqual(self.dbget.get_banned_workers(), ['worker'])
+        expired = list(self.dbget.get_expired_bans(time.time() + 3601))
+        self.assertEqual([w for _, w in expired], ['worker'])
+
+    def test_stale_entry_is_dropped(self):
+        self.dbset.ban_worker('worker', duration=3600)
+        stale_key = _get_ban_index_key(time.time() - 1, 'worker')
+        with self.pool.connection() as conn:
+            conn.table(BAN_TABLE).put(stale_key,
+                                      {'metadata:worker_id': 'worker'})
+        housekeeping.unban_workers(self.mt, self.dbget, self.dbset)
+        self.assertTrue(self.dbget.worker_is_banned('worker'))
+        self.assertEqual(list(self.dbget.get_expired_bans()), [])
+        self.assertEqual(len(list(self.dbget.get_expired_bans(
+            time.time() + 3601))), 1)
+
+
+class TestTaskTimeouts(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = ConnectionPool()
+        self.dbget = Get(self.pool)
+        self.dbset = Set(self.pool)
+        self.dbset.create_task_table()
+        self.dbset.create_task_index_table()
+        self.dbset.create_worker_table()
+        with self.pool.connection() as conn:
+            conn.table(TASK_TABLE).put('task', {
+                'status:awaiting_serve': TRUE,
+                'status:awaiting_hit_type': TRUE})
+        self.dbset.indicate_task_has_hit_type('task')
+
+    def task(self):
+        with self.pool.connection() as conn:
+            return conn.table(TASK_TABLE).row('task')
+
+    def index(self):
+        with self.pool.connection() as conn:
+            return [k for k, _ in conn.table(TASK_INDEX_TABLE).scan()]
+
+    def test_abandoned_task_is_reset(self):
+        self.dbset.task_served('task', 'worker', hit_id='hit')
+        self.assertEqual(self.dbget.get_n_with_hit_awaiting_serve(), 0)
+        # the task has not timed out yet.
+        housekeeping.reset_timed_out_tasks(None, self.dbget, self.dbset)
+        self.assertEqual(self.task()['status:pending_completion'], TRUE)
+        with mock.patch.object(db, 'TASK_COMPLETION_TIMEOUT', -10):
+            housekeeping.reset_timed_out_tasks(None, self.dbget, self.dbset)
+        task = self.task()
+        self.assertEqual(task['status:pending_completion'], FALSE)
+        self.assertEqual(task['status:awaiting_serve'], TRUE)
+        self.assertEqual(task['metadata:worker_id'], '')
+        self.assertEqual(self.index(), [task['status:index_key']])
+        self.assertEqual(self.dbget.get_n_with_hit_awaiting_serve(), 1)
+
+    def test_finished_task_is_not_served_again(self):
+        with self.pool.connection() as conn:
+            conn.table(TASK_TABLE).put('task', {
+                'completion_data:total_time': '100',
+                'status:pending_completion': FALSE})
+            self.dbset._move_task_index(conn, 'task')
+        self.dbset.task_served('task', 'worker', hit_id='hit')
+        self.assertEqual(self.task()['status:pending_completion'], FALSE)
+        self.assertEqual(self.index(), [])
+
+    def test_rebuilt_index_has_every_state(self):
+        with self.pool.connection() as conn:
+            conn.table(TASK_TABLE).put('served', {
+                'status:awaiting_serve': FALSE,
+                'status:pending_completion': TRUE})
+        self.dbset.create_task_index_table(clobber=True)
+        self.assertEqual(self.dbset.rebuild_task_index(), 2)
+        # keys are the state, the time it was entered and the task ID.
+        states = sorted((k[:2], k[16:]) for k in self.index())
+        self.assertEqual(states, [(AWAITING_SERVE_PREFIX, 'task'),
+                                  (PENDING_COMPLETION_PREFIX, 'served')])
+
+
+class TestAcceptTask(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = ConnectionPool()
+        self.dbget = Get(self.pool)
+        self.dbset = Set(self.pool)
+        for create in [self.dbset.create_task_table,
+                       self.dbset.create_worker_table,
+                       self.dbset.create_image_table,
+                       self.dbset.create_win_table,
+                       self.dbset.create_statistics_table]:
+            create()
+        with self.pool.connection() as conn:
+            conn.table(TASK_TABLE).put('task', {
+                'metadata:tuples': dumps([('a', 'b', 'c')]),
+                'metadata:tuple_types': dumps(['keep']),
+                'metadata:worker_id': 'worker',
+                'metadata:attribute': ATTRIBUTE,
+                'metadata:attributes': dumps(set(IMAGE_ATTRIBUTES)),
+                'completion_data:choices': dumps(['a']),
+                'completion_data:reaction_times': dumps([MIN_TRIAL_RT + 1]),
+                'completion_data:total_time': '100',
+                'status:pending_evaluation': TRUE})
+
+    def counter(self, table, row, column):
+        with self.pool.connection() as conn:
+            return conn.table(table).counter_get(row, column)
+
+    def test_failed_acceptance_is_finished_by_retry(self):
+        with mock.patch.object(Set, '_update_image_ratings',
+                               side_effect=IOError('lost connection')):
+            with self.assertRaises(IOError):
+                housekeeping.handle_accepted_task(None, self.dbget,
+                                                  self.dbset, 'task')
+        self.assertEqual(self.dbget.get_task_status('task'),
+                         EVALUATION_PENDING)
+        housekeeping.handle_accepted_task(None, self.dbget, self.dbset,
+                                          'task')
+        self.assertEqual(self.dbget.get_task_status('task'), ACCEPTED)
+        # the updates made before the failure are not made again.
+        self.assertEqual(self.counter(WORKER_TABLE, 'worker',
+                                      'stats:num_accepted'), 1)
+        self.assertEqual(self.counter(IMAGE_TABLE, 'a', 'stats:num_wins'), 1)
+        self.assertEqual(self.counter(WIN_TABLE, 'a,b', 'data:win_count'), 1)
+        with self.pool.connection() as conn:
+            ratings = dict(conn.table(IMAGE_TABLE).rows(
+                ['a', 'b'], columns=['stats:rating']))
+        self.assertEqual(len(ratings), 2)
+        # and an accepted task is left alone.
+        housekeeping.handle_accepted_task(None, self.dbget, self.dbset,
+                                          'task')
+        self.assertEqual(self.counter(WORKER_TABLE, 'worker',
+                                      'stats:num_accepted'), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
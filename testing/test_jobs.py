@@ -0,0 +1,70 @@
+"""
+Tests the coalescing and ordering of jobs.JobQueue.
+
+Run from the repository root with:
+    python -m pytest testing/test_jobs.py
+"""
+
+import threading
+import unittest
+import jobs
+
+
+class TestJobQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.queue = jobs.JobQueue(1)
+        self.addCleanup(self.queue.stop)
+        self.ran = []
+
+    def record(self, *args, **kwargs):
+        self.ran.append((args, kwargs))
+
+    def test_counts_are_coalesced(self):
+        for _ in range(5):
+            self.queue.add(self.record, args=['a'], key='top up a', count=1)
+        self.queue.add(self.record, args=['b'], key='top up b', count=2)
+        self.assertEqual(self.queue.depth(), 2)
+        self.queue.start()
+        self.assertTrue(self.queue.join(5))
+        self.assertEqual(self.ran, [(('a',), {'n': 5}), (('b',), {'n': 2})])
+
+    def test_priorities(self):
+        self.queue.add(self.record, args=['low'], priority=jobs.PRIORITY_LOW)
+        self.queue.add(self.record, args=['normal'])
+        self.queue.add(self.record, args=['high'],
+                       priority=jobs.PRIORITY_HIGH)
+        self.queue.start()
+        self.assertTrue(self.queue.join(5))
+        self.assertEqual([args[0] for args, _ in self.ran],
+                         ['high', 'normal', 'low'])
+
+    def test_running_job_is_not_coalesced(self):
+        started = threading.Event()
+        release = threading.Event()
+
+        def blocking(n):
+            started.set()
+            release.wait(5)
+            self.ran.append(n)
+        self.queue.start()
+        self.queue.add(blocking, key='k', count=1)
+        started.wait(5)
+        self.assertFalse(self.queue.add(blocking, key='k', count=1))
+        self.assertTrue(self.queue.add(blocking, key='k', count=1))
+        release.set()
+        self.assertTrue(self.queue.join(5))
+        self.assertEqual(self.ran, [1, 2])
+
+    def test_failing_job(self):
+        def fail():
+            raise ValueError('oops')
+        self.queue.add(fail)
+        self.queue.add(self.record)
+        self.queue.start()
+        self.assertTrue(self.queue.join(5))
+        self.assertEqual(len(self.ran), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
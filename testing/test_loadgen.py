@@ -0,0 +1,61 @@
+"""
+Tests that the payloads of testing.loadgen are scored as intended by
+db.Set.task_finished_from_json.
+
+Run from the repository root with:
+    python -m pytest testing/test_loadgen.py
+"""
+
+import random
+import unittest
+from conf import *
+from db import Set
+from testing.fakehbase import ConnectionPool
+from testing.loadgen import make_payload
+
+
+def _block(block_type, image_idx_map):
+    urls = [['https://images.example.com/im%07i.jpg' % i for i in tup]
+            for tup in image_idx_map]
+    return {'type': block_type, 'images': urls,
+            'ims_width': [[640] * len(tup) for tup in urls],
+            'ims_height': [[480] * len(tup) for tup in urls],
+            'global_tup_idxs': range(len(image_idx_map)),
+            'image_idx_map': image_idx_map}
+
+
+class TestMakePayload(unittest.TestCase):
+
+    def setUp(self):
+        self.dbset = Set(ConnectionPool())
+        self.dbset.create_task_table()
+        self.dbset.create_task_json_table()
+        tuples = [[3 * n, 3 * n + 1, 3 * n + 2] for n in range(20)]
+        self.blocks = [_block(KEEP_BLOCK, tuples),
+                       _block(REJECT_BLOCK, [t[::-1] for t in tuples])]
+
+    def score(self, **kwargs):
+        payload, passed = make_payload(self.blocks, 'worker', 'hit',
+                                       'assignment', 'task', True,
+                                       rng=random.Random(0), **kwargs)
+        frac_contradictions, frac_unanswered, frac_too_fast, _ = \
+            self.dbset.task_finished_from_json(payload)
+        return frac_contradictions, frac_unanswered, frac_too_fast, passed
+
+    def test_consistent_worker(self):
+        self.assertEqual(self.score(), (0., 0., 0., True))
+
+    def test_careless_worker(self):
+        self.assertEqual(self.score(contradiction_rate=1., too_fast_rate=1.),
+                         (1., 0., 1., False))
+
+    def test_demographics_come_first(self):
+        payload, _ = make_payload(self.blocks, 'worker', 'hit', 'assignment',
+                                  'task', False,
+                                  demographics=('female', 1980))
+        self.assertEqual(payload[0]['birthyear'], '1980')
+        self.assertTrue(all(t['taskId'] == 'task' for t in payload))
+
+
+if __name__ == '__main__':
+    unittest.main()
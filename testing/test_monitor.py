@@ -0,0 +1,167 @@
+"""
+Tests monitor.CarbonExporter against a local TCP sink.
+
+Run from the repository root with:
+    python -m pytest testing/test_monitor.py
+"""
+
+import cPickle
+import socket
+import struct
+import threading
+import time
+import unittest
+from monitor import CarbonExporter
+
+
+class _Sink(object):
+    """
+    A TCP server that records the connections made to it and the bytes
+    received on each.
+    """
+    def __init__(self, port=0):
+        self._server = socket.socket()
+        self._server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._server.bind(('127.0.0.1', port))
+        self._server.listen(5)
+        self.port = self._server.getsockname()[1]
+        self.received = []  # the bytes received, per connection
+        self.connections = []
+        self._open = []
+        self._thread = threading.Thread(target=self._accept)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _accept(self):
+        while True:
+            try:
+                conn, _ = self._server.accept()
+            except socket.error:
+                return
+            self.connections.append(conn)
+            self._open.append(conn)
+            self.received.append([])
+            reader = threading.Thread(target=self._read,
+                                      args=(conn, self.received[-1]))
+            reader.daemon = True
+            reader.start()
+
+    def _read(self, conn, chunks):
+        while True:
+            try:
+                data = conn.recv(65536)
+            except socket.error:
+                return
+            if not data:
+                return
+            chunks.append(data)
+
+    def data(self, timeout=2.):
+        """
+        Returns the bytes received on each connection, once they stop
+        arriving.
+        """
+        last = None
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            current = [''.join(chunks) for chunks in self.received]
+            if current == last and current:
+                break
+            last = current
+            time.sleep(.05)
+        return [''.join(chunks) for chunks in self.received]
+
+    def drop_connections(self):
+        while self._open:
+            conn = self._open.pop()
+            conn.shutdown(socket.SHUT_RDWR)
+            conn.close()
+
+    def close(self):
+        self.drop_connections()
+        # wakes the accepting thread, which holds the socket open.
+        self._server.shutdown(socket.SHUT_RDWR)
+        self._server.close()
+
+
+def _unpickle(data):
+    """
+    Decodes a stream of carbon pickle messages into a list of datapoints.
+    """
+    datapoints = []
+    while data:
+        length, = struct.unpack('!L', data[:4])
+        datapoints.extend(cPickle.loads(data[4:4 + length]))
+        data = data[4 + length:]
+    return datapoints
+
+
+class TestCarbonExporter(unittest.TestCase):
+
+    def setUp(self):
+        self.sink = _Sink()
+
+    def tearDown(self):
+        self.sink.close()
+
+    def test_plaintext_single_connection(self):
+        exporter = CarbonExporter('127.0.0.1', self.sink.port)
+        self.assertTrue(exporter.send([('a.b', 1), ('a.c', 2.5)], 100))
+        self.assertTrue(exporter.send([('a.b', 3)], 160))
+        exporter.close()
+        self.assertEqual(self.sink.data(),
+                         ['a.b 1 100\na.c 2.5 100\na.b 3 160\n'])
+
+    def test_pickle(self):
+        exporter = CarbonExporter('127.0.0.1', self.sink.port,
+                                  protocol='pickle')
+        metrics = [('m.%i' % i, i) for i in range(1200)]
+        self.assertTrue(exporter.send(metrics, 100))
+        exporter.close()
+        data, = self.sink.data()
+        self.assertEqual(_unpickle(data),
+                         [(name, (100, value)) for name, value in metrics])
+
+    def test_buffers_during_outage(self):
+        port = self.sink.port
+        self.sink.close()
+        exporter = CarbonExporter('127.0.0.1', port, buffer_size=5,
+                                  max_backoff=0)
+        for t in range(8):
+            self.assertFalse(exporter.send([('a', t)], t))
+        self.assertEqual(exporter.pending(), 5)
+        self.assertEqual(exporter.n_dropped, 3)
+        self.sink = _Sink(port)
+        self.assertTrue(exporter.flush())
+        exporter.close()
+        self.assertEqual(self.sink.data(),
+                         [''.join('a %i %i\n' % (t, t) for t in range(3, 8))])
+
+    def test_backoff(self):
+        port = self.sink.port
+        self.sink.close()
+        exporter = CarbonExporter('127.0.0.1', port, max_backoff=60)
+        self.assertFalse(exporter.send([('a', 1)], 1))
+        self.sink = _Sink(port)
+        # still backing off, so it doesn't try to connect.
+        self.assertFalse(exporter.flush())
+        self.assertEqual(self.sink.connections, [])
+        exporter._next_connect = 0
+        self.assertTrue(exporter.flush())
+        exporter.close()
+        self.assertEqual(self.sink.data(), ['a 1 1\n'])
+
+    def test_reconnects(self):
+        exporter = CarbonExporter('127.0.0.1', self.sink.port,
+                                  max_backoff=0)
+        self.assertTrue(exporter.send([('a', 1)], 1))
+        self.sink.data()
+        self.sink.drop_connections()
+        time.sleep(.1)
+        self.assertTrue(exporter.send([('a', 2)], 2))
+        exporter.close()
+        self.assertEqual(self.sink.data(), ['a 1 1\n', 'a 2 2\n'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+"""
+Tests mturk.MTurk against testing.mturk_sim.MTurkSimulator.
+
+Run from the repository root with:
+    python -m pytest testing/test_mturk_sim.py
+"""
+
+import unittest
+import boto.mturk.connection
+from conf import *
+from mturk import MTurk
+from testing.mturk_sim import MTurkSimulator
+
+
+class TestMTurkSimulator(unittest.TestCase):
+
+    def setUp(self):
+        self.sim = MTurkSimulator(seed=0, balance=100.)
+        self.mt = MTurk(self.sim)
+        self.mt.setup_quals()
+        self.task_type, self.practice_type = self.mt.register_hit_type_mturk()
+
+    def test_quals_are_reused(self):
+        quals = (self.mt.qualification_id, self.mt.quota_id,
+                 self.mt.practice_quota_id, self.mt.ban_id)
+        self.assertTrue(all(quals))
+        mt = MTurk(self.sim)
+        mt.setup_quals()
+        self.assertEqual((mt.qualification_id, mt.quota_id,
+                          mt.practice_quota_id, mt.ban_id), quals)
+
+    def test_hit_lifecycle(self):
+        hit_id = self.mt.add_hit_to_hit_type(self.task_type, 'task-0')
+        self.assertAlmostEqual(self.mt.get_account_balance(),
+                               100. - DEFAULT_TASK_PAYMENT)
+        self.assertEqual(self.mt.get_hit_status(hit_id), HIT_PENDING)
+        self.assertEqual(self.sim.assignable_hits(self.task_type), [hit_id])
+        assignment_id = self.sim.accept_hit(hit_id, 'worker')
+        self.assertEqual(self.sim.assignable_hits(), [])
+        self.assertFalse(self.mt.get_hit_complete(hit_id))
+        self.sim.submit_assignment(assignment_id)
+        self.assertTrue(self.mt.get_hit_complete(hit_id))
+        self.assertEqual(self.mt.get_hit_status(hit_id), HIT_COMPLETE)
+        self.mt.approve_assignment(assignment_id)
+        self.mt.dispose_hit(hit_id)
+        self.assertEqual(self.mt.get_all_hits_of_type(self.task_type), [])
+
+    def test_quota(self):
+        self.mt.reset_worker_daily_quota('worker')
+        self.assertEqual(self.mt.get_qualification_score(self.mt.quota_id,
+                                                         'worker'),
+                         MAX_SUBMITS_PER_DAY)
+        self.mt.decrement_worker_daily_quota('worker')
+        self.assertEqual(self.mt.get_qualification_score(self.mt.quota_id,
+                                                         'worker'),
+                         MAX_SUBMITS_PER_DAY - 1)
+        # the practice quota is granted automatically.
+        self.assertTrue(self.mt.get_worker_avail_practice('worker'))
+
+    def test_unknown_hit(self):
+        self.assertIsNone(self.mt.get_hit('no such hit'))
+
+    def test_injected_errors_are_deterministic(self):
+        def run():
+            sim = MTurkSimulator(seed=3, error_rates={'get_hit': 0.5})
+            failed = []
+            for _ in range(20):
+                try:
+                    sim.get_all_hits()
+                    sim.get_hit('no such hit')
+                except boto.mturk.connection.MTurkRequestError as e:
+                    failed.append(e.status)
+            return failed
+        failed = run()
+        self.assertEqual(failed, run())
+        self.assertIn(503, failed)
+        self.assertIn(400, failed)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+"""
+Tests the digests and rate limiting of notifier.Notifier.
+
+Run from the repository root with:
+    python -m pytest testing/test_notifier.py
+"""
+
+import time
+import unittest
+import notifier
+
+
+class _FailingTransport(notifier.MemoryTransport):
+    def __init__(self, failures):
+        notifier.MemoryTransport.__init__(self)
+        self.failures = failures
+
+    def send(self, subject, body):
+        if self.failures:
+            self.failures -= 1
+            raise IOError('transport is down')
+        notifier.MemoryTransport.send(self, subject, body)
+
+
+def _wait_for(cond, timeout=2.):
+    deadline = time.time() + timeout
+    while not cond() and time.time() < deadline:
+        time.sleep(0.01)
+
+
+class TestNotifier(unittest.TestCase):
+
+    def make(self, transport=None, **kwargs):
+        self.transport = transport or notifier.MemoryTransport()
+        n = notifier.Notifier(self.transport, **kwargs)
+        self.addCleanup(n.stop)
+        return n
+
+    def test_repeats_are_digested(self):
+        n = self.make(window=0.3, rate=100, burst=100)
+        n.start()
+        n.notify('Banned worker 0', 'body 0', key='banned')
+        _wait_for(lambda: len(self.transport.messages) == 1)
+        for i in range(1, 5):
+            n.notify('Banned worker %i' % i, 'body %i' % i, key='banned')
+        self.assertEqual(len(self.transport.messages), 1)
+        _wait_for(lambda: len(self.transport.messages) == 2)
+        first, digest = self.transport.messages
+        self.assertEqual(first, ('Banned worker 0', 'body 0'))
+        self.assertEqual(digest[0], '[4 notifications] Banned worker 1')
+        for i in range(1, 5):
+            self.assertIn('body %i' % i, digest[1])
+
+    def test_digest_is_truncated(self):
+        n = self.make(window=60, max_events=2)
+        for i in range(5):
+            n.notify('subject', 'body %i' % i)
+        n.flush()
+        subject, body = self.transport.messages[0]
+        self.assertEqual(subject, '[5 notifications] subject')
+        self.assertNotIn('body 2', body)
+        self.assertIn('... and 3 more.', body)
+
+    def test_rate_limit(self):
+        n = self.make(window=60, rate=0.01, burst=2)
+        n.start()
+        for i in range(4):
+            n.notify('subject %i' % i, 'body')
+        _wait_for(lambda: len(self.transport.messages) >= 2)
+        time.sleep(0.1)
+        self.assertEqual(len(self.transport.messages), 2)
+        n.stop()
+        self.assertEqual(len(self.transport.messages), 4)
+
+    def test_too_many_keys_overflow(self):
+        n = self.make(window=60, max_keys=2)
+        for i in range(4):
+            n.notify('subject %i' % i, 'body')
+        n.flush()
+        subjects = sorted(s for s, _ in self.transport.messages)
+        self.assertEqual(subjects, ['[2 notifications] Other notifications',
+                                    'subject 0', 'subject 1'])
+
+    def test_failed_send_is_retried(self):
+        n = self.make(_FailingTransport(1), window=60)
+        n.notify('subject', 'body')
+        n.flush()
+        self.assertEqual(self.transport.messages, [])
+        n.flush()
+        self.assertEqual(self.transport.messages, [('subject', 'body')])
+
+
+if __name__ == '__main__':
+    unittest.main()
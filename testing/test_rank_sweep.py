@@ -0,0 +1,60 @@
+"""
+Tests the checkpointing and resuming of testing.rank_sweep.
+
+Run from the repository root with:
+    python -m pytest testing/test_rank_sweep.py
+"""
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from testing import rank_sweep
+
+
+class TestSweep(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.path = os.path.join(self.dir, 'sweep.jsonl')
+        self.cells = rank_sweep.make_grid(['random'], ['beta'], ['prop'],
+                                          [7.5], [10], [0, 1])
+
+    def sweep(self, path=None):
+        return rank_sweep.sweep(self.cells, path or self.path, num_images=30,
+                                iterations=300, interval=100, workers=1)
+
+    def lines(self):
+        with open(self.path) as f:
+            return f.readlines()
+
+    def test_checkpoints(self):
+        results = self.sweep()
+        self.assertEqual(sorted(results),
+                         sorted(rank_sweep.cell_key(c) for c in self.cells))
+        for result in results.itervalues():
+            self.assertEqual([i for i, _ in result['checkpoints']],
+                             [100, 200, 300])
+        # the complete cells are not run again.
+        n_lines = len(self.lines())
+        self.assertEqual(self.sweep(), results)
+        self.assertEqual(len(self.lines()), n_lines)
+
+    def test_resume_after_partial_line(self):
+        expected = self.sweep(os.path.join(self.dir, 'uninterrupted.jsonl'))
+        key = rank_sweep.cell_key(self.cells[0])
+        # a run of the first cell was interrupted while writing a record.
+        record = {'cell': key, 'params': self.cells[0], 'run': 'interrupted',
+                  'iteration': 100, 'scores': {'kemeny_ratio': 0.}}
+        with open(self.path, 'w') as f:
+            f.write(json.dumps(record) + '\n')
+            f.write(json.dumps(dict(record, iteration=200))[:20])
+        results = self.sweep()
+        self.assertTrue(all(line.endswith('\n') for line in self.lines()))
+        self.assertEqual(results, expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
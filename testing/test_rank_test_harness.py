@@ -0,0 +1,174 @@
+"""
+Tests the sparse win store and the batched selectors of
+testing.rank_test_harness against the dense store and the item-by-item
+selectors that they replaced, on seeded runs.
+
+Run from the repository root with:
+    python -m pytest testing/test_rank_test_harness.py
+"""
+
+import unittest
+import numpy as np
+from testing import rank_test_harness as harness
+
+
+class _DenseStatistics(object):
+    """
+    The old store: a dense win matrix and the pairs in both orders.
+    """
+    def __init__(self, num_images):
+        self.num_samples = np.zeros(num_images, dtype=int)
+        self.is_active = np.zeros(num_images, dtype=bool)
+        self.win_matrix = np.zeros((num_images, num_images))
+        self.pairs = set()
+
+    @property
+    def min_seen(self):
+        try:
+            return np.min(self.num_samples[self.is_active])
+        except ValueError:
+            return 0
+
+    def activate(self, images):
+        self.is_active[images] = True
+
+    def add_win(self, win, lose):
+        self.pairs.add((win, lose))
+        self.pairs.add((lose, win))
+        self.win_matrix[win, lose] = 1
+        self.num_samples[win] += 1
+        self.num_samples[lose] += 1
+
+
+def _orig_candidates(selector, stats):
+    """
+    The first attempt of the old OrigSelector.get, which draws for one item
+    at a time.
+    """
+    ps = selector.prob_select(stats)
+    cands = []
+    while len(cands) < 2:
+        for i in range(stats.num_active):
+            if ps(stats.num_samples[i]) > np.random.rand():
+                cands.append(i)
+                if len(cands) == 2:
+                    break
+    return tuple(cands)
+
+
+def _min_gap_get(stats):
+    """
+    The old MinimizeSamplingGapSelector.get, which draws for one item at a
+    time.
+    """
+    while True:
+        cands = []
+        while len(cands) < 2:
+            for i in range(stats.num_active):
+                if 2. / stats.num_active > np.random.rand():
+                    if stats.sampling_gap_allow_selection(i):
+                        cands.append(i)
+                        if len(cands) == 2:
+                            break
+        i, j = cands
+        if i != j and not stats.pair_exists(i, j):
+            return i, j
+
+
+def _stats(num_images=60, num_active=40, num_wins=200, seed=0):
+    """
+    Returns a _Statistics with some of its images active and compared.
+    """
+    np.random.seed(seed)
+    ground_truth = np.random.beta(2., 5., num_images)
+    stats = harness._Statistics(num_images, ground_truth)
+    stats.activate(np.arange(num_active))
+    for _ in range(num_wins):
+        i, j = np.random.choice(num_active, 2, replace=False)
+        stats.add_win(i, j)
+    return stats
+
+
+class TestStatistics(unittest.TestCase):
+
+    def test_matches_dense_store(self):
+        np.random.seed(0)
+        num_images = 50
+        stats = harness._Statistics(num_images, np.ones(num_images))
+        dense = _DenseStatistics(num_images)
+        for step in range(2000):
+            if not step % 400:
+                images = np.arange(step / 40, step / 40 + 10)
+                stats.activate(images)
+                dense.activate(images)
+            i, j = np.random.choice(num_images, 2, replace=False)
+            stats.add_win(i, j)
+            dense.add_win(i, j)
+            self.assertEqual(stats.min_seen, dense.min_seen)
+            if not step % 100:
+                self.assertTrue(np.array_equal(
+                    stats.win_matrix.toarray(), dense.win_matrix))
+        self.assertTrue(np.array_equal(stats.num_samples, dense.num_samples))
+        for i in range(num_images):
+            for j in range(num_images):
+                self.assertEqual(stats.pair_exists(i, j),
+                                 (i, j) in dense.pairs)
+
+
+class TestSelectors(unittest.TestCase):
+
+    def test_orig_selector_makes_the_same_draws(self):
+        # the batched draws are the same random numbers as the draws for one
+        # item at a time, so the same state gives the same pair (unless the
+        # first pair is rejected, after which the draws differ).
+        stats = _stats()
+        selector = harness.OrigSelector(min_batch=4)
+        n_compared = 0
+        for seed in range(200):
+            np.random.seed(seed)
+            i, j = _orig_candidates(selector, stats)
+            if i == j or stats.pair_exists(i, j):
+                continue
+            np.random.seed(seed)
+            self.assertEqual(selector.get(stats), (i, j))
+            n_compared += 1
+        self.assertGreater(n_compared, 100)
+
+    def test_min_gap_selector_draws_alike(self):
+        # the geometric skips are a different use of the random numbers, so
+        # only the distribution of the pairs is the same.
+        n = 4000
+        pairs = {}
+        for name, get in [('old', _min_gap_get),
+                          ('new', harness.MinimizeSamplingGapSelector().get)]:
+            stats = _stats(seed=1)
+            np.random.seed(2)
+            pairs[name] = np.array([get(stats) for _ in range(n)])
+            self.assertFalse(np.any(pairs[name][:, 0] == pairs[name][:, 1]))
+        for column in range(2):
+            old, new = pairs['old'][:, column], pairs['new'][:, column]
+            self.assertLess(abs(old.mean() - new.mean()),
+                            4 * old.std() / np.sqrt(n))
+        # each item is drawn about as often by both.
+        old, new = [np.bincount(pairs[name].ravel(), minlength=40)
+                    for name in ['old', 'new']]
+        self.assertTrue(np.all(abs(old - new) < 4 * np.sqrt(old + new)))
+
+    def test_oracle_selector_makes_the_same_draws(self):
+        stats = _stats()
+        np.random.seed(3)
+        new = [harness.OracleSelector().get(stats) for _ in range(200)]
+        np.random.seed(3)
+        order = list(np.argsort(stats._ground_truth[:stats.num_active]))
+        old = []
+        while len(old) < 200:
+            i = np.random.choice(stats.num_active)
+            i_idx = order.index(i)
+            j_idx = i_idx + int(np.random.randn() * 5)
+            if 0 <= j_idx < stats.num_active and j_idx != i_idx:
+                old.append((i, order[j_idx]))
+        self.assertEqual(new, old)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+"""
+Tests that the increments of statemon.Counter reach the shared value, which
+other processes read.
+
+Run from the repository root with:
+    python -m pytest testing/test_statemon.py
+"""
+
+import multiprocessing
+import threading
+import time
+import unittest
+import statemon
+
+
+def _increment_in_child(counter):
+    counter.increment()  # flushed at once, being the first.
+    counter.increment(2)
+
+
+class TestCounter(unittest.TestCase):
+
+    def setUp(self):
+        self.counter = statemon.Counter('test_counter', int)
+
+    def shared(self):
+        # what another process would read.
+        return self.counter._value.value
+
+    def increment_in_thread(self, n):
+        t = threading.Thread(target=lambda: [self.counter.increment()
+                                             for _ in range(n)])
+        t.start()
+        t.join()
+
+    def test_exited_threads_are_flushed_on_read(self):
+        for _ in range(3):
+            self.increment_in_thread(10)
+        self.assertEqual(self.counter.get(), 30)
+        self.assertEqual(self.shared(), 30)
+        # their idents may have been reused by the threads of other tests,
+        # so which threads are alive is given.
+        self.counter.flush(alive={})
+        self.assertEqual(self.counter._shards, {})
+        self.assertEqual(self.counter.get(), 30)
+
+    def test_idle_threads_are_flushed_periodically(self):
+        self.counter.increment()  # flushed at once, being the first.
+        self.counter.increment(2)
+        self.assertEqual(self.shared(), 1)
+        deadline = time.time() + 5 * statemon.COUNTER_FLUSH_INTERVAL
+        while self.shared() != 3 and time.time() < deadline:
+            time.sleep(0.05)
+        self.assertEqual(self.shared(), 3)
+
+    def test_child_processes_are_flushed_at_exit(self):
+        proc = multiprocessing.Process(target=_increment_in_child,
+                                       args=(self.counter,))
+        proc.start()
+        proc.join()
+        self.counter.increment()
+        self.counter.increment()
+        self.assertEqual(self.counter.get(), 5)
+
+    def test_set_and_reset(self):
+        self.increment_in_thread(5)
+        self.counter.increment(2)
+        self.counter.set(10)
+        self.assertEqual(self.counter.get(), 10)
+        self.counter.reset()
+        self.counter.increment()
+        self.assertEqual(self.counter.get(), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -10,12 +10,16 @@ import boto
 pool = happybase.ConnectionPool(size=2, host=DATABASE_LOCATION)
 
 dbget = Get(pool)
+dbset = Set(pool)
+if dbset.create_ban_table():
+    dbset.rebuild_ban_index()
 
 mtconn = boto.mturk.connection.MTurkConnection(aws_access_key_id=MTURK_ACCESS_ID,
                                                aws_secret_access_key=MTURK_SECRET_KEY,
                                                host=MTURK_HOST)
 
-workers = [w for w in dbget.get_all_workers()]
+# only workers in the ban index can be banned, so don't scan all of them.
+workers = dbget.get_banned_workers()
 banned_ids = filter(lambda x: dbget.worker_is_banned(x), workers)
 
 for b in banned_ids:
@@ -7,10 +7,15 @@ This script also instantiates and distributes the Mechanical Turk connection
 object (mtconn) and the HBase / HappyBase database connection object (conn).
 Thus, this is the central routing house for commands -- it coordinates requests
 and updates to data both on the database (dbget / dbset) and mturk (mturk).
+If SIMULATED_BACKENDS is True, both are in-memory stand-ins instead (see
+testing/fakehbase.py and testing/mturk_sim.py).
 
-Finally, this script exports the functions that will be executed
-asynchronously by the threadpool. It also schedules events to be run by the
-threadpool that do not need to be queued.
+Finally, this script hands the work that follows from requests to the
+functions of housekeeping.py, which are run asynchronously by the job queue
+or, if USE_DAEMON is True, by the daemon (see daemon.py); otherwise, it also
+schedules the periodic housekeeping. Even with the daemon, the webserver
+records the tasks it serves itself, since doing so costs about as much as
+handing it over would (see housekeeping.DAEMON_JOBS).
 
 NOTES:
     For the mturk connection, make sure to export the AWS connection credentials
@@ -54,7 +59,15 @@ from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.executors.pool import ThreadPoolExecutor
 import statemon
 import monitor
-import boto.ses
+import phases
+import dbpool
+import profiler
+import jobs
+import notifier
+import housekeeping
+from housekeeping import dispatch_err
+from housekeeping import dispatch_notification
+from daemon import JobTable
 import traceback
 import logging
 
@@ -62,18 +75,14 @@ import logging
 _log = logger.setup_logger(__name__)
 
 # create state monitoring variables & handle statemon
-mon = statemon.state
-statemon.define("n_tasks_generated")
-statemon.define("n_practices_generated")
-statemon.define("n_workers_banned")
-statemon.define("n_workers_unbanned")
-statemon.define("n_tasks_accepted")
-statemon.define("n_tasks_rejected")
-statemon.define("n_tasks_served")
-statemon.define("n_practices_rejected")
-statemon.define("n_practices_passed")
-statemon.define("n_errors_observed")
-statemon.define("n_unknown_errors")
+_n_tasks_accepted = statemon.define("n_tasks_accepted")
+_n_tasks_rejected = statemon.define("n_tasks_rejected")
+_n_tasks_served = statemon.define("n_tasks_served")
+_n_practices_rejected = statemon.define("n_practices_rejected")
+_n_practices_passed = statemon.define("n_practices_passed")
+_n_unknown_errors = statemon.define("n_unknown_errors")
+_ms_task = statemon.define_timer("ms_task")
+_ms_submit = statemon.define_timer("ms_submit")
 
 
 if not CONTINUOUS_MODE:
@@ -88,19 +97,31 @@ if LOCAL:
     EXTERNAL_QUESTION_SUBMISSION_ENDPOINT = 'https://127.0.0.1:12344/submit'
 # instantiate a database connection & database objects
 _log.info('Instantiating database connection')
-pool = happybase.ConnectionPool(size=8, host=DATABASE_LOCATION)
+if SIMULATED_BACKENDS:
+    from testing.fakehbase import ConnectionPool
+    from testing.mturk_sim import MTurkSimulator
+    _log.warn('Running against the simulated database and MTurk')
+    pool = dbpool.InstrumentedPool(ConnectionPool())
+    # notifications are kept rather than emailed
+    housekeeping.notifications.transport = notifier.MemoryTransport()
+else:
+    pool = dbpool.InstrumentedPool(
+        happybase.ConnectionPool(size=8, host=DATABASE_LOCATION))
 dbget = Get(pool)
 dbset = Set(pool)
 
-emconn = boto.ses.connect_to_region('us-east-1')
+housekeeping.notifications.start()
 
 # instantiate the mechanical turk connection & mturk objects
 _log.info('Instantiating mturk connection')
 
-mtconn = boto.mturk.connection.MTurkConnection(
-            aws_access_key_id=MTURK_ACCESS_ID,
-            aws_secret_access_key=MTURK_SECRET_KEY,
-            host=MTURK_HOST)
+if SIMULATED_BACKENDS:
+    mtconn = MTurkSimulator()
+else:
+    mtconn = boto.mturk.connection.MTurkConnection(
+                aws_access_key_id=MTURK_ACCESS_ID,
+                aws_secret_access_key=MTURK_SECRET_KEY,
+                host=MTURK_HOST)
 
 mt = MTurk(mtconn)
 mt.setup_quals()
@@ -110,298 +131,14 @@ executors = {'default': ThreadPoolExecutor(NUM_THREADS)}
 job_defaults = {'misfire_grace_time': 999999}
 scheduler = BackgroundScheduler(executors=executors,
                                 job_defaults=job_defaults)
+# the jobs handed off by requests, which are coalesced and prioritized
+job_queue = jobs.JobQueue(NUM_THREADS)
+# the jobs handed over to the daemon
+job_table = JobTable(pool)
 
 app = Flask(__name__)
 
 
-"""
-POOL FUNCTIONS
-"""
-
-
-def check_tasks(mt, dbget, dbset, hit_type_id):
-    """
-    Ensures that there is an appropriate number of tasks posted and active.
-
-    :param mt: A MTurk object.
-    :param dbget: A database Get object.
-    :param dbset: A database Set object.
-    :param hit_type_id: The HIT type ID, as a string.
-    :return: None.
-    """
-    _log.info('JOB STARTED check_tasks: Looking for missing tasks')
-    num_extant_hits = mt.get_all_pending_hits_of_type(
-        TASK_HIT_TYPE_ID, ids_only=True)
-    to_generate = max(NUM_TASKS - len(num_extant_hits), 0)
-    if to_generate:
-        _log.info('Building %i new tasks and posting them' % to_generate)
-        for _ in range(to_generate):
-            create_hit(mt, dbget, dbset, hit_type_id)
-
-
-def create_hit(mt, dbget, dbset, hit_type_id):
-    """
-    The background task for creating new hits, which enables us to maintain a
-    constant number of tasks at all times. Note that this should be only used
-    for generating 'real' tasks--i.e., NOT practices!
-
-    Additionally, this checks to make sure that an adequate number of images
-    have been activated.
-
-    :param mt: A MTurk object.
-    :param dbget: A database Get object.
-    :param dbset: A database Set object.
-    :param hit_type_id: The HIT type ID, as a string.
-    :return: None.
-    """
-    _log.info('JOB_STARTED create_hit')
-    _log.info('Checking image statuses')
-    dbget.update_sampling()
-    if dbget.should_halt():
-        return
-    # n_active = dbget.get_n_active_images_count(IMAGE_ATTRIBUTES)
-    # mean_seen = dbget.image_get_mean_seen(IMAGE_ATTRIBUTES)
-    # if mean_seen > MEAN_SAMPLES_REQ_PER_IMAGE(n_active):
-    #     _log.info('Images are sufficiently sampled, activating more')
-    #     dbset.activate_n_images(ACTIVATION_CHUNK_SIZE)
-    # else:
-    #     _log.info('Mean %.2f < required %.2f' % (mean_seen,
-    #                                              MEAN_SAMPLES_REQ_PER_IMAGE(
-    #                                                  n_active)))
-    hit_cost = DEFAULT_TASK_PAYMENT
-    bal = mt.get_account_balance()
-    if hit_cost > bal:
-        _log.warn('Insufficient funds to generate new tasks: %.2f cost vs. '
-                  '%.2f balance', hit_cost, bal)
-        return
-    if bal < LOW_FUNDS_WARNING:
-        dispatch_notification('Low funds: %s' % str(bal),
-                              subject="LOW BALANCE WARING")
-    _log.info('Generating a new HIT')
-    task_id, exp_seq, attribute, register_task_kwargs = \
-        dbget.gen_task(DEF_NUM_IMAGES_PER_TASK, 3,
-                       DEF_NUM_IMAGE_APPEARANCE_PER_TASK, n_keep_blocks=1,
-                       n_reject_blocks=1, hit_type_id=hit_type_id)
-    _log.info('Registering task in the database')
-    dbset.register_task(task_id, exp_seq, attribute, **register_task_kwargs)
-    _log.info('Adding task %s to mturk as hit under hit type id %s' % (
-        task_id, hit_type_id))
-    hid = mt.add_hit_to_hit_type(hit_type_id, task_id)
-    _log.info('Hit %s is ready.' % hid)
-    mon.increment("n_tasks_generated")
-
-
-def check_practices(mt, dbget, dbset, hit_type_id):
-    """
-    Checks to make sure that the practices are up, etc. If not, rebuilds them.
-
-    NOTES:
-        Right now, if the practices are all used up (but not expired!) then
-        they are not re-created. They are only re-created upon expiration.
-
-    :param mt: A MTurk object.
-    :param dbget: A database Get object.
-    :param dbset: A database Set object.
-    :param hit_type_id: The HIT type ID, as a string.
-    :return: None.
-    """
-    _log.info('JOB STARTED check_practices: Checking practices...')
-    to_generate = 0
-    practice_hits = mt.get_all_hits_of_type(hit_type_id=hit_type_id)
-    to_generate += NUM_PRACTICES - len(practice_hits)
-    tot_cost = DEFAULT_PRACTICE_PAYMENT * NUM_ASSIGNMENTS_PER_PRACTICE * \
-               to_generate
-    bal = mt.get_account_balance()
-    if tot_cost > bal:
-        _log.warn('Insufficient funds to generate practicse: %.2f cost vs. '
-                  '%.2f balance', tot_cost, bal)
-        return
-    if bal < LOW_FUNDS_WARNING:
-        dispatch_notification('Low funds: %s' % str(bal),
-                              subject="LOW BALANCE WARING")
-    for hit in practice_hits:
-        if mt.get_practice_status(hit=hit) == PRACTICE_EXPIRED:
-            _log.info('Practice %s expired' % hit.HITId)
-            # disable it
-            mt.disable_hit(hit.HITId)
-            to_generate += 1
-        elif mt.get_practice_status(hit=hit) == PRACTICE_COMPLETE:
-            _log.info('Practice %s is complete' % hit.HITId)
-            # disable it
-            mt.disable_hit(hit.HITId)
-            to_generate += 1
-    if to_generate <= 0:
-        return
-    _log.info('Need to generate %i more practices' % to_generate)
-    for _ in range(to_generate):
-        task_id, exp_seq, attribute, register_task_kwargs = \
-            dbget.gen_task(DEF_PRACTICE_NUM_IMAGES_PER_TASK, 3,
-                           DEF_NUM_IMAGE_APPEARANCE_PER_TASK, n_keep_blocks=1,
-                           n_reject_blocks=1, hit_type_id=hit_type_id,
-                           practice=True)
-        dbset.register_task(task_id, exp_seq, attribute,
-                            **register_task_kwargs)
-        mt.add_practice_hit_to_hit_type(hit_type_id, task_id)
-        mon.increment('n_practices_generated')
-
-
-def create_practice(mt, dbget, dbset, hit_type_id):
-    """
-    Mirrors the functionality of create_hit, only creates practices instead.
-
-    :param mt: A MTurk object.
-    :param dbget: A database Get object.
-    :param dbset: A database Set object.
-    :param hit_type_id: The HIT type ID, as a string.
-    :return: None.
-    """
-    _log.info('JOB_STARTED create_practice')
-    if dbget.should_halt():
-        return
-    hit_cost = DEFAULT_PRACTICE_PAYMENT
-    bal = mt.get_account_balance()
-    if hit_cost > bal:
-        _log.warn('Insufficient funds to generate new tasks: %.2f cost vs. '
-                  '%.2f balance', hit_cost, bal)
-        return
-    task_id, exp_seq, attribute, register_task_kwargs = \
-        dbget.gen_task(DEF_PRACTICE_NUM_IMAGES_PER_TASK, 3,
-                       DEF_NUM_IMAGE_APPEARANCE_PER_TASK, n_keep_blocks=1,
-                       n_reject_blocks=1, hit_type_id=hit_type_id,
-                       practice=True)
-    dbset.register_task(task_id, exp_seq, attribute,
-                        **register_task_kwargs)
-    mt.add_practice_hit_to_hit_type(hit_type_id, task_id)
-    mon.increment('n_practices_generated')
-
-
-def check_ban(mt, dbget, dbset, worker_id=None):
-    """
-    Checks to see if a worker needs to be banned
-
-    :param mt: A MTurk object.
-    :param dbget: A database Get object.
-    :param dbset: A database Set object.
-    :param worker_id: The worker ID, as a string
-    :return: None
-    """
-    _log.info('JOB STARTED check_ban')
-    if dbget.worker_autoban_check(worker_id):
-        dbset.ban_worker(worker_id)
-        try:
-            mt.ban_worker(worker_id)
-        except Exception as e:
-            tb = traceback.format_exc()
-            dispatch_err(e, tb, None)
-            return
-        dispatch_notification('Worker %s has been banned' % str(worker_id),
-                              subject="Ban notification")
-        try:
-            mon.increment('n_workers_banned')
-        except:
-            _log.warn('Could not increment statemons')
-
-
-def unban_workers(mt, dbget, dbset):
-    """
-    Designed to run periodically, checks to see the workers -- if any -- that
-    need to be unbanned.
-
-    :param mt: A MTurk object.
-    :param dbget: A database Get object.
-    :param dbset: A database Set object.
-    :return: None
-    """
-    _log.info('JOB STARTED unban_workers')
-    _log.info('Checking if any bans can be lifted...')
-    for worker_id in dbget.get_all_workers():
-        if dbget.worker_is_banned(worker_id):
-            if not dbset.worker_ban_expires_in(worker_id):
-                mt.unban_worker(worker_id)
-                dispatch_notification('Worker %s has been unbanned' % str(
-                    worker_id), subject="Unban notification")
-                try:
-                    mon.increment("n_workers_unbanned")
-                except:
-                    _log.warn('Could not increment statemons')
-
-
-def reset_worker_quotas(mt, dbget):
-    """
-    Designed to run periodically, resets all the worker completion quotas.
-
-    :param mt: A MTurk object.
-    :param dbget: A database Get object.
-    :return: None
-    """
-    _log.info('JOB STARTED reset_worker_quotas')
-    for worker_id in dbget.get_all_workers():
-        mt.reset_worker_daily_quota(worker_id)
-
-
-def reset_weekly_practices(mt, dbget):
-    """
-    Designed to run periodically, resets all the worker practice quotas.
-
-    :param mt: A MTurk object.
-    :param dbget: A database Get object.
-    :return: None
-    """
-    _log.info('JOB STARTED reset_weekly_practices')
-    for worker_id in dbget.get_all_workers():
-        mt.reset_worker_weekly_practice_quota(worker_id)
-
-
-def handle_accepted_task(dbset, task_id):
-    """
-    Handles an accepted task asynchronously, i.e., by being passed to the
-    threadpool.
-
-    :param dbset: A database Set object.
-    :param task_id: The internal task ID
-    :return: None
-    """
-    dbset.accept_task(task_id)
-
-
-def handle_reject_task(mt, dbset, worker_id, assignment_id, task_id,
-                       reason):
-    """
-    Handles a rejected task asynchronously, i.e., by being passed to the
-    threadpool.
-
-    :param mt: A MTurk object.
-    :param dbset: A database Set object.
-    :param worker_id: The worker ID
-    :param assignment_id: The MTurk assignment ID
-    :param task_id: The internal task ID
-    :param reason: The reason for the rejection
-    :return: None
-    """
-    _log.info('Soft rejection assignment %s from worker %s: %s' % (
-        assignment_id, worker_id, reason))
-    mt.soft_reject_assignment(worker_id, assignment_id, reason)
-    dbset.reject_task(task_id, reason)
-
-
-def handle_finished_hit(mt, dbget, dbset, hit_id):
-    """
-    Disables a completed task asynchronously, i.e., by being passed to the
-    threadpool.
-
-    NOTES:
-        Either an assignment_id or hit_id must be provided.
-
-    :param mt: A MTurk object.
-    :param dbget: A database Get object.
-    :param dbset: A database Set object.
-    :param hit_id: The reason for the rejection
-    :return: None
-    """
-    # mt.disable_hit(hit_id)
-    pass
-
-
 """
 HELPER FUNCTIONS
 """
@@ -412,61 +149,30 @@ def shutdown_server():
     Function to shutdown the server.
     """
     scheduler.shutdown(wait=False)
+    job_queue.stop(wait=False)
     func = request.environ.get('werkzeug.server.shutdown')
     if func is None:
         raise RuntimeError('Not running with the Werkzeug Server')
     func()
 
 
-def dispatch_err(e, tb='', request=None):
+def add_job(name, args=None, priority=jobs.PRIORITY_NORMAL, key=None,
+            count=None):
     """
-    Dispatches an error email.
+    Hands a housekeeping job over to the daemon, if USE_DAEMON is True and it
+    is one the daemon runs, or to the job queue otherwise. See
+    jobs.JobQueue.add() for the arguments.
 
-    :param e: The exception.
-    :param tb: The traceback.
-    :param request: The Flask request.
+    :param name: The name of the job, in housekeeping.JOBS.
+    :param args: Its arguments, following mt, dbget and dbset.
+    :return: None
     """
-    try:
-        mon.increment('n_errors_observed')
-    except:
-        _log.warn('Could not increment observed error count')
-    if request is not None:
-        if request.headers.getlist("X-Forwarded-For"):
-           src = request.headers.getlist("X-Forwarded-For")[0]
-        else:
-           src = request.remote_addr
-        try:
-            req_json = request.json
-        except:
-            req_json = 'No JSON'
-        try:
-            ua = str(request.user_agent)
-        except:
-            ua = 'No User Agent'
+    if USE_DAEMON and name in housekeeping.DAEMON_JOBS:
+        job_table.add(name, args, priority=priority, key=key, count=count)
     else:
-        src = 'No request'
-        req_json = 'No request'
-        ua = 'No request'
-    subj = 'MTurk Error %s' % e.message
-    body_elem = ['Error: %s' % e.message,
-                 'Traceback:\n%s' % tb,
-                 'IP: %s' % src,
-                 'User Agent: %s' % ua,
-                 'JSON: %s' % str(req_json)]
-    body = '\n\n----------------------------\n\n'.join(body_elem)
-    emconn.send_email('ops@kryto.me', subj, body,
-                      ['kryptonlabs99@gmail.com'])
-
-
-def dispatch_notification(message, subject='Notification'):
-    """
-    Dispatches a message to kryptonlabs99@gmail.com
-
-    :param message: The body of the message.
-    :param subject: The subject of the message.
-    """
-    emconn.send_email('ops@kryto.me', subject, message,
-                      ['kryptonlabs99@gmail.com'])
+        job_queue.add(housekeeping.JOBS[name],
+                      args=[mt, dbget, dbset] + list(args or []),
+                      priority=priority, key=key, count=count)
 
 
 """
@@ -477,7 +183,7 @@ FLASK FUNCTIONS
 @app.errorhandler(500)
 def internal_error(e):
     try:
-        mon.increment('n_unknown_errors')
+        _n_unknown_errors.increment()
     except:
         _log.warn('Could not increment unknown error count')
     try:
@@ -497,6 +203,21 @@ stopaddition_url = rand_id_gen(15)
 stopaddition_endpoint = 'mturk.kryto.me/%s' % stopaddition_url
 halt_url = rand_id_gen(15)
 halt_endpoint = 'mturk.kryto.me/%s' % halt_url
+profile_url = rand_id_gen(15)
+profile_endpoint = 'mturk.kryto.me/%s' % profile_url
+
+request_profiler = profiler.RequestProfiler()
+
+
+@app.before_request
+def start_request_profile():
+    if request.path != '/%s' % profile_url:
+        request_profiler.start()
+
+
+@app.teardown_request
+def stop_request_profile(exc):
+    request_profiler.stop()
 
 
 @app.route('/%s' % shutdown_url, methods=['GET', 'POST'])
@@ -554,8 +275,58 @@ def halt():
     mt.disable_all_hits_of_type()
     return 'HITs disabled, continuous mode disabled'
 
-body = 'Stop Endpoint: %s\nHalt Endpoint: %s\nShutdown Endpoint: %s\n'
-body = body % (stopaddition_endpoint, halt_endpoint, shutdown_endpoint)
+
+@app.route('/%s' % profile_url, methods=['GET', 'POST'])
+def profile():
+    """
+    Profiles the running server. With no arguments, it samples the stacks of
+    every thread and returns them as collapsed stacks, which flamegraph.pl
+    and speedscope read. The arguments are:
+
+        seconds - How long to sample for. [def: 10]
+        interval - The time between samples, in seconds. [def: 0.005]
+        by_thread - If 1, the root of each stack is its thread's name.
+        requests - If given, cProfiles the next this-many requests instead
+                   of sampling.
+        report - If 1, returns the statistics of the profiled requests
+                 instead of sampling.
+
+    :return: The collapsed stacks or the cProfile report, as plain text.
+    """
+    if request.headers.getlist("X-Forwarded-For"):
+        src = request.headers.getlist("X-Forwarded-For")[0]
+    else:
+        src = request.remote_addr
+    _log.warn('Profile request received from %s' % str(src))
+    headers = {'Content-Type': 'text/plain'}
+    try:
+        if request.values.get('report', '0') == '1':
+            report = request_profiler.report(
+                sort=request.values.get('sort', 'cumulative'))
+            if report is None:
+                return 'No requests have been profiled.', 200, headers
+            return ('%i requests profiled, %i remaining.\n\n%s' % (
+                request_profiler.n_profiled, request_profiler.remaining,
+                report), 200, headers)
+        if 'requests' in request.values:
+            n = int(request.values['requests'])
+            request_profiler.arm(n)
+            return 'Profiling the next %i requests.' % n, 200, headers
+        seconds = float(request.values.get('seconds', 10))
+        interval = float(request.values.get('interval', 0.005))
+        by_thread = request.values.get('by_thread', '0') == '1'
+    except (ValueError, KeyError) as e:
+        return 'Bad profile arguments: %s' % str(e), 400, headers
+    counts, n_samples = profiler.sample_stacks(seconds, interval, by_thread)
+    if counts is None:
+        return 'Another profile is in progress.', 409, headers
+    _log.info('Profile took %i samples', n_samples)
+    return profiler.collapse(counts), 200, headers
+
+body = 'Stop Endpoint: %s\nHalt Endpoint: %s\nShutdown Endpoint: %s\n' \
+       'Profile Endpoint: %s\n'
+body = body % (stopaddition_endpoint, halt_endpoint, shutdown_endpoint,
+               profile_endpoint)
 dispatch_notification(body, subject='Control Endpoints')
 
 
@@ -572,6 +343,8 @@ def healthcheck():
 
 
 @app.route('/task', methods=['POST', 'GET'])
+@_ms_task
+@phases.request('task')
 def task():
     """
     Accepts a request for a task, and then returns the static URLs pointing to
@@ -593,13 +366,15 @@ def task():
     if hit_id is None:
         _log.debug('Returning request to %s' % str(src))
         return make_error('Could not fetch HIT ID.')
+    phases.annotate(hit_id=hit_id)
     try:
-        val_hit_info = mtconn.get_hit(hit_id)[0]
+        with phases.phase('mturk_get_hit'):
+            val_hit_info = mtconn.get_hit(hit_id)[0]
     except:
         body = 'Unassignable HIT requested: %s'
         body = body % str(hit_id)
         subject = body
-        dispatch_notification(body, subject)
+        dispatch_notification(body, subject, key='unassignable_hit')
         return 'Could not confirm request with MTurk'
     try:
         assert val_hit_info.HITStatus == 'Unassignable'
@@ -607,10 +382,11 @@ def task():
         body = 'HIT %s accepted but is not unassignable. status: %s'
         body = body % (str(hit_id), str(val_hit_info.HITStatus))
         subject = body
-        dispatch_notification(body, subject)
+        dispatch_notification(body, subject, key='hit_not_unassignable')
         return 'Apologies, this HIT is %s' % str(val_hit_info.HITStatus)
     try:
-        hit_info = mt.get_hit(hit_id)
+        with phases.phase('get_hit'):
+            hit_info = mt.get_hit(hit_id)
         task_id = hit_info.RequesterAnnotation
     except Exception as e:
         tb = traceback.format_exc()
@@ -631,45 +407,53 @@ def task():
             _log.debug('Returning task preview request from %s' % str(src))
         return make_preview_page(is_practice, task_time)
     worker_id = request.values.get('workerId', '')
-    if dbget.worker_is_banned(worker_id):
+    phases.annotate(task_id=task_id, worker_id=worker_id)
+    with phases.phase('worker_is_banned'):
+        is_banned = dbget.worker_is_banned(worker_id)
+    if is_banned:
         body = 'Banned worker %s (ip: %s) tried to request a task or practice.'
         body = body % (worker_id, str(src))
         subject = body
-        dispatch_notification(body, subject)
+        dispatch_notification(body, subject, key='banned_worker_task')
         return 'You have been banned.'
     if is_practice:
         # check if they have the practice quota qualification
         pq_id = mt.practice_quota_id
         try:
-            mtconn.get_qualification_score(pq_id, worker_id)
+            with phases.phase('get_qualification_score'):
+                mtconn.get_qualification_score(pq_id, worker_id)
         except:  # ahh this isn't a real worker! KILL THEM!
             body = 'Unknown worker %s (ip: %s) tried to request a task or ' \
                    'practice.'
             body = body % (worker_id, str(src))
             subject = body
-            dispatch_notification(body, subject)
+            dispatch_notification(body, subject, key='unknown_worker')
             return 'Could not confirm request with MTurk.'
     else:
         # check that they have the daily quota qualification
         pt_id = mt.quota_id
         try:
-            pt_val = mtconn.get_qualification_score(pt_id, worker_id)
+            with phases.phase('get_qualification_score'):
+                pt_val = mtconn.get_qualification_score(pt_id, worker_id)
         except:  # ahh this isn't a real worker! KILL THEM!
             body = 'Unknown worker %s tried to request a task.'
             body = body % worker_id
             subject = body
-            dispatch_notification(body, subject)
+            dispatch_notification(body, subject, key='unknown_worker')
             return 'Could not confirm request with MTurk.'
         if pt_val <= 0:
             return 'You have taken as many tasks as possible today.'
         try:
-            mt.decrement_worker_daily_quota(worker_id)
+            with phases.phase('decrement_quota'):
+                mt.decrement_worker_daily_quota(worker_id)
         except Exception as e:
             _log.error('Problem decrementing daily quota: %s' % e.message)
             tb = traceback.format_exc()
             dispatch_err(e, tb, request)
     try:
-        response = fetch_task(dbget, dbset, task_id, worker_id, is_practice)
+        with phases.phase('fetch_task'):
+            response = fetch_task(dbget, dbset, task_id, worker_id,
+                                  is_practice)
     except Exception as e:
         tb = traceback.format_exc()
         dispatch_err(e, tb, request)
@@ -679,13 +463,25 @@ def task():
                                       'WORKER ID': worker_id},
                           hit_id=hit_id, task_id=task_id)
     try:
-        mon.increment("n_tasks_served")
+        with phases.phase('worker_active'):
+            dbset.worker_active(worker_id)
+    except Exception as e:
+        _log.warn('Could not record worker activity: %s' % e.message)
+    if not is_practice:
+        add_job('handle_served_task',
+                args=[task_id, worker_id, hit_id,
+                      getattr(hit_info, 'HITTypeId', None)],
+                priority=jobs.PRIORITY_HIGH)
+    try:
+        _n_tasks_served.increment()
     except Exception as e:
         _log.warn('Could not increment statemons: %s' % e.message)
     return response
 
 
 @app.route('/submit', methods=['POST', 'GET'])
+@_ms_submit
+@phases.request('submit')
 def submit():
     """
     Allows a user to submit a task, and inputs all the relevant data into the
@@ -702,16 +498,20 @@ def submit():
         worker_id = request.json[0]['workerId']
         task_id = request.json[0]['taskId']
         assignment_id = request.json[0]['assignmentId']
-        hit_info = mt.get_hit(hit_id)
+        phases.annotate(hit_id=hit_id, task_id=task_id, worker_id=worker_id)
+        with phases.phase('get_hit'):
+            hit_info = mt.get_hit(hit_id)
     except Exception as e:
         tb = traceback.format_exc()
         dispatch_err(e, tb, request)
         return make_error('Problem fetching submission information.')
-    if dbget.worker_is_banned(worker_id):
+    with phases.phase('worker_is_banned'):
+        is_banned = dbget.worker_is_banned(worker_id)
+    if is_banned:
         body = 'Banned worker %s (ip: %s) tried to submit a task or practice.'
         body = body % (worker_id, str(worker_ip))
         subject = body
-        dispatch_notification(body, subject)
+        dispatch_notification(body, subject, key='banned_worker_submit')
         return 'You have been banned.'
     err_dict = {'HIT ID': hit_id, 'WORKER ID': worker_id, 'TASK ID': task_id,
                 'ASSIGNMENT ID': assignment_id}
@@ -751,7 +551,7 @@ def submit():
                                   task_id=task_id, allow_submit=True)
             mt.grant_worker_practice_passed(worker_id)
             try:
-                mon.increment("n_practices_passed")
+                _n_practices_passed.increment()
             except Exception as e:
                 _log.warn('Could not increment statemons: %s' % e.message)
         else:
@@ -765,12 +565,13 @@ def submit():
                                   error_data=err_dict, hit_id=hit_id,
                                   task_id=task_id, allow_submit=True)
             try:
-                mon.increment("n_practices_rejected")
+                _n_practices_rejected.increment()
             except Exception as e:
                 _log.warn('Could not increment statemons: %s' % e.message)
         if CONTINUOUS_MODE:
-            scheduler.add_job(create_practice,
-                              args=[mt, dbget, dbset, hit_type_id])
+            add_job('create_practices', args=[hit_type_id],
+                    priority=jobs.PRIORITY_LOW,
+                    key=('create_practices', hit_type_id), count=1)
     else:
         # ---------- Handle submitted task ---------- #
         if dbget.worker_need_demographics(worker_id):
@@ -795,10 +596,11 @@ def submit():
                               error_data=err_dict, hit_id=hit_id,
                               task_id=task_id, allow_submit=True)
         try:
-            frac_contradictions, frac_unanswered, frac_too_fast, prob_random = \
-                dbset.task_finished_from_json(request.json,
-                                              hit_type_id=hit_type_id,
-                                              user_agent=request.user_agent)
+            with phases.phase('task_finished_from_json'):
+                frac_contradictions, frac_unanswered, frac_too_fast, \
+                    prob_random = dbset.task_finished_from_json(
+                        request.json, hit_type_id=hit_type_id,
+                        user_agent=request.user_agent)
             _log.debug('Assignment %s submitted from %s:\n\tFraction '
                        'contractions: %.2f\n\tFraction unanswered: '
                        '%.2f\n\tFraction too fast: %.2f\n\tChi Square score: '
@@ -811,12 +613,13 @@ def submit():
             dispatch_err(e, tb, request)
             return to_return
         try:
-            is_valid, reason = \
-                dbset.validate_task(task_id=None,
-                                    frac_contradictions=frac_contradictions,
-                                    frac_unanswered=frac_unanswered,
-                                    frac_too_fast=frac_too_fast,
-                                    prob_random=prob_random)
+            with phases.phase('validate_task'):
+                is_valid, reason = dbset.validate_task(
+                    task_id=None,
+                    frac_contradictions=frac_contradictions,
+                    frac_unanswered=frac_unanswered,
+                    frac_too_fast=frac_too_fast,
+                    prob_random=prob_random)
         except Exception as e:
             _log.error('Could not validate task, default to accept. Error '
                        'was: %s' % e.message)
@@ -825,31 +628,36 @@ def submit():
             is_valid = True
             reason = None
         if not is_valid:
-            scheduler.add_job(handle_reject_task,
-                              args=[mt, dbset, worker_id,
-                                    assignment_id, task_id, reason])
-            scheduler.add_job(check_ban,
-                              args=[mt, dbget, dbset, worker_id])
+            add_job('handle_reject_task',
+                    args=[worker_id, assignment_id, task_id, reason],
+                    priority=jobs.PRIORITY_HIGH)
+            add_job('check_ban', args=[worker_id],
+                    key=('check_ban', worker_id))
             try:
-                mon.increment("n_tasks_rejected")
+                _n_tasks_rejected.increment()
             except Exception as e:
                 _log.warn('Could not increment statemons: %s' % e.message)
         else:
-            scheduler.add_job(handle_accepted_task,
-                              args=[dbset, task_id])
+            add_job('handle_accepted_task', args=[task_id],
+                    priority=jobs.PRIORITY_HIGH)
             try:
-                mon.increment("n_tasks_accepted")
+                _n_tasks_accepted.increment()
             except Exception as e:
                 _log.warn('Could not increment statemons: %s' % e.message)
         if CONTINUOUS_MODE:
-            scheduler.add_job(create_hit, args=[mt, dbget, dbset, hit_type_id])
-        scheduler.add_job(handle_finished_hit, args=[mt, dbget, dbset, hit_id])
+            add_job('create_hits', args=[hit_type_id],
+                    priority=jobs.PRIORITY_LOW,
+                    key=('create_hits', hit_type_id), count=1)
+        add_job('handle_finished_hit', args=[hit_id])
     return to_return
 
 
 if __name__ == '__main__':
     webhand = logger.config_root_logger(LOG_LOCATION, return_webserver=True)
     app.logger.addHandler(webhand)
+    if SIMULATED_BACKENDS:
+        from testing.loadgen import seed_database
+        seed_database(dbset)
     # start the monitoring agent
     dbget.update_sampling()
     samp_rem = dbget._sampl_obj._get_n_samples_remaining()
@@ -858,50 +666,30 @@ if __name__ == '__main__':
     secs -= 14
     _log.info('Starting scheduler')
     scheduler.start()
+    job_queue.start()
     if not LOCAL:
         magent = monitor.MonitoringAgent()
         magent.start()
-    _log.info('Fetching hit types')
-    PRACTICE_HIT_TYPE_ID = dbget.get_active_practice_hit_type_for(
-        task_attribute=ATTRIBUTE,
-        image_attributes=IMAGE_ATTRIBUTES)
-    TASK_HIT_TYPE_ID = dbget.get_active_hit_type_for(
-        task_attribute=ATTRIBUTE,
-        image_attributes=IMAGE_ATTRIBUTES)
-    if ((not PRACTICE_HIT_TYPE_ID) or (not TASK_HIT_TYPE_ID) or TESTING or
-            FORCE_HIT_TYPE_REGEN):
-        _log.info('Calculating payment')
-        _task_payment = 0.41 #((1./60) * dbget.task_time) * PAYMENT_PER_MIN
-        task_payment = float(int(_task_payment * 100))/100
-        mins, secs = divmod(dbget.task_time, 60)
-        _log.info('Average task time is %i min, %i sec. Payment is %.2f',
-                  int(mins), int(secs), task_payment)
-        if PRACTICE_HIT_TYPE_ID:
-            dbset.deactivate_hit_type(PRACTICE_HIT_TYPE_ID)
-        if TASK_HIT_TYPE_ID:
-            dbset.deactivate_hit_type(TASK_HIT_TYPE_ID)
-        TASK_HIT_TYPE_ID, PRACTICE_HIT_TYPE_ID = \
-            mt.register_hit_type_mturk(reward=task_payment)
-        _log.info('Created new HIT Types, obtained %s and %s',
-                  PRACTICE_HIT_TYPE_ID, TASK_HIT_TYPE_ID)
-        dbset.register_hit_type(TASK_HIT_TYPE_ID, reward=task_payment)
-        dbset.register_hit_type(PRACTICE_HIT_TYPE_ID, is_practice=True)
-    if MIN_THREADS:
-        check_practices(mt, dbget, dbset, PRACTICE_HIT_TYPE_ID)
-        check_tasks(mt, dbget, dbset, TASK_HIT_TYPE_ID)
+    if USE_DAEMON:
+        # the daemon posts the HITs and runs the periodic housekeeping.
+        _log.info('Leaving the housekeeping to the daemon')
+        dbset.create_job_table()
     else:
-        scheduler.add_job(check_practices,
-                          args=[mt, dbget, dbset, PRACTICE_HIT_TYPE_ID])
-        scheduler.add_job(check_tasks,
-                          args=[mt, dbget, dbset, TASK_HIT_TYPE_ID])
-    # note that this must be done *after* the tasks are generated, since it
-    # is the tasks that actually activate new images.
-    scheduler.add_job(unban_workers, 'interval', hours=24,
-                      args=[mt, dbget, dbset], id='unban workers')
-    scheduler.add_job(reset_worker_quotas, 'cron', hour='0',
-                      args=[mt, dbget], id='task quota reset')
-    scheduler.add_job(reset_weekly_practices, 'cron', day_of_week='sun',
-                      hour='1', args=[mt, dbget], id='practice quota reset')
+        TASK_HIT_TYPE_ID, PRACTICE_HIT_TYPE_ID = \
+            housekeeping.setup_hit_types(mt, dbget, dbset)
+        if MIN_THREADS:
+            housekeeping.check_practices(mt, dbget, dbset,
+                                         PRACTICE_HIT_TYPE_ID)
+            housekeeping.check_tasks(mt, dbget, dbset, TASK_HIT_TYPE_ID)
+        else:
+            scheduler.add_job(housekeeping.check_practices,
+                              args=[mt, dbget, dbset, PRACTICE_HIT_TYPE_ID])
+            scheduler.add_job(housekeeping.check_tasks,
+                              args=[mt, dbget, dbset, TASK_HIT_TYPE_ID])
+        # note that this must be done *after* the tasks are generated, since
+        # it is the tasks that actually activate new images.
+        housekeeping.setup_indices(dbset)
+        housekeeping.schedule_periodic(scheduler, mt, dbget, dbset)
     _log.info('Tasks being served on %s' % EXTERNAL_QUESTION_ENDPOINT)
     _log.info('Starting webserver')
     if LOCAL: